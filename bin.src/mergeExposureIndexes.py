@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+#
+# LSST Data Management System
+#
+# Copyright 2016  AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+"""Merge exposure index shards into a single SQLite 3 exposure index."""
+from __future__ import print_function
+
+import argparse
+
+from lsst.daf.ingest.shardedExposureIndex import (merge_exposure_indexes,
+                                                  shard_paths)
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument("database", help="Output SQLite 3 database file name")
+parser.add_argument("shards", nargs="+",
+                    help="Shard file names, or a single shard directory")
+parser.add_argument("--allow-replace", action="store_true",
+                    help="Let exposures in later shards replace earlier ones")
+parser.add_argument("--batch-size", type=int, default=10000,
+                    help="Number of exposures stored per transaction")
+parser.add_argument("--profile", choices=("bulk-build", "append"),
+                    default="bulk-build",
+                    help="SQLite 3 tuning profile used to write the output")
+args = parser.parse_args()
+shards = args.shards
+if len(shards) == 1:
+    shards = shard_paths(shards[0]) or shards
+num_exposures = merge_exposure_indexes(shards, args.database,
+                                       args.allow_replace, args.batch_size,
+                                       args.profile)
+print("Merged {} exposures from {} shards into {}".format(
+    num_exposures, len(shards), args.database))
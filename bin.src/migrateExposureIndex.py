@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+#
+# LSST Data Management System
+#
+# Copyright 2016  AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+"""Re-key SQLite 3 exposure indexes by canonically encoded data-ids."""
+from __future__ import print_function
+
+import argparse
+
+from lsst.daf.ingest.indexExposure import migrate_data_id_codec
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument("databases", nargs="+",
+                    help="SQLite 3 exposure index file names")
+parser.add_argument("--profile", choices=("bulk-build", "append"),
+                    default="bulk-build",
+                    help="SQLite 3 tuning profile used to migrate indexes")
+args = parser.parse_args()
+for database in args.databases:
+    counts = migrate_data_id_codec(database, args.profile)
+    print("Re-keyed {rekeyed} of {exposures} exposures in {0}, removing "
+          "{duplicates} duplicates".format(database, **counts))
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+#
+# LSST Data Management System
+#
+# Copyright 2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+#
+"""Benchmark spatial exposure index queries.
+
+A SQLite 3 exposure index containing a configurable number of synthetic
+exposures (distributed uniformly at random over the sky) is built, and a
+read-only snapshot of it is written. The same set of random circular query
+regions is then run through find_intersecting_exposures,
+find_intersecting_exposures_many, an ExposureIndexReader, and an
+ExposureIndexSnapshot (memory-mapped and in-memory). Results are checked for
+equality, and the throughput of each, in queries per second, is printed.
+
+If a pixelization is given, the index also contains a pixelization index, and
+the candidate-set tightness of the R*Tree and pixelization indexes is printed.
+"""
+from __future__ import print_function
+
+import argparse
+import math
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+
+import lsst.sphgeom as sphgeom
+from lsst.daf.ingest.dataIdCodec import encode_data_id
+from lsst.daf.ingest.exposureIndexSnapshot import (
+    ExposureIndexSnapshot,
+    write_exposure_index_snapshot,
+)
+from lsst.daf.ingest.indexExposure import (
+    create_exposure_tables,
+    ExposureIndexReader,
+    ExposureInfo,
+    find_intersecting_exposures,
+    find_intersecting_exposures_many,
+    measure_candidate_tightness,
+    store_exposure_info,
+)
+
+
+def random_point(rng):
+    """Return a (longitude, latitude) pair, in degrees, uniformly distributed
+    over most of the sky.
+    """
+    return (rng.uniform(0.0, 360.0),
+            math.degrees(math.asin(rng.uniform(-0.99, 0.99))))
+
+
+def make_exposures(num_exposures, size, rng):
+    """Yield exposure information for square-ish exposures of the given
+    size (degrees) at random positions.
+    """
+    for data_id in range(num_exposures):
+        lon, lat = random_point(rng)
+        half = 0.5 * size
+        corners = [
+            sphgeom.UnitVector3d(sphgeom.LonLat.fromDegrees(
+                lon + dlon * half / math.cos(math.radians(lat)),
+                lat + dlat * half))
+            for dlon, dlat in ((-1, -1), (1, -1), (1, 1), (-1, 1))
+        ]
+        yield ExposureInfo(encode_data_id(dict(visit=data_id)),
+                           sphgeom.ConvexPolygon(corners).encode())
+
+
+def time_queries(label, results, reference=None):
+    """Time the exhaustion of `results`, an iterable over per-region query
+    results, print the query throughput, and return the sorted visits of
+    each result.
+    """
+    start = time.time()
+    visits = [sorted(info.data_id["visit"] for info in infos)
+              for infos in results]
+    elapsed = max(time.time() - start, 1e-9)
+    print("{:36s} {:12.1f} queries/s".format(label, len(visits) / elapsed))
+    if reference is not None and visits != reference:
+        raise RuntimeError(label + " results differ")
+    return visits
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--exposures", type=int, default=100000)
+    parser.add_argument("--exposure-size", type=float, default=0.25,
+                        help="Exposure width and height (degrees)")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--query-radius", type=float, default=1.0,
+                        help="Query region radius (degrees)")
+    parser.add_argument("--pixelization", choices=("htm", "q3c"),
+                        help="Pixelization index to build (optional)")
+    parser.add_argument("--level", type=int, default=7,
+                        help="Pixelization subdivision level")
+    parser.add_argument("--seed", type=int, default=12345)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    directory = tempfile.mkdtemp()
+    try:
+        database = os.path.join(directory, "index.sqlite3")
+        create_exposure_tables(database, [], args.pixelization, args.level)
+        start = time.time()
+        store_exposure_info(database, False, make_exposures(
+            args.exposures, args.exposure_size, rng))
+        print("indexed {} exposures in {:.3f} s".format(
+            args.exposures, time.time() - start))
+        start = time.time()
+        write_exposure_index_snapshot(database, os.path.join(directory, "snap"))
+        print("wrote snapshot in {:.3f} s".format(time.time() - start))
+        regions = [
+            sphgeom.Circle(
+                sphgeom.UnitVector3d(sphgeom.LonLat.fromDegrees(
+                    *random_point(rng))),
+                sphgeom.Angle.fromDegrees(args.query_radius))
+            for _ in range(args.queries)
+        ]
+        conn = sqlite3.connect(database)
+        reference = time_queries(
+            "find_intersecting_exposures",
+            (find_intersecting_exposures(conn, r) for r in regions))
+        time_queries("find_intersecting_exposures_many",
+                     find_intersecting_exposures_many(conn, regions),
+                     reference)
+        with ExposureIndexReader(conn) as reader:
+            # Run the queries twice, to measure the benefit of caching.
+            for label in ("reader (cold)", "reader (warm)"):
+                time_queries(label,
+                             reader.find_intersecting_exposures_many(regions),
+                             reference)
+        if args.pixelization is not None:
+            report = measure_candidate_tightness(conn, regions)
+            for index in sorted(report):
+                print("{:6s} index: {candidates} candidates, {results} "
+                      "results, tightness {tightness:.3f}, "
+                      "{elapsed:.3f} s".format(index, **report[index]))
+        conn.close()
+        for mmap in (True, False):
+            snapshot = ExposureIndexSnapshot(os.path.join(directory, "snap"),
+                                             mmap=mmap)
+            label = "snapshot ({})".format("mmap" if mmap else "in-memory")
+            time_queries(label,
+                         snapshot.find_intersecting_exposures_many(regions),
+                         reference)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
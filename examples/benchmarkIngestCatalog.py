@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+#
+# LSST Data Management System
+#
+# Copyright 2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+"""Benchmark catalog ingestion.
+
+A synthetic catalog with a configurable number of rows and columns is
+formatted with the original record-at-a-time code path, with the
+column-at-a-time code path used by IngestCatalogTask, and as executemany()
+parameters. The throughput of each, in rows per second, is printed.
+
+If a database host and name are given, the catalog is also ingested into a
+scratch table with each ingest mode, and end-to-end throughput is printed.
+"""
+from __future__ import print_function
+
+import argparse
+from contextlib import closing
+import time
+import uuid
+
+import numpy as np
+
+import lsst.afw.table as afw_table
+from lsst.daf.ingest.ingestCatalog import (
+    field_formatters,
+    IngestCatalogConfig,
+    IngestCatalogTask,
+)
+
+
+def make_catalog(num_rows, num_columns):
+    """Create a catalog with a mix of double, float, int and flag fields."""
+    schema = afw_table.Schema()
+    types = ("D", "F", "L", "I", "Flag")
+    keys = [schema.addField("f{}".format(i), type=types[i % len(types)],
+                            doc="benchmark field")
+            for i in range(num_columns)]
+    cat = afw_table.BaseCatalog(schema)
+    cat.reserve(num_rows)
+    for _ in range(num_rows):
+        cat.addNew()
+    cat = cat.copy(deep=True)
+    rng = np.random.RandomState(12345)
+    columns = cat.getColumnView()
+    for key, t in zip(keys, (types[i % len(types)] for i in range(num_columns))):
+        if t == "Flag":
+            for record, value in zip(cat, rng.rand(num_rows) < 0.5):
+                record.set(key, bool(value))
+        elif t in ("D", "F"):
+            values = rng.randn(num_rows)
+            values[::97] = np.nan
+            columns[key][:] = values
+        else:
+            columns[key][:] = rng.randint(-2**31, 2**31 - 1, num_rows)
+    return cat
+
+
+def format_rows_by_record(cat, items):
+    """Format rows one record and one field at a time (the original code)."""
+    keys = [(item.key, field_formatters[item.field.getTypeString()])
+            for item in items]
+    for pos in range(len(cat)):
+        row = cat[pos]
+        yield "(" + ",".join([f.format_value(row.get(k)) for (k, f) in keys]) + ")"
+
+
+def format_parameters(task, cat):
+    """Yield executemany() parameter rows for the records of a catalog."""
+    codec = task._codec(cat.schema)
+    for _, columns in task._format_columns(cat, codec.items,
+                                           codec.parameter_formats):
+        for row in zip(*columns):
+            yield row
+
+
+def time_ingest(cat, config, args):
+    """Return the time taken to ingest `cat` into a scratch table, and the
+    task counters (see IngestCatalogTask.__init__).
+    """
+    table_name = "benchmark_" + uuid.uuid4().hex
+    task = IngestCatalogTask(config=config)
+    start = time.time()
+    try:
+        task.ingest(cat, table_name, args.host, args.database,
+                    port=args.port, user=args.user)
+        return time.time() - start, task.counters
+    finally:
+        conn = IngestCatalogTask.connect(args.host, args.port,
+                                         args.database, args.user)
+        with closing(conn):
+            conn.query("DROP TABLE IF EXISTS " + table_name)
+
+
+def time_rows(rows):
+    """Return the time taken to exhaust `rows`, and the number of bytes."""
+    start = time.time()
+    num_bytes = sum(len(r) for r in rows)
+    return time.time() - start, num_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--columns", type=int, default=300)
+    parser.add_argument("--block-size", type=int, default=10000)
+    parser.add_argument("--host", help="Database hostname (optional)")
+    parser.add_argument("--database", help="Database name (optional)")
+    parser.add_argument("--port", type=int, default=3306)
+    parser.add_argument("--user", default=None)
+    args = parser.parse_args()
+
+    cat = make_catalog(args.rows, args.columns)
+    config = IngestCatalogConfig()
+    config.block_size = args.block_size
+    task = IngestCatalogTask(config=config)
+    items = task._codec(cat.schema).items
+
+    before, before_bytes = time_rows(format_rows_by_record(cat, items))
+    after, after_bytes = time_rows(task._format_rows(cat))
+    if before_bytes != after_bytes:
+        raise RuntimeError("Record and column formatting output lengths differ")
+    print("{} rows x {} columns, {} bytes of SQL values".format(
+        args.rows, args.columns, after_bytes))
+    print("record-at-a-time: {:12.1f} rows/s".format(args.rows / before))
+    print("column-at-a-time: {:12.1f} rows/s".format(args.rows / after))
+    start = time.time()
+    for _ in format_parameters(task, cat):
+        pass
+    print("parameters:       {:12.1f} rows/s".format(
+        args.rows / (time.time() - start)))
+    if args.host is None or args.database is None:
+        return
+    for ingest_mode in ("insert", "executemany", "load_data"):
+        config.ingest_mode = ingest_mode
+        elapsed, counters = time_ingest(cat, config, args)
+        print("ingest ({}): {:12.1f} rows/s".format(
+            ingest_mode, args.rows / elapsed))
+        print("    " + ", ".join(
+            "{} {:.3f} s".format(phase, counters[phase + "_time"])
+            for phase in ("ddl", "read", "format", "execute", "commit")))
+
+
+if __name__ == "__main__":
+    main()
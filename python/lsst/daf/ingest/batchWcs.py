@@ -0,0 +1,334 @@
+#
+# LSST Data Management System
+#
+# Copyright 2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+"""This module computes exposure boundary polygons for many exposures at once.
+
+:func:`.compute_polygons` maps points along the pixel-space bounding boxes
+of many exposures to the sky, and returns the convex hull of each exposure's
+points as a |polygon|. For the most common WCSes - gnomonic (``TAN``)
+projections, optionally with SIP distortion (``TAN-SIP``), described by
+|metadata| - the points of all exposures are transformed together with NumPy
+array arithmetic, avoiding a Python-level WCS call per point. Other WCSes
+fall back to per-point afw WCS evaluation.
+
+.. |metadata|      replace::  :class:`metadata <lsst.daf.base.PropertySet>`
+.. |polygon|       replace::  :class:`polygon <lsst.sphgeom.ConvexPolygon>`
+"""
+import math
+
+import numpy as np
+
+import lsst.daf.base as daf_base
+import lsst.afw.image as afw_image
+from lsst.sphgeom import ConvexPolygon, UnitVector3d
+
+
+__all__ = (
+    "boundary_positions",
+    "tan_sip_parameters",
+    "compute_polygons",
+)
+
+
+def boundary_positions(pixel_bbox, edge_samples=1):
+    """Return pixel positions along the boundary of a pixel index box.
+
+    Each edge of the box (which connects the centers of corner pixels) is
+    divided into `edge_samples` segments, and the positions of the segment
+    end-points are returned in counter-clockwise order, starting with the
+    minimum corner.
+    """
+    corners = [(afw_image.indexToPosition(c.getX()),
+                afw_image.indexToPosition(c.getY()))
+               for c in pixel_bbox.getCorners()]
+    positions = []
+    for (x0, y0), (x1, y1) in zip(corners, corners[1:] + corners[:1]):
+        positions.append((x0, y0))
+        for i in xrange(1, edge_samples):
+            t = float(i) / edge_samples
+            positions.append((x0 + t * (x1 - x0), y0 + t * (y1 - y0)))
+    return positions
+
+
+def _getter(metadata):
+    """Return a function looking up metadata values (with a default) and a
+    list of the metadata keys, for a dict or |metadata| object.
+    """
+    if isinstance(metadata, daf_base.PropertySet):
+        def get(key, default=None):
+            return metadata.get(key) if metadata.exists(key) else default
+        return get, metadata.names()
+    return metadata.get, list(metadata)
+
+
+def tan_sip_parameters(metadata):
+    """Return the parameters of a ``TAN`` or ``TAN-SIP`` WCS.
+
+    Parameters
+    ----------
+
+    metadata : lsst.daf.base.PropertySet or dict
+        FITS WCS header cards.
+
+    Returns
+    -------
+
+    dict
+        The reference pixel (``crpix``, FITS 1-based and relative to the
+        parent image origin, i.e. shifted by ``-LTV1`` and ``-LTV2`` like
+        the WCSes made by :func:`lsst.afw.image.makeWcs`), the linear
+        transformation matrix (``cd``, degrees per pixel), the reference
+        sky coordinates and the native longitude of the celestial pole
+        (``crval`` and ``lonpole``, radians), and the SIP distortion
+        coefficient matrices (``a`` and ``b``, or ``None``), or ``None`` if
+        the WCS is of another kind, or uses features not supported here
+        (e.g. ``PV`` or ``CROTA`` cards, or SIP coefficients without a
+        ``-SIP`` projection code).
+    """
+    get, names = _getter(metadata)
+    ctype1 = str(get("CTYPE1", "")).strip()
+    ctype2 = str(get("CTYPE2", "")).strip()
+    if (ctype1[:8] != "RA---TAN" or ctype2[:8] != "DEC--TAN" or
+            ctype1[8:] != ctype2[8:] or ctype1[8:] not in ("", "-SIP")):
+        return None
+    if any(n.startswith("PV") or n in ("CROTA1", "CROTA2") for n in names):
+        return None
+    if "A_ORDER" in names and not ctype1.endswith("-SIP"):
+        return None
+    for i in (1, 2):
+        if str(get("CUNIT{}".format(i), "deg")).strip() != "deg":
+            return None
+    crval = np.radians([float(get("CRVAL1")), float(get("CRVAL2"))])
+    if "LONPOLE" in names:
+        lonpole = math.radians(float(get("LONPOLE")))
+    elif abs(float(get("CRVAL2"))) < 90.0:
+        lonpole = math.pi
+    else:
+        # The default depends on conventions that vary between libraries.
+        return None
+    cd_names = ["CD{}_{}".format(i, j) for i in (1, 2) for j in (1, 2)]
+    if any(n in names for n in cd_names):
+        cd = np.array([float(get(n, 0.0)) for n in cd_names]).reshape(2, 2)
+    else:
+        pc = np.array([float(get("PC{}_{}".format(i, j), float(i == j)))
+                       for i in (1, 2) for j in (1, 2)]).reshape(2, 2)
+        cdelt = np.array([float(get("CDELT1", 1.0)),
+                          float(get("CDELT2", 1.0))])
+        cd = cdelt[:, np.newaxis] * pc
+    params = dict(
+        # The CRPIX of a subimage is relative to the subimage origin, which
+        # is at (-LTV1, -LTV2) in the parent image.
+        crpix=np.array([float(get("CRPIX1")) - float(get("LTV1", 0.0)),
+                        float(get("CRPIX2")) - float(get("LTV2", 0.0))]),
+        cd=cd,
+        crval=crval,
+        lonpole=lonpole,
+        a=None,
+        b=None,
+    )
+    if ctype1.endswith("-SIP"):
+        for prefix in ("A", "B"):
+            order = get(prefix + "_ORDER")
+            if order is None:
+                return None
+            order = int(order)
+            coeffs = np.zeros((order + 1, order + 1))
+            for p in xrange(order + 1):
+                for q in xrange(order + 1 - p):
+                    coeffs[p, q] = float(
+                        get("{}_{}_{}".format(prefix, p, q), 0.0))
+            params[prefix.lower()] = coeffs
+    return params
+
+
+def _sip(coeffs, u, v):
+    """Evaluate SIP distortion polynomials for arrays of pixel offsets.
+
+    `coeffs` has shape (N, order + 1, order + 1), and holds the coefficients
+    of the polynomial applied to each of the N offsets.
+    """
+    result = np.zeros_like(u)
+    order = coeffs.shape[1] - 1
+    for p in xrange(order + 1):
+        for q in xrange(order + 1 - p):
+            c = coeffs[:, p, q]
+            if c.any():
+                result += c * u**p * v**q
+    return result
+
+
+def _stack_sip(params, key, order):
+    """Return the SIP coefficients named `key` in a list of TAN-SIP WCS
+    parameters, zero-padded to a common order and stacked into one array.
+    """
+    coeffs = np.zeros((len(params), order + 1, order + 1))
+    for i, p in enumerate(params):
+        if p[key] is not None:
+            n = p[key].shape[0]
+            coeffs[i, :n, :n] = p[key]
+    return coeffs
+
+
+def _tan_sip_to_sky(params, counts, x, y):
+    """Map arrays of LSST (0-based) pixel positions to sky coordinates
+    (radians) using ``TAN`` or ``TAN-SIP`` WCSes.
+
+    `params` is a list of WCS parameters (see :func:`.tan_sip_parameters`),
+    and `counts` gives the number of consecutive positions each of them
+    applies to.
+    """
+    # Gather the parameters into arrays once per WCS, and then expand them
+    # to one entry per position.
+    counts = np.asarray(counts, dtype=int)
+    crpix = np.repeat(np.array([p["crpix"] for p in params]).reshape(-1, 2),
+                      counts, axis=0)
+    cd = np.repeat(np.radians(np.array([p["cd"] for p in params])
+                              .reshape(-1, 2, 2)), counts, axis=0)
+    crval = np.repeat(np.array([p["crval"] for p in params]).reshape(-1, 2),
+                      counts, axis=0)
+    lonpole = np.repeat(np.array([p["lonpole"] for p in params]), counts)
+    u = x + 1.0 - crpix[:, 0]
+    v = y + 1.0 - crpix[:, 1]
+    order = max([-1] + [max(p["a"].shape[0], p["b"].shape[0]) - 1
+                        for p in params if p["a"] is not None])
+    if order >= 0:
+        a = np.repeat(_stack_sip(params, "a", order), counts, axis=0)
+        b = np.repeat(_stack_sip(params, "b", order), counts, axis=0)
+        u, v = u + _sip(a, u, v), v + _sip(b, u, v)
+    xi = cd[:, 0, 0] * u + cd[:, 0, 1] * v
+    eta = cd[:, 1, 0] * u + cd[:, 1, 1] * v
+    # Gnomonic deprojection to native spherical coordinates, followed by a
+    # rotation to celestial coordinates (see Calabretta & Greisen 2002).
+    phi = np.arctan2(xi, -eta)
+    theta = np.arctan2(1.0, np.hypot(xi, eta))
+    sin_theta, cos_theta = np.sin(theta), np.cos(theta)
+    sin_delta_p, cos_delta_p = np.sin(crval[:, 1]), np.cos(crval[:, 1])
+    dphi = phi - lonpole
+    cos_dphi = np.cos(dphi)
+    lat = np.arcsin(np.clip(sin_theta * sin_delta_p +
+                            cos_theta * cos_delta_p * cos_dphi, -1.0, 1.0))
+    lon = crval[:, 0] + np.arctan2(
+        -cos_theta * np.sin(dphi),
+        sin_theta * cos_delta_p - cos_theta * sin_delta_p * cos_dphi)
+    return lon, lat
+
+
+def _afw_to_sky(wcs, x, y):
+    """Map arrays of pixel positions to sky coordinates (radians) using an
+    afw WCS, one point at a time.
+    """
+    lon = np.empty(len(x))
+    lat = np.empty(len(x))
+    for i in xrange(len(x)):
+        c = wcs.pixelToSky(float(x[i]), float(y[i]))
+        lon[i] = c.getLongitude().asRadians()
+        lat[i] = c.getLatitude().asRadians()
+    return lon, lat
+
+
+def compute_polygons(items, edge_samples=1):
+    """Compute the boundary polygons of many exposures.
+
+    Parameters
+    ----------
+
+    items : iterable
+        (pixel bounding box, WCS) pairs. Each bounding box is an
+        :class:`lsst.afw.geom.Box2I` of pixel indexes, and each WCS is either
+        an afw WCS object, or |metadata| (or a dict) of FITS WCS header
+        cards.
+
+    edge_samples : int
+        The number of segments each bounding box edge is divided into (see
+        :func:`.boundary_positions`).
+
+    Returns
+    -------
+
+    list
+        One |polygon| per item - the convex hull of the sky coordinates of
+        the bounding box boundary positions - or ``None`` if any of those
+        coordinates is not finite.
+    """
+    positions = []
+    fast = []
+    fast_params = []
+    lon = []
+    lat = []
+    for pixel_bbox, wcs in items:
+        xy = np.array(boundary_positions(pixel_bbox, edge_samples),
+                      dtype=float).reshape(-1, 2)
+        positions.append(xy)
+        params = None
+        if isinstance(wcs, (daf_base.PropertySet, dict)):
+            params = tan_sip_parameters(wcs)
+            if params is None:
+                wcs = afw_image.makeWcs(_property_set(wcs), False)
+        if params is not None:
+            # Defer to a single array evaluation for all such exposures.
+            fast.append(len(positions) - 1)
+            fast_params.append(params)
+            lon.append(None)
+            lat.append(None)
+        else:
+            lo, la = _afw_to_sky(wcs, xy[:, 0], xy[:, 1])
+            lon.append(lo)
+            lat.append(la)
+    if not positions:
+        return []
+    if fast:
+        xy = np.concatenate([positions[i] for i in fast])
+        counts = [len(positions[i]) for i in fast]
+        lo, la = _tan_sip_to_sky(fast_params, counts, xy[:, 0], xy[:, 1])
+        offsets = np.cumsum([0] + counts)
+        for i, begin, end in zip(fast, offsets[:-1], offsets[1:]):
+            lon[i] = lo[begin:end]
+            lat[i] = la[begin:end]
+    # Convert all sky coordinates to unit vectors, and check them for
+    # finiteness, in single array operations.
+    lon = np.concatenate(lon)
+    lat = np.concatenate(lat)
+    cos_lat = np.cos(lat)
+    vectors = np.column_stack((cos_lat * np.cos(lon),
+                               cos_lat * np.sin(lon),
+                               np.sin(lat)))
+    finite = np.isfinite(vectors).all(axis=1)
+    offsets = np.cumsum([0] + [len(xy) for xy in positions])
+    polygons = []
+    for begin, end in zip(offsets[:-1], offsets[1:]):
+        if not finite[begin:end].all():
+            polygons.append(None)
+            continue
+        polygons.append(ConvexPolygon([UnitVector3d(*v) for v in
+                                       vectors[begin:end].tolist()]))
+    return polygons
+
+
+def _property_set(metadata):
+    """Return `metadata` as a |metadata| object."""
+    if isinstance(metadata, daf_base.PropertySet):
+        return metadata
+    md = daf_base.PropertySet()
+    for key, value in sorted(metadata.iteritems()):
+        if value is not None:
+            md.set(key, value)
+    return md
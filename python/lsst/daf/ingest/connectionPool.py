@@ -0,0 +1,279 @@
+#
+# LSST Data Management System
+#
+# Copyright 2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+"""This module provides a thread-safe pool of SQLite 3 connections.
+
+:class:`.ConnectionPool` keeps open connections per database file, per
+thread (and per connection profile), so that functions given database file
+names do not pay for opening the file and parsing its schema on every call.
+The pool is bounded: idle connections are closed when they are the least
+recently used ones in a full pool, or when the thread that opened them has
+exited. The exposure index functions in :mod:`.indexExposure` use a shared
+pool.
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+import os
+import sqlite3
+import threading
+
+
+__all__ = ("ConnectionPool",)
+
+
+class _Entry(object):
+    """A pooled connection, the identity of the file it was opened on, the
+    thread that opened it, and the number of times it is in use.
+    """
+    __slots__ = ("conn", "identity", "thread", "uses")
+
+    def __init__(self, conn, identity, thread):
+        self.conn = conn
+        self.identity = identity
+        self.thread = thread
+        self.uses = 0
+
+
+def _file_identity(path):
+    """Return the device and inode numbers of a file, or ``None`` if it
+    does not exist.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_dev, st.st_ino)
+
+
+class ConnectionPool(object):
+    """A cache of SQLite 3 connections, keyed by file name, thread and
+    profile.
+
+    A connection is only ever handed out to the thread that opened it, and
+    is reused by later requests from that thread for the same file and
+    profile. Since the sqlite3 module caches prepared statements per
+    connection, reusing connections also reuses prepared statements.
+
+    At most `max_size` idle connections are kept: when the pool is full,
+    the least recently used idle connections are closed. Connections
+    opened by threads that have exited are closed too, as are connections
+    to files that have been deleted or replaced. Connections are never
+    reused by processes forked from the one that opened them, and
+    in-memory databases are never pooled.
+
+    Instances can be used as context managers, and close all pooled
+    connections on exit.
+    """
+
+    def __init__(self, initializer=None, cached_statements=256, max_size=16,
+                 transient_profiles=()):
+        """Create an empty pool.
+
+        Parameters
+        ----------
+
+        initializer : callable
+            Called with each new connection and the profile it was requested
+            with, e.g. to execute PRAGMA statements. Optional.
+
+        cached_statements : int
+            The number of prepared statements cached by each connection.
+
+        max_size : int
+            The maximum number of pooled connections that are not in use.
+
+        transient_profiles : iterable of str
+            Profiles whose connections are not pooled. They are closed when
+            released, e.g. so that writers do not share transactions, or
+            hold locks, after they are done.
+        """
+        if max_size < 0:
+            raise RuntimeError("Pool size must be non-negative")
+        self.initializer = initializer
+        self.cached_statements = cached_statements
+        self.max_size = max_size
+        self.transient_profiles = frozenset(transient_profiles)
+        self._pid = os.getpid()
+        self._entries = OrderedDict()
+        self._pooled = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def __len__(self):
+        """Return the number of pooled connections."""
+        return len(self._entries)
+
+    def _connect(self, path, profile):
+        conn = sqlite3.connect(path, check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        try:
+            if self.initializer is not None:
+                self.initializer(conn, profile)
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def acquire(self, path, profile=None):
+        """Return a connection to the SQLite 3 database file `path`.
+
+        The connection must be handed back via :meth:`.release` rather than
+        closed. Note that the same connection is returned to a thread for as
+        long as it is pooled, so callers in one thread share transactions,
+        unless `profile` is one of the pool's transient profiles.
+        """
+        if path in ("", ":memory:") or profile in self.transient_profiles:
+            return self._connect(path, profile)
+        path = os.path.abspath(path)
+        identity = _file_identity(path)
+        thread = threading.current_thread()
+        key = (thread.ident, path, profile)
+        conn = None
+        with self._lock:
+            stale = self._forget_stale()
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                if (entry.thread is thread and identity is not None and
+                        entry.identity == identity):
+                    # Mark the entry as the most recently used one.
+                    self._entries[key] = entry
+                    entry.uses += 1
+                    conn = entry.conn
+                else:
+                    # Connections that are still in use are closed when
+                    # they are released.
+                    del self._pooled[id(entry.conn)]
+                    if entry.uses == 0:
+                        stale.append(entry.conn)
+        self._close(stale)
+        if conn is not None:
+            return conn
+        conn = self._connect(path, profile)
+        if identity is None:
+            # The file did not exist, and was created by connecting (or will
+            # be by the first write).
+            identity = _file_identity(path)
+        entry = _Entry(conn, identity, thread)
+        entry.uses = 1
+        with self._lock:
+            self._entries[key] = entry
+            self._pooled[id(conn)] = key
+        return conn
+
+    def release(self, conn):
+        """Hand back a connection returned by :meth:`.acquire`.
+
+        Pooled connections are kept open (up to the pool size), and others
+        are closed.
+        """
+        with self._lock:
+            key = self._pooled.get(id(conn))
+            entry = None if key is None else self._entries.get(key)
+            if entry is None or entry.conn is not conn:
+                evicted = [conn]
+            else:
+                entry.uses = max(entry.uses - 1, 0)
+                evicted = self._evict()
+        self._close(evicted)
+
+    def _forget_stale(self):
+        """Forget pooled connections that must not be used anymore, and
+        return those that should be closed. The lock must be held.
+        """
+        if os.getpid() != self._pid:
+            # Connections must not be used across a fork, and closing them
+            # could disturb the parent's locks, so forget them.
+            self._pid = os.getpid()
+            self._entries.clear()
+            self._pooled.clear()
+            return []
+        stale = []
+        for key, entry in self._entries.items():
+            if not entry.thread.is_alive():
+                del self._entries[key]
+                del self._pooled[id(entry.conn)]
+                stale.append(entry.conn)
+        return stale
+
+    def _evict(self):
+        """Forget the least recently used idle connections while there are
+        more than `max_size` of them, and return them. The lock must be held.
+        """
+        idle = [key for key, entry in self._entries.iteritems()
+                if entry.uses == 0]
+        evicted = []
+        for key in idle[:max(len(idle) - self.max_size, 0)]:
+            entry = self._entries.pop(key)
+            del self._pooled[id(entry.conn)]
+            evicted.append(entry.conn)
+        return evicted
+
+    @staticmethod
+    def _close(conns):
+        """Close the given connections."""
+        for conn in conns:
+            conn.close()
+
+    @contextmanager
+    def connection(self, path, profile=None):
+        """Return a context manager that acquires a connection on entry,
+        and releases it on exit.
+        """
+        conn = self.acquire(path, profile)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    @contextmanager
+    def cursor(self, path, profile=None):
+        """Return a context manager that yields a cursor for a pooled
+        connection, and closes the cursor (ending any read transaction it
+        holds) on exit.
+        """
+        with self.connection(path, profile) as conn:
+            cursor = conn.cursor()
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+
+    def close(self):
+        """Close all pooled connections, in all threads.
+
+        This must not be called while other threads are using pooled
+        connections.
+        """
+        with self._lock:
+            entries = self._entries.values()
+            forked = os.getpid() != self._pid
+            self._entries.clear()
+            self._pooled.clear()
+            self._pid = os.getpid()
+        if not forked:
+            self._close(entry.conn for entry in entries)
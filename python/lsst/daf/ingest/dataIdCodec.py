@@ -0,0 +1,340 @@
+#
+# LSST Data Management System
+#
+# Copyright 2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+"""This module provides a canonical binary encoding for data-ids.
+
+Exposure indexes use encoded data-ids as unique keys, so equal data-ids must
+have identical encodings. Pickles do not guarantee this (e.g. the order of
+dict entries, the pickle protocol, and ``str`` versus ``unicode`` strings all
+affect the bytes produced), and they are comparatively large.
+
+:func:`.encode_data_id` instead produces a compact, versioned encoding in
+which dict entries are sorted, and numbers and strings that compare equal
+are encoded identically. :func:`.decode_data_id` also accepts pickles, so
+that indexes written before this encoding existed remain readable.
+
+Encoding format (version 1)
+---------------------------
+
+An encoded data-id starts with the byte ``0xdd`` (which never starts a
+pickle), followed by a version byte and a single encoded value. Each value
+starts with a type tag:
+
+``N``
+    ``None``.
+``b``, ``h``, ``i``, ``q``
+    An integer (including ``bool`` values, and ``float`` values with an
+    integral value), as a big-endian signed 1, 2, 4 or 8 byte integer. The
+    narrowest width that can represent the value is used.
+``L``
+    An integer too large for 8 bytes, as a length-prefixed decimal string.
+``d``
+    A non-integral ``float``, as a big-endian IEEE 754 double.
+``s``
+    A string, as length-prefixed UTF-8.
+``T``, ``A``
+    A tuple or list, as an element count followed by the elements.
+``D``
+    A dict, as an entry count followed by alternating keys and values,
+    sorted by encoded key.
+``P``
+    Any other value, as a length-prefixed pickle (protocol 2). Such
+    values are not canonical.
+
+Lengths and counts are unsigned LEB128 variable-length integers.
+"""
+import struct
+try:
+    import cPickle as pickle
+except:
+    import pickle
+
+
+__all__ = (
+    "DATA_ID_CODEC_VERSION",
+    "encode_data_id",
+    "decode_data_id",
+    "is_encoded_data_id",
+)
+
+
+"""Version of the data-id encoding produced by :func:`.encode_data_id`."""
+DATA_ID_CODEC_VERSION = 1
+
+"""First byte of every encoded data-id."""
+_magic = "\xdd"
+
+"""Header of data-ids encoded with the current version."""
+_header = _magic + chr(DATA_ID_CODEC_VERSION)
+
+"""Integer formats (tag and struct), from narrowest to widest."""
+_int_formats = (
+    ("b", struct.Struct(">b"), -2**7, 2**7),
+    ("h", struct.Struct(">h"), -2**15, 2**15),
+    ("i", struct.Struct(">i"), -2**31, 2**31),
+    ("q", struct.Struct(">q"), -2**63, 2**63),
+)
+
+_int_structs = dict((tag, s) for tag, s, _, _ in _int_formats)
+
+_double = struct.Struct(">d")
+
+
+def _encode_length(n, out):
+    """Append `n` as an unsigned LEB128 integer to the list `out`."""
+    while n >= 0x80:
+        out.append(chr((n & 0x7f) | 0x80))
+        n >>= 7
+    out.append(chr(n))
+
+
+def _encode_int(value, out):
+    if -0x80 <= value < 0x80:
+        out.append("b" + _int_structs["b"].pack(value))
+        return
+    for tag, s, lo, hi in _int_formats:
+        if lo <= value < hi:
+            out.append(tag + s.pack(value))
+            return
+    text = str(value)
+    out.append("L")
+    _encode_length(len(text), out)
+    out.append(text)
+
+
+def _encode_none(value, out):
+    out.append("N")
+
+
+def _encode_number(value, out):
+    _encode_int(int(value), out)
+
+
+def _encode_float(value, out):
+    if value == value and abs(value) != _infinity and value == int(value):
+        _encode_int(int(value), out)
+    else:
+        out.append("d" + _double.pack(value))
+
+
+def _encode_text(value, out):
+    if isinstance(value, unicode):
+        value = value.encode("utf-8")
+    n = len(value)
+    if n < 0x80:
+        out.append("s" + chr(n) + value)
+    else:
+        out.append("s")
+        _encode_length(n, out)
+        out.append(value)
+
+
+def _encode_sequence(value, out):
+    out.append("T" if isinstance(value, tuple) else "A")
+    _encode_length(len(value), out)
+    for v in value:
+        _encoders.get(type(v), _encode_other)(v, out)
+
+
+def _encode_dict(value, out):
+    entries = []
+    for k, v in value.iteritems():
+        key = []
+        _encoders.get(type(k), _encode_other)(k, key)
+        entries.append(("".join(key), v))
+    entries.sort()
+    out.append("D")
+    _encode_length(len(entries), out)
+    for key, v in entries:
+        out.append(key)
+        _encoders.get(type(v), _encode_other)(v, out)
+
+
+def _encode_other(value, out):
+    """Encode a value whose type is not in :data:`._encoders`, e.g. an
+    instance of a subclass of a supported type.
+    """
+    for t, encoder in _encoders.iteritems():
+        if isinstance(value, t):
+            encoder(value, out)
+            return
+    data = pickle.dumps(value, 2)
+    out.append("P")
+    _encode_length(len(data), out)
+    out.append(data)
+
+
+_infinity = float("inf")
+
+"""Value encoders, by type. Each appends the encoding of a value to a list.
+"""
+_encoders = {
+    type(None): _encode_none,
+    bool: _encode_number,
+    int: _encode_number,
+    long: _encode_number,
+    float: _encode_float,
+    str: _encode_text,
+    unicode: _encode_text,
+    tuple: _encode_sequence,
+    list: _encode_sequence,
+    dict: _encode_dict,
+}
+
+
+def encode_data_id(data_id):
+    """Return the canonical binary encoding of a data-id, as a str.
+
+    Data-ids are typically dicts mapping str keys to int, float or str
+    values, but any combination of ``None``, numbers, strings, tuples, lists
+    and dicts has a canonical encoding. Other values are pickled.
+    """
+    out = [_header]
+    _encoders.get(type(data_id), _encode_other)(data_id, out)
+    return "".join(out)
+
+
+def is_encoded_data_id(data):
+    """Return ``True`` if `data` was produced by :func:`.encode_data_id`
+    (rather than being a pickle).
+    """
+    return data[:1] == _magic
+
+
+def _decode_length(data, pos):
+    n = ord(data[pos])
+    pos += 1
+    if n < 0x80:
+        return n, pos
+    n &= 0x7f
+    shift = 7
+    while True:
+        b = ord(data[pos])
+        pos += 1
+        n |= (b & 0x7f) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+
+def _decode_text(data, pos):
+    n, pos = _decode_length(data, pos)
+    end = pos + n
+    text = data[pos:end]
+    try:
+        text.decode("ascii")
+    except UnicodeDecodeError:
+        try:
+            text = text.decode("utf-8")
+        except UnicodeDecodeError:
+            # A str holding arbitrary bytes.
+            pass
+    return text, end
+
+
+def _int_decoder(s):
+    unpack_from = s.unpack_from
+    size = s.size
+
+    def decode(data, pos):
+        return unpack_from(data, pos)[0], pos + size
+    return decode
+
+
+def _decode_none(data, pos):
+    return None, pos
+
+
+def _decode_double(data, pos):
+    return _double.unpack_from(data, pos)[0], pos + _double.size
+
+
+def _decode_dict(data, pos):
+    n, pos = _decode_length(data, pos)
+    result = {}
+    for _ in xrange(n):
+        key, pos = _decoders[data[pos]](data, pos + 1)
+        result[key], pos = _decoders[data[pos]](data, pos + 1)
+    return result, pos
+
+
+def _decode_list(data, pos):
+    n, pos = _decode_length(data, pos)
+    result = []
+    for _ in xrange(n):
+        value, pos = _decoders[data[pos]](data, pos + 1)
+        result.append(value)
+    return result, pos
+
+
+def _decode_tuple(data, pos):
+    result, pos = _decode_list(data, pos)
+    return tuple(result), pos
+
+
+def _decode_long(data, pos):
+    text, pos = _decode_text(data, pos)
+    return int(text), pos
+
+
+def _decode_pickle(data, pos):
+    n, pos = _decode_length(data, pos)
+    return pickle.loads(data[pos:pos + n]), pos + n
+
+
+"""Value decoders, by type tag. Each takes the encoded data and the position
+following the tag, and returns the value and the position following it."""
+_decoders = dict(
+    N=_decode_none,
+    L=_decode_long,
+    d=_decode_double,
+    s=_decode_text,
+    T=_decode_tuple,
+    A=_decode_list,
+    D=_decode_dict,
+    P=_decode_pickle,
+)
+_decoders.update((tag, _int_decoder(s)) for tag, s in _int_structs.items())
+
+
+def decode_data_id(data):
+    """Return the data-id encoded by :func:`.encode_data_id`, or pickled, in
+    the str (or buffer) `data`.
+    """
+    data = str(data)
+    if data[:2] != _header:
+        if not is_encoded_data_id(data):
+            return pickle.loads(data)
+        raise RuntimeError("Unsupported data-id encoding version {}".format(
+            ord(data[1:2] or "\0")))
+    try:
+        value, pos = _decoders[data[2]](data, 3)
+    except KeyError, e:
+        raise RuntimeError(
+            "Invalid encoded data-id type tag {!r}".format(e.args[0]))
+    except (IndexError, struct.error):
+        raise RuntimeError("Truncated encoded data-id")
+    if pos > len(data):
+        raise RuntimeError("Truncated encoded data-id")
+    if pos != len(data):
+        raise RuntimeError("Trailing bytes after encoded data-id")
+    return value
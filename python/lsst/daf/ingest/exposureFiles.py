@@ -0,0 +1,273 @@
+#
+# LSST Data Management System
+#
+# Copyright 2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+"""This module provides butler-free access to exposure files in a repository.
+
+:func:`.find_exposure_files` walks a data repository and recovers data-ids
+from file paths using a butler mapper path template, and
+:func:`.read_fits_header` reads selected FITS header cards without reading
+pixel data or building a full |metadata| object. Together, they allow
+exposures to be indexed in bulk (see :meth:`.IndexExposureTask.index_files`).
+
+.. |metadata|      replace::  :class:`metadata <lsst.daf.base.PropertySet>`
+"""
+import hashlib
+import os
+import re
+
+
+__all__ = (
+    "read_fits_header",
+    "fits_header_checksum",
+    "find_exposure_files",
+)
+
+
+"""Size of a FITS header or data block, in bytes."""
+_block_size = 2880
+
+"""Size of a FITS header card, in bytes."""
+_card_size = 80
+
+"""Header keywords needed to locate the header of the image HDU."""
+_structural_keywords = frozenset([
+    "NAXIS", "EXTEND", "ZIMAGE", "ZNAXIS1", "ZNAXIS2",
+])
+
+
+def _parse_value(text):
+    """Parse the value field of a FITS header card.
+
+    Strings, logicals, integers and reals are supported. ``None`` is
+    returned for undefined values, and the raw text for anything else
+    (e.g. complex values).
+    """
+    text = text.lstrip()
+    if text.startswith("'"):
+        # Quotes inside strings are escaped by doubling them.
+        chars = []
+        i = 1
+        while i < len(text):
+            if text[i] == "'":
+                if text[i + 1:i + 2] != "'":
+                    break
+                i += 1
+            chars.append(text[i])
+            i += 1
+        return "".join(chars).rstrip()
+    text = text.split("/", 1)[0].strip()
+    if text == "":
+        return None
+    if text in ("T", "F"):
+        return text == "T"
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        return float(text.replace("D", "E"))
+    except ValueError:
+        return text
+
+
+def _read_hdu_header(f, wanted, digest=None):
+    """Read the header of the HDU starting at the current position of `f`.
+
+    Returns a dict of the values of the keywords for which `wanted` returns
+    ``True``, or ``None`` if there are no more HDUs. If `digest` is not
+    ``None``, it is updated with the raw header blocks.
+    """
+    header = {}
+    while True:
+        block = f.read(_block_size)
+        if len(block) == 0:
+            return None
+        if len(block) != _block_size:
+            raise RuntimeError("Truncated FITS header in {}".format(f.name))
+        if digest is not None:
+            digest.update(block)
+        for i in xrange(0, _block_size, _card_size):
+            keyword = block[i:i + 8].rstrip()
+            if keyword == "END":
+                return header
+            if block[i + 8:i + 10] == "= " and wanted(keyword):
+                header[keyword] = _parse_value(block[i + 10:i + _card_size])
+
+
+def _read_image_header(path, wanted, digest=None):
+    """Read the header of the image HDU of a FITS file (see
+    :func:`.read_fits_header`).
+    """
+    with open(path, "rb") as f:
+        header = _read_hdu_header(f, wanted, digest)
+        if header is None:
+            raise RuntimeError("{} is not a FITS file".format(path))
+        # An empty primary HDU has no data blocks, so the first extension
+        # header (if any) follows immediately.
+        if header.get("NAXIS", 0) == 0 and header.get("EXTEND", False):
+            extension = _read_hdu_header(f, wanted, digest)
+            if extension is not None:
+                header.update(extension)
+    return header
+
+
+def read_fits_header(path, pattern=None):
+    """Read selected header cards of the image HDU of a FITS file.
+
+    The image HDU is the primary HDU, unless the primary HDU has no data, in
+    which case it is the first extension (the layout of afw exposures). In
+    the latter case, primary header cards not present in the extension
+    header are included as well. For tile-compressed images, the image
+    dimensions are reported as ``NAXIS1`` and ``NAXIS2``.
+
+    Only header blocks are read, and only the values of selected cards are
+    parsed.
+
+    Parameters
+    ----------
+
+    path : str
+        The name of a FITS file.
+
+    pattern : str or regular expression object
+        A regular expression matching the keywords to read, or ``None`` to
+        read all keywords.
+
+    Returns
+    -------
+
+    dict
+        A mapping from keyword to value. Commentary cards (e.g. ``COMMENT``
+        or ``HISTORY``) are not included.
+    """
+    if pattern is None:
+        def wanted(keyword):
+            return True
+    else:
+        match = re.compile(pattern).match
+
+        def wanted(keyword):
+            return keyword in _structural_keywords or match(keyword)
+    header = _read_image_header(path, wanted)
+    if header.get("ZIMAGE", False):
+        for i in (1, 2):
+            if "ZNAXIS{}".format(i) in header:
+                header["NAXIS{}".format(i)] = header["ZNAXIS{}".format(i)]
+    if pattern is not None:
+        header = dict(item for item in header.iteritems() if match(item[0]))
+    return header
+
+
+def fits_header_checksum(path):
+    """Return a checksum of the raw header blocks of the image HDU of a FITS
+    file (see :func:`.read_fits_header`), as a hexadecimal string.
+
+    No header card values are parsed, and no data blocks are read.
+    """
+    digest = hashlib.md5()
+    _read_image_header(path, _structural_keywords.__contains__, digest)
+    return digest.hexdigest()
+
+
+"""Matches %-style conversions of named values in butler path templates."""
+_template_conversion = re.compile(
+    r"%\((?P<key>\w+)\)(?P<flags>[-#0 +]*\d*(?:\.\d+)?)(?P<type>[diufFeEs])")
+
+"""Regular expressions and types for template conversions, by type code."""
+_template_types = dict(
+    d=(r"[-+]?\d+", int),
+    i=(r"[-+]?\d+", int),
+    u=(r"[-+]?\d+", int),
+    f=(r"[-+]?[0-9.eE+-]+", float),
+    F=(r"[-+]?[0-9.eE+-]+", float),
+    e=(r"[-+]?[0-9.eE+-]+", float),
+    E=(r"[-+]?[0-9.eE+-]+", float),
+    s=(r"[^/]+?", str),
+)
+
+
+def _compile_template(template):
+    """Convert a butler path template to a regular expression.
+
+    Returns the compiled expression, and a mapping from data-id key to the
+    type of its values.
+    """
+    regex = []
+    types = {}
+    pos = 0
+    for m in _template_conversion.finditer(template):
+        regex.append(re.escape(template[pos:m.start()]))
+        key = m.group("key")
+        value_regex, value_type = _template_types[m.group("type")]
+        if key in types:
+            # Repeated keys must have the same value everywhere.
+            regex.append("(?P={})".format(key))
+        else:
+            regex.append("(?P<{}>{})".format(key, value_regex))
+            types[key] = value_type
+        pos = m.end()
+    regex.append(re.escape(template[pos:]))
+    return re.compile("".join(regex) + "$"), types
+
+
+def find_exposure_files(root, template):
+    """Find the files of a dataset in a data repository.
+
+    Parameters
+    ----------
+
+    root : str
+        The root directory of the data repository.
+
+    template : str
+        The path template of the dataset relative to `root`, as given by a
+        butler mapper policy, e.g. ``"calexp/v%(visit)d-f%(filter)s/c%(ccd)02d.fits"``.
+        Path components are separated by ``/``.
+
+    Returns
+    -------
+
+        A generator yielding a (path, data-id) pair for every file matching
+        `template`, in sorted path order. Data-ids are dicts mapping the keys
+        in `template` to values of the type implied by their conversion
+        specifiers (``int`` for ``%d``, ``float`` for ``%f``, and ``str`` for
+        ``%s``).
+    """
+    regex, types = _compile_template(template)
+    depth = template.count("/")
+    root = os.path.normpath(root)
+    for dir_path, dir_names, file_names in os.walk(root):
+        rel_dir = os.path.relpath(dir_path, root)
+        rel_depth = 0 if rel_dir == "." else rel_dir.count(os.sep) + 1
+        dir_names.sort()
+        if rel_depth >= depth:
+            # No file deeper than the template can match.
+            del dir_names[:]
+        if rel_depth != depth:
+            continue
+        for file_name in sorted(file_names):
+            rel_path = os.path.join(rel_dir, file_name) if rel_depth else file_name
+            m = regex.match(rel_path.replace(os.sep, "/"))
+            if m is None:
+                continue
+            data_id = dict((k, types[k](v)) for k, v in m.groupdict().iteritems())
+            yield os.path.join(dir_path, file_name), data_id
@@ -0,0 +1,214 @@
+#
+# LSST Data Management System
+#
+# Copyright 2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+"""This module provides read-only snapshots of SQLite 3 exposure indexes.
+
+A snapshot of an exposure index (see :mod:`.indexExposure`) is a directory of
+NumPy arrays holding exposure rowids, 3-D bounding boxes, and packed encoded
+data-ids (see :mod:`.dataIdCodec`) and |encoded| |polygon| objects.
+Snapshots are written by :func:`.write_exposure_index_snapshot` and queried
+via :class:`.ExposureIndexSnapshot`, which memory-maps the arrays, so that
+the operating system shares a single copy of a snapshot between all
+processes that query it.
+
+.. |encoded|       replace::  :meth:`encoded <lsst.sphgeom.Region.encode>`
+.. |polygon|       replace::  :class:`polygon <lsst.sphgeom.ConvexPolygon>`
+"""
+
+import os
+
+import numpy as np
+
+from lsst.sphgeom import ConvexPolygon, DISJOINT
+from lsst.daf.ingest.dataIdCodec import decode_data_id
+from lsst.daf.ingest.indexExposure import ExposureInfo, _connect, _release
+from lsst.daf.ingest.lruCache import LruCache
+
+
+__all__ = (
+    "write_exposure_index_snapshot",
+    "ExposureIndexSnapshot",
+)
+
+
+"""Names of the arrays in a snapshot directory, each stored as <name>.npy."""
+_array_names = (
+    "row_ids",
+    "boxes",
+    "data_ids",
+    "data_id_offsets",
+    "polygons",
+    "polygon_offsets",
+)
+
+
+def _pack(strings):
+    """Pack a list of strings into a byte array and an array of offsets.
+
+    String ``i`` is stored in elements ``offsets[i]:offsets[i + 1]`` of the
+    byte array.
+    """
+    offsets = np.zeros(len(strings) + 1, dtype=np.int64)
+    np.cumsum([len(s) for s in strings], out=offsets[1:])
+    return np.frombuffer("".join(strings), dtype=np.uint8), offsets
+
+
+def write_exposure_index_snapshot(database, directory):
+    """Write a read-only snapshot of an exposure index.
+
+    Parameters
+    ----------
+
+    database : sqlite3.Connection or str
+        A connection to (or filename of) a SQLite 3 database containing
+        an exposure index.
+
+    directory : str
+        The directory to write the snapshot arrays to. It is created if
+        necessary, and existing snapshot arrays in it are overwritten.
+
+    Returns
+    -------
+
+    int
+        The number of exposures in the snapshot.
+    """
+    conn = _connect(database, "serve")
+    try:
+        # The bounding boxes are read from the R*Tree rather than computed
+        # from the polygons, so that snapshot queries compare exactly the
+        # same (single precision) values as R*Tree queries.
+        rows = conn.execute(
+            "SELECT rowid, pickled_data_id, encoded_polygon,\n"
+            "       x_min, x_max, y_min, y_max, z_min, z_max\n"
+            "FROM exposure JOIN exposure_rtree USING (rowid)\n"
+            "ORDER BY rowid"
+        ).fetchall()
+    finally:
+        _release(conn, database)
+    arrays = dict(
+        row_ids=np.array([r[0] for r in rows], dtype=np.int64),
+        boxes=np.array([r[3:] for r in rows], dtype=np.float64).reshape(
+            len(rows), 6),
+    )
+    # Note that in Python 2, BLOB columns are mapped to Python buffer
+    # objects, and so a conversion to str is necessary.
+    arrays["data_ids"], arrays["data_id_offsets"] = _pack(
+        [str(r[1]) for r in rows])
+    arrays["polygons"], arrays["polygon_offsets"] = _pack(
+        [str(r[2]) for r in rows])
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    for name in _array_names:
+        np.save(os.path.join(directory, name + ".npy"), arrays[name])
+    return len(rows)
+
+
+class ExposureIndexSnapshot(object):
+    """A read-only, memory-mappable snapshot of an exposure index.
+
+    Queries first select candidate exposures with a vectorized comparison of
+    the query region bounding box against all exposure bounding boxes (the
+    same comparison an R*Tree query performs), and then decode the candidate
+    polygons and check them against the query region exactly. Results
+    therefore match those of :func:`.find_intersecting_exposures` for the
+    database the snapshot was written from.
+
+    Decoded exposures are kept in a bounded least-recently-used cache.
+    """
+
+    def __init__(self, directory, mmap=True, cache_size=10000):
+        """Open a snapshot written by :func:`.write_exposure_index_snapshot`.
+
+        Parameters
+        ----------
+
+        directory : str
+            The snapshot directory.
+
+        mmap : bool
+            If ``True``, memory-map the snapshot arrays (read-only) rather
+            than reading them into memory.
+
+        cache_size : int
+            Maximum number of decoded exposures to cache.
+        """
+        mmap_mode = "r" if mmap else None
+        for name in _array_names:
+            setattr(self, name, np.load(os.path.join(directory, name + ".npy"),
+                                        mmap_mode=mmap_mode))
+        if self.boxes.shape != (len(self.row_ids), 6):
+            raise RuntimeError("Invalid exposure index snapshot in {}".format(
+                directory))
+        self._cache = LruCache(cache_size)
+
+    def __len__(self):
+        """Return the number of exposures in the snapshot."""
+        return len(self.row_ids)
+
+    def candidates(self, region):
+        """Return the indexes of exposures with bounding boxes intersecting
+        the bounding box of `region`.
+        """
+        bbox = region.getBoundingBox3d()
+        boxes = self.boxes
+        mask = ((boxes[:, 0] < bbox.x().getB()) &
+                (boxes[:, 1] > bbox.x().getA()) &
+                (boxes[:, 2] < bbox.y().getB()) &
+                (boxes[:, 3] > bbox.y().getA()) &
+                (boxes[:, 4] < bbox.z().getB()) &
+                (boxes[:, 5] > bbox.z().getA()))
+        return np.flatnonzero(mask)
+
+    def exposure_info(self, i):
+        """Return an :class:`.ExposureInfo` for the exposure at index `i`,
+        with a decoded data-id and polygon.
+        """
+        info = self._cache.get(i)
+        if info is None:
+            begin, end = self.data_id_offsets[i:i + 2]
+            data_id = decode_data_id(self.data_ids[begin:end].tostring())
+            begin, end = self.polygon_offsets[i:i + 2]
+            polygon = ConvexPolygon.decode(self.polygons[begin:end].tostring())
+            info = ExposureInfo(data_id, polygon)
+            self._cache.put(i, info)
+        return info
+
+    def find_intersecting_exposures(self, region):
+        """Find exposures that intersect a spherical region.
+
+        See :func:`.find_intersecting_exposures`.
+        """
+        results = []
+        for i in self.candidates(region):
+            info = self.exposure_info(int(i))
+            if region.relate(info.boundary) != DISJOINT:
+                results.append(info)
+        return results
+
+    def find_intersecting_exposures_many(self, regions):
+        """Find the exposures that intersect each of a sequence of regions.
+
+        See :func:`.find_intersecting_exposures_many`.
+        """
+        for region in regions:
+            yield self.find_intersecting_exposures(region)
@@ -24,32 +24,50 @@
 
 :class:`.IndexExposureTask` extracts the WCS from an input exposure and uses
 it to compute a corresponding spherical bounding polygon. The exposure data-id
-and bounding polygon are then written to an SQLite 3 database.  Fast spatial
-queries are supported by maintaining an `R*Tree`_ index over exposures.
+and bounding polygon are then written to an SQLite 3 database, with the
+data-id in a canonical binary encoding (see :mod:`.dataIdCodec`). Fast
+spatial queries are supported by maintaining an `R*Tree`_ index over
+exposures.
+For query-heavy workloads, an index can also be exported to a read-only,
+memory-mappable snapshot (see :mod:`.exposureIndexSnapshot`). Bounding
+polygons of exposures with ``TAN`` or ``TAN-SIP`` WCSes are computed with
+vectorized NumPy arithmetic, many exposures at a time when indexing files in
+bulk (see :mod:`.batchWcs`).
 
 .. _`R*Tree`:      https://www.sqlite.org/rtree.html
 
 .. |allow_replace| replace::  :attr:`~.IndexExposureConfig.allow_replace`
 .. |configuration| replace::  :class:`configuration <.IndexExposureConfig>`
+.. |data_id_columns| replace:: :attr:`~.IndexExposureConfig.data_id_columns`
 .. |defer_writes|  replace::  :attr:`~.IndexExposureConfig.defer_writes`
+.. |edge_samples|  replace::  :attr:`~.IndexExposureConfig.edge_samples`
 .. |encoded|       replace::  :meth:`encoded <lsst.sphgeom.Region.encode>`
 .. |exposure|      replace::  :class:`exposure <lsst.afw.image.ExposureF>`
+.. |incremental|   replace::  :attr:`~.IndexExposureConfig.incremental`
 .. |metadata|      replace::  :class:`metadata <lsst.daf.base.PropertySet>`
 .. |pad_pixels|    replace::  :attr:`~.IndexExposureConfig.pad_pixels`
+.. |pixelization|  replace::  :attr:`~.IndexExposureConfig.pixelization`
 .. |polygon|       replace::  :class:`polygon <lsst.sphgeom.ConvexPolygon>`
 .. |run|           replace::  :meth:`~.IndexExposureTask.run`
 .. |runner|        replace::  :class:`runner <.IndexExposureRunner>`
+.. |sqlite_profile| replace:: :attr:`~.IndexExposureConfig.sqlite_profile`
 .. |task|          replace::  :class:`~lsst.pipe.base.Task`
+.. |write_batch_size| replace:: :attr:`~.IndexExposureConfig.write_batch_size`
 """
 
 from collections import namedtuple
-import math
+from itertools import chain, imap, islice
+import json
+import multiprocessing
+import os
 try:
     import cPickle as pickle
 except:
     import pickle
+import re
 import sqlite3
 import sys
+import time
 import traceback
 
 import lsst.daf.base as daf_base
@@ -58,15 +76,37 @@ import lsst.afw.image as afw_image
 import lsst.pex.config as pex_config
 import lsst.pipe.base as pipe_base
 from lsst.log import Log
-from lsst.sphgeom import Angle, ConvexPolygon, DISJOINT, UnitVector3d
+from lsst.sphgeom import (ConvexPolygon, DISJOINT, HtmPixelization,
+                          Q3cPixelization)
+from lsst.daf.ingest.batchWcs import compute_polygons
+from lsst.daf.ingest.connectionPool import ConnectionPool
+from lsst.daf.ingest.dataIdCodec import (DATA_ID_CODEC_VERSION,
+                                         decode_data_id,
+                                         encode_data_id,
+                                         is_encoded_data_id)
+from lsst.daf.ingest.exposureFiles import (find_exposure_files,
+                                           fits_header_checksum,
+                                           read_fits_header)
+from lsst.daf.ingest.lruCache import LruCache
 
 
 __all__ = (
     "quote_sqlite3_identifier",
+    "sqlite_profiles",
+    "apply_sqlite_profile",
+    "connection_pool",
     "create_exposure_tables",
+    "get_pixelization",
     "ExposureInfo",
+    "ExposureSource",
+    "get_exposure_source",
     "store_exposure_info",
     "find_intersecting_exposures",
+    "find_intersecting_exposures_many",
+    "ExposureIndexReader",
+    "measure_candidate_tightness",
+    "measure_missed_results",
+    "migrate_data_id_codec",
     "IndexExposureConfig",
     "IndexExposureRunner",
     "IndexExposureTask",
@@ -96,31 +136,148 @@ def quote_sqlite3_identifier(s):
     return '"' + ident.replace('"', '""') + '"'
 
 
-def create_exposure_tables(database, init_statements=[]):
+"""PRAGMA statements tuning SQLite 3 connections for a workload, by name.
+
+``"bulk-build"`` is for building (or rebuilding) an index in one pass, with
+no concurrent readers: durability is traded for speed, and the database is
+locked for as long as the writing connection is open. ``"append"`` is for
+adding exposures to an index that is being queried: write-ahead logging lets
+readers proceed while exposures are stored. ``"serve"`` is for query
+connections, which memory-map the database file. It does not make
+connections read-only, since exposures may be stored via the connection of
+an :class:`.ExposureIndexReader` (use ``PRAGMA query_only`` for that).
+
+Write-ahead logging is a persistent property of a database file, so indexes
+written with either writer profile can be read concurrently with later
+appends.
+"""
+sqlite_profiles = {
+    "bulk-build": (
+        "PRAGMA locking_mode = EXCLUSIVE",
+        "PRAGMA journal_mode = WAL",
+        "PRAGMA synchronous = OFF",
+        "PRAGMA cache_size = -262144",
+        "PRAGMA temp_store = MEMORY",
+    ),
+    "append": (
+        "PRAGMA journal_mode = WAL",
+        "PRAGMA synchronous = NORMAL",
+        "PRAGMA cache_size = -65536",
+        "PRAGMA temp_store = MEMORY",
+    ),
+    "serve": (
+        "PRAGMA mmap_size = 1073741824",
+        "PRAGMA cache_size = -65536",
+    ),
+}
+
+
+def apply_sqlite_profile(conn, profile):
+    """Execute the PRAGMA statements of a named profile (see
+    :data:`.sqlite_profiles`) on a SQLite 3 connection.
+
+    ``None`` is a profile with no statements.
+    """
+    if profile is None:
+        return
+    if profile not in sqlite_profiles:
+        raise RuntimeError("Unknown SQLite 3 profile {}".format(profile))
+    for statement in sqlite_profiles[profile]:
+        conn.execute(statement).fetchall()
+
+
+"""Pixelizations that can be used to index exposures, by name."""
+_pixelizations = dict(htm=HtmPixelization, q3c=Q3cPixelization)
+
+
+def create_exposure_tables(database, init_statements=[],
+                           pixelization=None, level=None,
+                           data_id_columns=None, profile="append"):
     """Create SQLite 3 exposure index tables.
 
     One table, ``exposure``, contains exposure data-ids and boundaries,
     and the other, ``exposure_rtree``, is an `R*Tree`_ of 3-D exposure
-    bounding boxes.
+    bounding boxes. A table of index properties, ``exposure_index_metadata``,
+    is created as well.
+
+    A table of the files exposures were read from, ``exposure_source``,
+    allows unchanged exposures to be skipped when re-indexing (see
+    :func:`.get_exposure_source`).
+
+    Exposures are keyed by their canonically encoded data-ids (see
+    :mod:`.dataIdCodec`), which are stored in the ``pickled_data_id``
+    column. The column name is kept for compatibility with indexes created
+    before the encoding existed, which keep using pickled data-ids until
+    they are converted with :func:`.migrate_data_id_codec`.
+
+    In addition to an encoded data-id, the ``exposure`` table can contain one
+    indexed column per data-id key (see :func:`.find_intersecting_exposures`
+    for how to use them). These typed data-id columns are given by
+    `data_id_columns` or, if it is empty, inferred from the first stored
+    data-id (here if the index already contains exposures, and otherwise by
+    :func:`.store_exposure_info`). Indexes created before typed data-id
+    columns existed are migrated: the columns are added and filled in from
+    the stored data-ids.
+
+    If a `pixelization` is given, a pixelization index is created too: the
+    ``exposure_pixel`` table contains the ids of the pixels (at the given
+    subdivision `level`) that cover each exposure, and is indexed by pixel
+    id. If the exposure index already exists but has no pixelization index,
+    one is created and filled in for all previously stored exposures.
 
     Parameters
     ----------
 
     database : sqlite3.Connection or str
-        A connection to (or filename of) a SQLite 3 database.
+        A connection to (or filename of) a SQLite 3 database. Transactions
+        are committed on a given connection, including any changes the
+        caller has not committed yet. Given a file name, a connection that
+        is not shared with any other caller is used (see
+        :data:`.connection_pool`), unless `profile` is ``"serve"``.
 
     init_statements : iterable
         A series of database initialization statements (strings) to execute.
+        They are executed after those of `profile`, and so can override them.
+
+    pixelization : str
+        ``"htm"``, ``"q3c"``, or ``None``.
+
+    level : int
+        The subdivision level of the pixelization.
+
+    data_id_columns : dict or list
+        A mapping from data-id key to SQLite 3 column type (or a list of
+        key, type pairs), or ``None``.
+
+    profile : str
+        The name of the :data:`.sqlite_profiles` entry applied if `database`
+        is a file name.
 
     .. _`R*Tree`:      https://www.sqlite.org/rtree.html
     """
-    if isinstance(database, sqlite3.Connection):
-        conn = database
-    else:
-        conn = sqlite3.connect(database)
+    if pixelization is not None:
+        if pixelization not in _pixelizations:
+            raise RuntimeError(
+                "Unknown pixelization {}".format(pixelization))
+        if level is None:
+            raise RuntimeError("A pixelization level must be specified")
+    conn = _connect(database, profile)
+    try:
+        _create_exposure_tables(conn, init_statements, pixelization, level,
+                                data_id_columns)
+    finally:
+        _release(conn, database)
+
+
+def _create_exposure_tables(conn, init_statements, pixelization, level,
+                            data_id_columns):
+    """Create exposure index tables using an open connection (see
+    :func:`.create_exposure_tables`).
+    """
     with conn:
         for statement in init_statements:
             conn.execute(statement)
+        _create_metadata_table(conn)
         conn.execute(
             'CREATE VIRTUAL TABLE IF NOT EXISTS exposure_rtree USING rtree(\n'
             '    rowid,\n'
@@ -136,98 +293,668 @@ def create_exposure_tables(database, init_statements=[]):
             '    encoded_polygon BLOB NOT NULL\n'
             ')'
         )
+        _create_source_table(conn)
+        _get_data_id_encoder(conn)
+        _ensure_data_id_columns(conn, data_id_columns)
+        existing = _get_metadata(conn, 'pixelization', 'pixelization_level')
+        if pixelization is None or existing == (pixelization, level):
+            return
+        if existing[0] is not None:
+            raise RuntimeError(
+                'The exposure index already has a {} level {} '
+                'pixelization index'.format(*existing))
+        conn.execute(
+            'CREATE TABLE exposure_pixel (\n'
+            '    pixel INTEGER NOT NULL,\n'
+            '    exposure_id INTEGER NOT NULL,\n'
+            '    PRIMARY KEY (pixel, exposure_id)\n'
+            ')'
+        )
+        conn.execute(
+            'CREATE INDEX exposure_pixel_exposure_id\n'
+            '    ON exposure_pixel (exposure_id)'
+        )
+        conn.executemany(
+            'INSERT INTO exposure_index_metadata (name, value) VALUES (?, ?)',
+            [('pixelization', pixelization), ('pixelization_level', level)]
+        )
+        _store_pixels(conn, _pixelizations[pixelization](level),
+                      'SELECT rowid, encoded_polygon FROM exposure')
+
+
+def _create_metadata_table(conn):
+    """Create the table of exposure index properties, if necessary."""
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS exposure_index_metadata (\n'
+        '    name TEXT PRIMARY KEY,\n'
+        '    value NOT NULL\n'
+        ')'
+    )
+
+
+def _create_source_table(conn):
+    """Create the table of exposure source files, if necessary."""
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS exposure_source (\n'
+        '    path TEXT PRIMARY KEY,\n'
+        '    pickled_data_id BLOB NOT NULL,\n'
+        '    size INTEGER NOT NULL,\n'
+        '    mtime REAL NOT NULL,\n'
+        '    checksum TEXT\n'
+        ')'
+    )
+
+
+def _has_table(conn, name):
+    """Return ``True`` if the database contains a table with the given name.
+    """
+    return conn.execute(
+        "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = ?",
+        (name,)
+    ).fetchone()[0] > 0
+
+
+def _get_metadata(conn, *names):
+    """Return a tuple of the values of the given exposure index properties.
+
+    The value of a property that is not set (or of any property, if the
+    index predates the property table) is ``None``.
+    """
+    if not _has_table(conn, 'exposure_index_metadata'):
+        return (None,) * len(names)
+    values = dict(conn.execute(
+        'SELECT name, value FROM exposure_index_metadata\n'
+        'WHERE name IN ({})'.format(', '.join(['?'] * len(names))), names))
+    return tuple(values.get(name) for name in names)
+
+
+def _legacy_encode_data_id(data_id):
+    """Encode a data-id for an index that has not been migrated to the
+    canonical data-id encoding, i.e. pickle it.
+    """
+    return pickle.dumps(data_id)
+
+
+def _get_data_id_encoder(conn):
+    """Return the function used to encode data-ids for an exposure index.
+
+    Empty indexes use :func:`.encode_data_id` (and record this), while
+    indexes that already contain pickled data-ids keep using pickles until
+    they are migrated (see :func:`.migrate_data_id_codec`).
+    """
+    version = _get_metadata(conn, 'data_id_codec')[0]
+    if version is None:
+        if conn.execute('SELECT COUNT(*) FROM exposure').fetchone()[0] > 0:
+            return _legacy_encode_data_id
+        _create_metadata_table(conn)
+        with conn:
+            conn.execute(
+                'INSERT INTO exposure_index_metadata (name, value)\n'
+                'VALUES (?, ?)', ('data_id_codec', DATA_ID_CODEC_VERSION))
+    elif version != DATA_ID_CODEC_VERSION:
+        raise RuntimeError(
+            'Unsupported data-id encoding version {}'.format(version))
+    return encode_data_id
+
+
+def get_pixelization(database):
+    """Return the pixelization used to index exposures in a database.
+
+    Parameters
+    ----------
+
+    database : sqlite3.Connection or str
+        A connection to (or filename of) a SQLite 3 database containing
+        an exposure index.
+
+    Returns
+    -------
+
+    lsst.sphgeom.Pixelization
+        A :class:`~lsst.sphgeom.HtmPixelization` or
+        :class:`~lsst.sphgeom.Q3cPixelization`, or ``None`` if the index
+        has no pixelization index.
+    """
+    conn = _connect(database, "serve")
+    try:
+        name, level = _get_metadata(conn, 'pixelization', 'pixelization_level')
+    finally:
+        _release(conn, database)
+    if name is None:
+        return None
+    return _pixelizations[name](level)
+
+
+"""SQLite 3 column types for data-id values, by Python type."""
+_data_id_column_types = (
+    (bool, 'INTEGER'),
+    (int, 'INTEGER'),
+    (long, 'INTEGER'),
+    (float, 'REAL'),
+    (basestring, 'TEXT'),
+)
+
+
+def _infer_data_id_columns(data_id):
+    """Return (key, type) pairs for the typed data-id columns of an index
+    containing `data_id`.
+
+    Only dict data-ids have keys. Keys with values of types that do not map
+    to SQLite 3 column types are ignored.
+    """
+    columns = []
+    if isinstance(data_id, dict):
+        for key in sorted(data_id):
+            for python_type, column_type in _data_id_column_types:
+                if isinstance(data_id[key], python_type):
+                    columns.append((key, column_type))
+                    break
+    return columns
+
+
+def _data_id_values(data_id, keys):
+    """Return a tuple of the values of the given data-id keys.
+
+    The value of a key that is missing from `data_id` is ``None``.
+    """
+    if not isinstance(data_id, dict):
+        return (None,) * len(keys)
+    return tuple(data_id.get(key) for key in keys)
+
+
+def _get_data_id_columns(conn):
+    """Return the (key, type) pairs of the typed data-id columns of an
+    exposure index.
+    """
+    value = _get_metadata(conn, 'data_id_columns')[0]
+    if value is None:
+        return []
+    return [tuple(c) for c in json.loads(value)]
+
+
+def _ensure_data_id_columns(conn, columns=None, data_id=None):
+    """Return the typed data-id columns of an exposure index, adding them
+    first if the index has none.
+
+    Columns are taken from `columns` (a mapping from key to column type, or
+    a list of key, type pairs) if it is not empty, and are otherwise
+    inferred from the data-id of a stored exposure or, if there are none,
+    from `data_id`.
+    """
+    if isinstance(columns, dict):
+        columns = sorted(columns.iteritems())
+    columns = [tuple(c) for c in columns or []]
+    existing = _get_data_id_columns(conn)
+    if existing:
+        if columns and columns != existing:
+            raise RuntimeError(
+                'The exposure index already has data-id columns {}'.format(
+                    ', '.join('{} {}'.format(*c) for c in existing)))
+        return existing
+    if not columns:
+        row = conn.execute(
+            'SELECT pickled_data_id FROM exposure LIMIT 1').fetchone()
+        if row is not None:
+            columns = _infer_data_id_columns(decode_data_id(row[0]))
+        elif data_id is not None:
+            columns = _infer_data_id_columns(data_id)
+    if columns:
+        _add_data_id_columns(conn, columns)
+    return columns
+
+
+def _add_data_id_columns(conn, columns):
+    """Add typed data-id columns to the ``exposure`` table.
+
+    An index is created for each column, and the column values of existing
+    exposures are filled in from their stored data-ids.
+    """
+    for key, column_type in columns:
+        if key.lower() in ('rowid', 'pickled_data_id', 'encoded_polygon'):
+            raise RuntimeError(
+                'Data-id key {} clashes with an exposure table column'.format(
+                    key))
+    _create_metadata_table(conn)
+    # Columns may already exist if a previous migration was interrupted.
+    existing = set(row[1] for row in conn.execute('PRAGMA table_info(exposure)'))
+    for key, column_type in columns:
+        column = quote_sqlite3_identifier(key)
+        if key not in existing:
+            conn.execute('ALTER TABLE exposure ADD COLUMN {} {}'.format(
+                column, column_type))
+        conn.execute('CREATE INDEX IF NOT EXISTS {} ON exposure ({})'.format(
+            quote_sqlite3_identifier('exposure_' + key), column))
+    keys = [key for key, _ in columns]
+    with conn:
+        rows = conn.execute(
+            'SELECT rowid, pickled_data_id FROM exposure').fetchall()
+        conn.executemany(
+            'UPDATE exposure SET {} WHERE rowid = ?'.format(', '.join(
+                quote_sqlite3_identifier(key) + ' = ?' for key in keys)),
+            (_data_id_values(decode_data_id(data_id), keys) + (row_id,)
+             for row_id, data_id in rows)
+        )
+        conn.execute(
+            'INSERT OR REPLACE INTO exposure_index_metadata (name, value)\n'
+            'VALUES (?, ?)', ('data_id_columns', json.dumps(columns)))
+
+
+def _constraint_clauses(constraints, columns):
+    """Return SQL clauses and parameters for constraints on data-id keys.
+
+    Parameters
+    ----------
+
+    constraints : dict
+        A mapping from data-id key to a constraint on its value: a tuple
+        ``(min, max)`` requires ``min <= value <= max`` (a bound of ``None``
+        is ignored), a list or set requires the value to be one of its
+        elements, and anything else requires the value to be equal to it.
+
+    columns : list
+        The (key, type) pairs of the typed data-id columns of the index.
+        The ``exposure`` table is referred to as ``e``.
+
+    Returns
+    -------
+
+        A list of SQL clauses and a list of their parameters.
+    """
+    keys = set(key for key, _ in columns)
+    clauses = []
+    params = []
+    for key in sorted(constraints):
+        if key not in keys:
+            raise RuntimeError(
+                'The exposure index has no data-id column for {}'.format(key))
+        column = 'e.' + quote_sqlite3_identifier(key)
+        value = constraints[key]
+        if isinstance(value, tuple):
+            lower, upper = value
+            if lower is not None:
+                clauses.append(column + ' >= ?')
+                params.append(lower)
+            if upper is not None:
+                clauses.append(column + ' <= ?')
+                params.append(upper)
+        elif isinstance(value, (list, set, frozenset)):
+            values = list(value)
+            clauses.append('{} IN ({})'.format(
+                column, ', '.join(['?'] * len(values))))
+            params.extend(values)
+        else:
+            clauses.append(column + ' = ?')
+            params.append(value)
+    return clauses, params
+
+
+def _store_pixels(conn, pixelization, query):
+    """Store the pixels covering exposures in the ``exposure_pixel`` table.
+
+    Parameters
+    ----------
+
+    conn : sqlite3.Connection
+        A connection to a SQLite 3 database containing an exposure index.
+
+    pixelization : lsst.sphgeom.Pixelization
+        The pixelization of the index.
+
+    query : str
+        A query for the rowids and encoded polygons of the exposures to
+        store pixels for.
+    """
+    def rows():
+        # Pixels are only inserted into exposure_pixel, so reading exposures
+        # while inserting is safe.
+        for row_id, encoded_polygon in conn.execute(query):
+            poly = ConvexPolygon.decode(str(encoded_polygon))
+            for begin, end in pixelization.envelope(poly):
+                for pixel in xrange(begin, end):
+                    yield pixel, row_id
+
+    conn.executemany(
+        'INSERT INTO exposure_pixel (pixel, exposure_id) VALUES (?, ?)',
+        rows()
+    )
+
+
+"""Information about an exposure: a data-id, a boundary, and (optionally)
+an :class:`.ExposureSource` describing the file it was read from."""
+ExposureInfo = namedtuple('ExposureInfo', ['data_id', 'boundary', 'source'])
+ExposureInfo.__new__.__defaults__ = (None,)
+
+"""The fingerprint of an exposure file: its path, size in bytes,
+modification time, and an optional header checksum."""
+ExposureSource = namedtuple('ExposureSource',
+                            ['path', 'size', 'mtime', 'checksum'])
+
+
+def get_exposure_source(path, checksum=False):
+    """Return an :class:`.ExposureSource` for an exposure file.
+
+    If `checksum` is ``True``, a checksum of the raw FITS header of the file
+    is computed (see :func:`.fits_header_checksum`).
+    """
+    st = os.stat(path)
+    return ExposureSource(path, st.st_size, st.st_mtime,
+                          fits_header_checksum(path) if checksum else None)
+
+
+class _SourceFilter(object):
+    """Selects exposure files that are new or have changed since they were
+    last stored in an exposure index.
+
+    A file is unchanged if its size and modification time match the stored
+    ones, or, when checksums are used, if its header checksum matches the
+    stored one. In the latter case, the stored size and modification time
+    are updated by :meth:`.update`, so that the header is not read again.
+    """
+
+    def __init__(self, database, checksum=False, profile="append"):
+        conn = _connect(database, profile)
+        try:
+            _create_source_table(conn)
+            self.known = dict(
+                (row[0], ExposureSource(*row)) for row in conn.execute(
+                    'SELECT path, size, mtime, checksum FROM exposure_source'))
+        finally:
+            _release(conn, database)
+        self.checksum = checksum
+        self.profile = profile
+        self.touched = []
+        self.num_skipped = 0
+
+    def source(self, path):
+        """Return an :class:`.ExposureSource` for `path` if it is new or
+        has changed, and ``None`` otherwise.
+        """
+        known = self.known.get(path)
+        source = get_exposure_source(path)
+        if known is not None and known[1:3] == source[1:3]:
+            self.num_skipped += 1
+            return None
+        if self.checksum:
+            source = source._replace(checksum=fits_header_checksum(path))
+            if known is not None and known.checksum == source.checksum:
+                self.touched.append(source)
+                self.num_skipped += 1
+                return None
+        return source
+
+    def update(self, database):
+        """Store the fingerprints of files that changed, but whose header
+        checksums did not.
+        """
+        if not self.touched:
+            return
+        conn = _connect(database, self.profile)
+        try:
+            with conn:
+                conn.executemany(
+                    'UPDATE exposure_source SET size = ?, mtime = ?\n'
+                    'WHERE path = ?',
+                    [(s.size, s.mtime, s.path) for s in self.touched]
+                )
+        finally:
+            _release(conn, database)
+        del self.touched[:]
+
+
+"""The pool of connections used by functions given database file names.
 
+Read connections (``"serve"`` profile) are reused by later calls from the
+same thread, so the cost of opening a database and parsing its schema is
+only paid once per thread. At most 16 idle connections are kept open. Write
+connections (``"bulk-build"`` and ``"append"`` profiles) are not pooled:
+each writer gets its own connection, which is closed when it is done, so
+that writes never share a transaction with (or commit pending writes of)
+other users of the pool. Call ``connection_pool.close()`` to close all
+pooled connections.
+"""
+connection_pool = ConnectionPool(apply_sqlite_profile,
+                                 transient_profiles=("bulk-build", "append"))
+
+
+def _connect(database, profile=None, **kwargs):
+    """Return `database` if it is a SQLite 3 connection, and a connection to
+    the database with that file name otherwise.
+
+    Connections are tuned with the given :data:`.sqlite_profiles` entry, and
+    taken from :data:`.connection_pool`, unless `kwargs` (which are passed to
+    :func:`sqlite3.connect`) are given. They must be handed back via
+    :func:`._release`.
+    """
+    if isinstance(database, sqlite3.Connection):
+        return database
+    if not kwargs:
+        return connection_pool.acquire(database, profile)
+    conn = sqlite3.connect(database, **kwargs)
+    try:
+        apply_sqlite_profile(conn, profile)
+    except Exception:
+        conn.close()
+        raise
+    return conn
+
+
+def _release(conn, database):
+    """Hand back a connection returned by :func:`._connect` for `database`.
+    """
+    if conn is not database:
+        connection_pool.release(conn)
 
-ExposureInfo = namedtuple('ExposureInfo', ['data_id', 'boundary'])
 
+def _exposure_rows(exposure_info, keys, encode):
+    """Yield rows of the ``exposure_staging`` table for exposure information.
 
-def store_exposure_info(database, allow_replace, exposure_info):
+    Each row contains a data-id encoded with `encode`, an encoded polygon,
+    the 3-D bounding box of the polygon, the exposure source file
+    fingerprint (or NULLs), and the values of the given data-id keys.
+    ``None`` entries are skipped.
+    """
+    for info in exposure_info:
+        if info is None:
+            continue
+        bbox = ConvexPolygon.decode(info.boundary).getBoundingBox3d()
+        x, y, z = bbox.x(), bbox.y(), bbox.z()
+        # Data-ids that are already canonically encoded are stored as is,
+        # and all others are re-keyed, so that equal data-ids always have
+        # equal keys.
+        data_id = None
+        encoded = info.data_id
+        if encode is not encode_data_id or not is_encoded_data_id(encoded):
+            data_id = decode_data_id(encoded)
+            encoded = encode(data_id)
+        # In Python 2, the sqlite3 module maps between Python buffer
+        # objects and BLOBs. When migrating to Python 3, the buffer()
+        # calls should be removed (sqlite3 maps bytes objects to BLOBs).
+        row = (buffer(encoded), buffer(info.boundary),
+               x.getA(), x.getB(), y.getA(), y.getB(), z.getA(), z.getB())
+        row += info.source or (None,) * len(ExposureSource._fields)
+        if keys:
+            if data_id is None:
+                data_id = decode_data_id(encoded)
+            row += _data_id_values(data_id, keys)
+        yield row
+
+
+def store_exposure_info(database, allow_replace, exposure_info,
+                        batch_size=0, profile="append"):
     """Store exposure data-ids and bounding polygons in the given database.
 
     The database is assumed to have been initialized via
     :func:`.create_exposure_tables`.
 
+    All exposures are first bulk inserted into a temporary staging table.
+    The ``exposure`` and ``exposure_rtree`` tables are then updated from it
+    with a handful of set-based statements, in a single transaction (or in
+    one transaction per batch, if `batch_size` is positive).
+
     Parameters
     ----------
 
     database : sqlite3.Connection or str
-        A connection to (or filename of) a SQLite 3 database.
+        A connection to (or filename of) a SQLite 3 database. Transactions
+        are committed on a given connection, including any changes the
+        caller has not committed yet. Given a file name, a connection that
+        is not shared with any other caller is used (see
+        :data:`.connection_pool`), unless `profile` is ``"serve"``.
 
     allow_replace : bool
         If ``True``, information for previously stored exposures with matching
-        data-ids will be overwritten.
+        data-ids will be overwritten (and if the same data-id occurs more than
+        once in `exposure_info`, the last occurrence is stored). Otherwise,
+        storing an exposure with the same data-id as an existing one raises
+        :class:`sqlite3.IntegrityError`, and nothing is stored.
 
     exposure_info : iterable or lsst.daf.ingest.indexExposure.ExposureInfo
         One or more :class:`.ExposureInfo` objects to persist. Their
-        ``data_id`` attributes must be pickled data-ids, and their
-        ``boundary`` attributes must be |encoded| |polygon| objects.
+        ``data_id`` attributes must be encoded (or pickled) data-ids, and
+        their ``boundary`` attributes must be |encoded| |polygon| objects.
+        Source file fingerprints (``source`` attributes) that are not
+        ``None`` are stored in the ``exposure_source`` table. Data-ids are
+        re-encoded as necessary, so that equal data-ids are always stored
+        with identical keys.
+
+    batch_size : int
+        If positive, `exposure_info` is consumed and stored in batches of
+        at most this many entries, each in its own transaction. This bounds
+        memory usage for arbitrarily long generators of exposure information,
+        and batches stored before a failure remain stored.
+
+    profile : str
+        The name of the :data:`.sqlite_profiles` entry applied if `database`
+        is a file name. Use ``"bulk-build"`` when there are no concurrent
+        readers or writers.
     """
-    if isinstance(database, sqlite3.Connection):
-        conn = database
+    if isinstance(exposure_info, ExposureInfo):
+        exposure_info = (exposure_info,)
+    conn = _connect(database, profile)
+    try:
+        if batch_size <= 0:
+            _store_exposure_info(conn, allow_replace, exposure_info)
+            return
+        exposure_info = iter(exposure_info)
+        while True:
+            batch = list(islice(exposure_info, batch_size))
+            if not batch:
+                return
+            _store_exposure_info(conn, allow_replace, batch)
+    finally:
+        _release(conn, database)
+
+
+def _store_exposure_info(conn, allow_replace, exposure_info):
+    """Store exposure information in a single transaction using an open
+    connection (see :func:`.store_exposure_info`).
+    """
+    pixelization = get_pixelization(conn)
+    # Find the first exposure, from which typed data-id columns are inferred
+    # if the index has none yet.
+    exposure_info = iter(exposure_info)
+    for first in exposure_info:
+        if first is not None:
+            break
     else:
-        conn = sqlite3.connect(database)
+        return
+    exposure_info = chain((first,), exposure_info)
+    encode = _get_data_id_encoder(conn)
+    columns = _ensure_data_id_columns(conn,
+                                      data_id=decode_data_id(first.data_id))
+    keys = [key for key, _ in columns]
+    data_id_columns = ''.join(', ' + quote_sqlite3_identifier(key)
+                              for key in keys)
+    staged_data_id_columns = ''.join(', s.' + quote_sqlite3_identifier(key)
+                                     for key in keys)
+    # Create the staging table before any data is modified, since the
+    # sqlite3 module implicitly commits before executing DDL.
+    _create_source_table(conn)
+    conn.execute('DROP TABLE IF EXISTS temp.exposure_staging')
+    conn.execute(
+        'CREATE TEMP TABLE exposure_staging (\n'
+        '    pickled_data_id BLOB NOT NULL,\n'
+        '    encoded_polygon BLOB NOT NULL,\n'
+        '    x_min REAL, x_max REAL,\n'
+        '    y_min REAL, y_max REAL,\n'
+        '    z_min REAL, z_max REAL,\n'
+        '    path TEXT, size INTEGER, mtime REAL, checksum TEXT' +
+        ''.join(',\n    {} {}'.format(quote_sqlite3_identifier(key), t)
+                for key, t in columns) +
+        '\n)'
+    )
     with conn:
-        cursor = conn.cursor()
-        if isinstance(exposure_info, ExposureInfo):
-            exposure_info = (exposure_info,)
-        # Insert or update information in database
-        for info in exposure_info:
-            if info is None:
-                continue
-            # In Python 2, the sqlite3 module maps between Python buffer
-            # objects and BLOBs. When migrating to Python 3, the buffer()
-            # calls should be removed (sqlite3 maps bytes objects to BLOBs).
-            pickled_data_id = buffer(info.data_id)
-            encoded_polygon = buffer(info.boundary)
-            bbox = ConvexPolygon.decode(info.boundary).getBoundingBox3d()
-            if allow_replace:
-                # See if there is already an entry for the given data id.
-                cursor.execute(
-                    'SELECT rowid FROM exposure WHERE pickled_data_id = ?',
-                    (pickled_data_id,)
-                )
-                results = cursor.fetchall()
-                if len(results) > 0:
-                    # If so, update spatial information for the exposure.
-                    row_id = results[0][0]
-                    cursor.execute(
-                        'UPDATE exposure\n'
-                        '    SET encoded_polygon = ?\n'
-                        '    WHERE rowid = ?',
-                        (encoded_polygon, row_id)
-                    )
-                    cursor.execute(
-                        'UPDATE exposure_rtree SET\n'
-                        '    x_min = ?, x_max = ?,\n'
-                        '    y_min = ?, y_max = ?,\n'
-                        '    z_min = ?, z_max = ?\n'
-                        'WHERE rowid = ?',
-                        (bbox.x().getA(), bbox.x().getB(),
-                         bbox.y().getA(), bbox.y().getB(),
-                         bbox.z().getA(), bbox.z().getB(),
-                         row_id)
-                    )
-                    return
-            # Insert the data id and corresponding spatial information.
-            cursor.execute(
+        conn.executemany(
+            'INSERT INTO exposure_staging VALUES ({})'.format(
+                ', '.join(['?'] * (12 + len(keys)))),
+            _exposure_rows(exposure_info, keys, encode)
+        )
+        if allow_replace:
+            # Only keep the last occurrence of each data id.
+            conn.execute(
+                'DELETE FROM exposure_staging WHERE rowid NOT IN (\n'
+                '    SELECT MAX(rowid) FROM exposure_staging\n'
+                '    GROUP BY pickled_data_id\n'
+                ')'
+            )
+            # Remove the bounding boxes of exposures that will be replaced,
+            # and then replace their polygons, keeping their rowids.
+            conn.execute(
+                'DELETE FROM exposure_rtree WHERE rowid IN (\n'
+                '    SELECT e.rowid\n'
+                '    FROM exposure_staging AS s JOIN exposure AS e\n'
+                '        ON (e.pickled_data_id = s.pickled_data_id)\n'
+                ')'
+            )
+            conn.execute(
+                'INSERT OR REPLACE INTO exposure\n'
+                '    (rowid, pickled_data_id, encoded_polygon{0})\n'
+                'SELECT e.rowid, s.pickled_data_id, s.encoded_polygon{1}\n'
+                'FROM exposure_staging AS s LEFT JOIN exposure AS e\n'
+                '    ON (e.pickled_data_id = s.pickled_data_id)\n'
+                'ORDER BY s.rowid'.format(
+                    data_id_columns, staged_data_id_columns)
+            )
+        else:
+            conn.execute(
                 'INSERT INTO exposure\n'
-                '    (pickled_data_id, encoded_polygon)\n'
-                '    VALUES (?, ?)',
-                (pickled_data_id, encoded_polygon)
+                '    (pickled_data_id, encoded_polygon{0})\n'
+                'SELECT pickled_data_id, encoded_polygon{0}\n'
+                'FROM exposure_staging ORDER BY rowid'.format(data_id_columns)
             )
-            row_id = cursor.lastrowid
-            cursor.execute(
-                'INSERT INTO exposure_rtree\n'
-                '     (rowid, x_min, x_max, y_min, y_max, z_min, z_max)\n'
-                '     VALUES (?, ?, ?, ?, ?, ?, ?)',
-                (row_id,
-                 bbox.x().getA(), bbox.x().getB(),
-                 bbox.y().getA(), bbox.y().getB(),
-                 bbox.z().getA(), bbox.z().getB())
+        conn.execute(
+            'INSERT INTO exposure_rtree\n'
+            '    (rowid, x_min, x_max, y_min, y_max, z_min, z_max)\n'
+            'SELECT e.rowid, s.x_min, s.x_max, s.y_min, s.y_max,\n'
+            '       s.z_min, s.z_max\n'
+            'FROM exposure_staging AS s JOIN exposure AS e\n'
+            '    ON (e.pickled_data_id = s.pickled_data_id)'
+        )
+        if pixelization is not None:
+            if allow_replace:
+                conn.execute(
+                    'DELETE FROM exposure_pixel WHERE exposure_id IN (\n'
+                    '    SELECT e.rowid\n'
+                    '    FROM exposure_staging AS s JOIN exposure AS e\n'
+                    '        ON (e.pickled_data_id = s.pickled_data_id)\n'
+                    ')'
+                )
+            _store_pixels(
+                conn, pixelization,
+                'SELECT e.rowid, s.encoded_polygon\n'
+                'FROM exposure_staging AS s JOIN exposure AS e\n'
+                '    ON (e.pickled_data_id = s.pickled_data_id)'
             )
+        conn.execute(
+            'INSERT OR REPLACE INTO exposure_source\n'
+            '    (path, pickled_data_id, size, mtime, checksum)\n'
+            'SELECT path, pickled_data_id, size, mtime, checksum\n'
+            'FROM exposure_staging WHERE path IS NOT NULL'
+        )
+        conn.execute('DELETE FROM exposure_staging')
 
 
-def find_intersecting_exposures(database, region):
+def find_intersecting_exposures(database, region, constraints=None):
     """Find exposures that intersect a spherical region.
 
     Parameters
@@ -240,6 +967,15 @@ def find_intersecting_exposures(database, region):
     region : lsst.sphgeom.Region
         The spherical region of interest.
 
+    constraints : dict
+        Optional constraints on data-id values, e.g. ``dict(filter='r')``
+        or ``dict(visit=(1000, 2000))``. Each key must have a typed data-id
+        column (see :func:`.create_exposure_tables`). A tuple ``(min, max)``
+        matches values in the inclusive range (a bound of ``None`` is
+        ignored), a list or set matches any of its elements, and other
+        values match themselves. Constraints are evaluated by the database,
+        so exposures that do not satisfy them are never decoded.
+
     Returns
     -------
 
@@ -249,29 +985,448 @@ def find_intersecting_exposures(database, region):
         the corresponding exposure, and their ``boundary`` attributes
         are |polygon| objects.
     """
-    if isinstance(database, sqlite3.Connection):
-        conn = database
-    else:
-        conn = sqlite3.connect(database)
-    query = ("SELECT pickled_data_id, encoded_polygon\n"
-             "FROM exposure JOIN exposure_rtree USING (rowid)\n"
-             "WHERE x_min < ? AND x_max > ? AND\n"
-             "      y_min < ? AND y_max > ? AND\n"
-             "      z_min < ? AND z_max > ?")
-    bbox = region.getBoundingBox3d()
-    params = (bbox.x().getB(), bbox.x().getA(),
-              bbox.y().getB(), bbox.y().getA(),
-              bbox.z().getB(), bbox.z().getA())
-    results = []
-    for row in conn.execute(query, params):
-        # Note that in Python 2, BLOB columns are mapped to Python buffer
-        # objects, and so a conversion to str is necessary. In Python 3,
-        # BLOBs are mapped to bytes directly, and the str() calls must
-        # be removed.
-        poly = ConvexPolygon.decode(str(row[1]))
-        if region.relate(poly) != DISJOINT:
-            results.append(ExposureInfo(pickle.loads(str(row[0])), poly))
-    return results
+    return next(find_intersecting_exposures_many(database, [region],
+                                                 constraints=constraints))
+
+
+"""Query for the rowids of exposures with bounding boxes intersecting a box.
+
+Using a single query string allows the sqlite3 module to reuse one prepared
+statement for many regions.
+"""
+_rtree_query = ("SELECT rowid FROM exposure_rtree\n"
+                "WHERE x_min < ? AND x_max > ? AND\n"
+                "      y_min < ? AND y_max > ? AND\n"
+                "      z_min < ? AND z_max > ?")
+
+
+"""Query for the rowids of exposures covered by a range of pixels."""
+_pixel_query = ("SELECT exposure_id FROM exposure_pixel\n"
+                "WHERE pixel >= ? AND pixel < ?")
+
+
+def _constrain_query(query, clauses):
+    """Restrict a query for exposure rowids to exposures satisfying the
+    given SQL clauses (see :func:`._constraint_clauses`).
+    """
+    if not clauses:
+        return query
+    return ("SELECT e.rowid FROM exposure AS e\n"
+            "WHERE e.rowid IN (\n{}\n) AND {}").format(
+                query, " AND ".join(clauses))
+
+
+def _fetch_exposures(conn, row_ids, chunk_size=500):
+    """Yield (rowid, :class:`.ExposureInfo`) pairs for the given exposure
+    rowids, with decoded data-ids and polygons.
+    """
+    for i in xrange(0, len(row_ids), chunk_size):
+        chunk = row_ids[i:i + chunk_size]
+        query = ("SELECT rowid, pickled_data_id, encoded_polygon\n"
+                 "FROM exposure WHERE rowid IN ({})").format(
+                     ", ".join(["?"] * len(chunk)))
+        for row in conn.execute(query, chunk):
+            # Note that in Python 2, BLOB columns are mapped to Python buffer
+            # objects, and so a conversion to str is necessary. In Python 3,
+            # BLOBs are mapped to bytes directly, and the str() calls must
+            # be removed.
+            yield row[0], ExposureInfo(decode_data_id(row[1]),
+                                       ConvexPolygon.decode(str(row[2])))
+
+
+def find_intersecting_exposures_many(database, regions, cache_size=10000,
+                                     constraints=None):
+    """Find the exposures that intersect each of a sequence of regions.
+
+    All regions are processed using a single connection and a single R*Tree
+    query statement. Candidate exposures are fetched and decoded once, and
+    then shared between the results of all regions they are candidates for
+    (up to a limit of `cache_size` decoded exposures, beyond which the least
+    recently used ones are discarded). Results are generated lazily, one
+    region at a time.
+
+    Parameters
+    ----------
+
+    database : sqlite3.Connection or str
+        A connection to (or filename of) a SQLite 3 database containing
+        an exposure index.
+
+    regions : iterable of lsst.sphgeom.Region
+        The spherical regions of interest.
+
+    cache_size : int
+        Maximum number of decoded exposures to retain between regions.
+
+    constraints : dict
+        Optional constraints on data-id values, applied to every region (see
+        :func:`.find_intersecting_exposures`).
+
+    Returns
+    -------
+
+        A generator yielding one list per region, as returned by
+        :func:`.find_intersecting_exposures`. The :class:`.ExposureInfo`
+        objects in different lists may be shared, and should not be
+        modified.
+    """
+    with ExposureIndexReader(database, cache_size) as reader:
+        for results in reader.find_intersecting_exposures_many(regions,
+                                                               constraints):
+            yield results
+
+
+class ExposureIndexReader(object):
+    """A reader for an exposure index that caches decoded exposures.
+
+    Decoded data-ids and polygons are kept in a bounded
+    least-recently-used cache keyed by exposure rowid, so that exposures
+    returned by many queries (e.g. for neighboring patches) are only
+    decoded once. The ``hits`` and ``misses`` attributes count cache lookups
+    that did and did not find a decoded exposure.
+
+    Candidate exposures for a query region are found using either the
+    R*Tree of exposure bounding boxes, or (if the index has one, see
+    :func:`.create_exposure_tables`) the pixelization index. The latter
+    generally yields fewer candidates for thin or high-declination
+    exposures; :func:`.measure_candidate_tightness` can be used to compare
+    the two. The final results do not depend on the choice.
+
+    Before each query, the reader checks whether the database has changed
+    since the cache was filled, either via another connection (as reported
+    by ``PRAGMA data_version``) or via its own, and if so, empties the cache
+    and reloads the list of typed data-id columns that queries can be
+    constrained by.
+
+    Readers can be used as context managers, and hand the database
+    connection back to :data:`.connection_pool` on exit if they obtained it
+    from there.
+    """
+
+    def __init__(self, database, cache_size=10000, candidate_index=None):
+        """Create a reader for an exposure index.
+
+        Parameters
+        ----------
+
+        database : sqlite3.Connection or str
+            A connection to (or filename of) a SQLite 3 database containing
+            an exposure index.
+
+        cache_size : int
+            Maximum number of decoded exposures to cache.
+
+        candidate_index : str
+            The index used to find candidate exposures: ``"rtree"``,
+            ``"pixel"``, or ``None`` to use the pixelization index if there
+            is one, and the R*Tree otherwise.
+        """
+        if candidate_index not in (None, "rtree", "pixel"):
+            raise RuntimeError(
+                "Unknown candidate index {}".format(candidate_index))
+        self.conn = _connect(database, "serve")
+        self._owns_conn = self.conn is not database
+        self._cache = LruCache(cache_size)
+        self._version = None
+        self.data_id_columns = _get_data_id_columns(self.conn)
+        self.pixelization = get_pixelization(self.conn)
+        if candidate_index is None:
+            candidate_index = "rtree" if self.pixelization is None else "pixel"
+        elif candidate_index == "pixel" and self.pixelization is None:
+            self.close()
+            raise RuntimeError("The exposure index has no pixelization index")
+        self.candidate_index = candidate_index
+
+    @property
+    def hits(self):
+        """Number of exposures found in the cache."""
+        return self._cache.hits
+
+    @property
+    def misses(self):
+        """Number of exposures that had to be fetched and decoded."""
+        return self._cache.misses
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def close(self):
+        """Empty the cache, and release the connection if the reader
+        obtained it from a file name.
+        """
+        self._cache.clear()
+        if self._owns_conn:
+            _release(self.conn, None)
+
+    def find_intersecting_exposures(self, region, constraints=None):
+        """Find exposures that intersect a spherical region.
+
+        See :func:`.find_intersecting_exposures`.
+        """
+        return next(self.find_intersecting_exposures_many([region],
+                                                          constraints))
+
+    def find_intersecting_exposures_many(self, regions, constraints=None):
+        """Find the exposures that intersect each of a sequence of regions.
+
+        See :func:`.find_intersecting_exposures_many`.
+        """
+        for region in regions:
+            self._check_version()
+            row_ids = self.candidates(region, constraints)
+            candidates = {}
+            missing = []
+            for row_id in row_ids:
+                info = self._cache.get(row_id)
+                if info is None:
+                    missing.append(row_id)
+                else:
+                    candidates[row_id] = info
+            for row_id, info in _fetch_exposures(self.conn, missing):
+                candidates[row_id] = info
+                self._cache.put(row_id, info)
+            yield [candidates[row_id] for row_id in row_ids
+                   if row_id in candidates and
+                   region.relate(candidates[row_id].boundary) != DISJOINT]
+
+    def candidates(self, region, constraints=None):
+        """Return the rowids of the candidate exposures for a region.
+
+        Every exposure intersecting `region` (and satisfying `constraints`,
+        see :func:`.find_intersecting_exposures`) is a candidate, but not
+        every candidate intersects `region`.
+        """
+        clauses, params = _constraint_clauses(constraints or {},
+                                              self.data_id_columns)
+        if self.candidate_index == "pixel":
+            query = _constrain_query(_pixel_query, clauses)
+            row_ids = set()
+            for begin, end in self.pixelization.envelope(region):
+                row_ids.update(row[0] for row in self.conn.execute(
+                    query, [begin, end] + params))
+            return sorted(row_ids)
+        query = _constrain_query(_rtree_query, clauses)
+        bbox = region.getBoundingBox3d()
+        params = [bbox.x().getB(), bbox.x().getA(),
+                  bbox.y().getB(), bbox.y().getA(),
+                  bbox.z().getB(), bbox.z().getA()] + params
+        return [row[0] for row in self.conn.execute(query, params)]
+
+    def _check_version(self):
+        """Empty the cache if the database has changed since it was filled.
+
+        ``PRAGMA data_version`` only reflects changes committed by other
+        connections, so the number of changes made through the reader's own
+        connection is checked as well.
+        """
+        row = self.conn.execute("PRAGMA data_version").fetchone()
+        version = (None if row is None else row[0], self.conn.total_changes)
+        if version != self._version:
+            self._cache.clear()
+            self._version = version
+            self.data_id_columns = _get_data_id_columns(self.conn)
+
+
+def measure_candidate_tightness(database, regions):
+    """Measure how tightly each available index bounds query results.
+
+    Each region is queried using the R*Tree and (if there is one) the
+    pixelization index, and the numbers of candidates and of actual results
+    are accumulated. The tightness of an index is the ratio of the number of
+    results to the number of candidates: 1 means that no candidate was
+    decoded and tested in vain.
+
+    Parameters
+    ----------
+
+    database : sqlite3.Connection or str
+        A connection to (or filename of) a SQLite 3 database containing
+        an exposure index.
+
+    regions : iterable of lsst.sphgeom.Region
+        Representative query regions.
+
+    Returns
+    -------
+
+    dict
+        A mapping from index name (``"rtree"`` or ``"pixel"``) to a dict
+        containing the total number of ``candidates`` and ``results``, the
+        ``tightness``, and the ``elapsed`` time (seconds) taken to run the
+        queries with a cold decoding cache.
+    """
+    regions = list(regions)
+    conn = _connect(database, "serve")
+    indexes = ["rtree"]
+    if get_pixelization(conn) is not None:
+        indexes.append("pixel")
+    report = {}
+    try:
+        for index in indexes:
+            reader = ExposureIndexReader(conn, candidate_index=index)
+            num_candidates = sum(len(reader.candidates(r)) for r in regions)
+            start = time.time()
+            num_results = sum(len(reader.find_intersecting_exposures(r))
+                              for r in regions)
+            elapsed = time.time() - start
+            report[index] = dict(
+                candidates=num_candidates,
+                results=num_results,
+                tightness=(float(num_results) / num_candidates
+                           if num_candidates > 0 else 1.0),
+                elapsed=elapsed,
+            )
+    finally:
+        _release(conn, database)
+    return report
+
+
+def measure_missed_results(reference, database, regions):
+    """Measure how many true query results an exposure index misses.
+
+    The same exposures are assumed to have been indexed in two databases,
+    e.g. with different values of the |edge_samples| configuration
+    parameter, the `reference` having the more accurate exposure boundaries.
+    Each region is queried in both, and the numbers of results are
+    accumulated. Every reference result missing from the results for
+    `database` is an exposure that overlaps the region, but that a
+    downstream consumer (e.g. coaddition) querying `database` would
+    silently omit - a false negative.
+
+    Parameters
+    ----------
+
+    reference : sqlite3.Connection or str
+        A connection to (or filename of) the reference exposure index.
+
+    database : sqlite3.Connection or str
+        A connection to (or filename of) the exposure index to compare.
+
+    regions : iterable of lsst.sphgeom.Region
+        Representative query regions.
+
+    Returns
+    -------
+
+    dict
+        A dict containing the total number of ``reference_results`` and
+        ``results``, the number of ``missed`` results (reference results
+        absent from the results for `database`), the number of ``extra``
+        results (results absent from the reference results), and the
+        ``missed_fraction`` of reference results.
+    """
+    regions = list(regions)
+    totals = dict(reference_results=0, results=0, missed=0, extra=0)
+    with ExposureIndexReader(reference) as reference_reader:
+        with ExposureIndexReader(database) as reader:
+            for expected, results in zip(
+                    reference_reader.find_intersecting_exposures_many(regions),
+                    reader.find_intersecting_exposures_many(regions)):
+                expected = set(encode_data_id(e.data_id) for e in expected)
+                results = set(encode_data_id(e.data_id) for e in results)
+                totals["reference_results"] += len(expected)
+                totals["results"] += len(results)
+                totals["missed"] += len(expected - results)
+                totals["extra"] += len(results - expected)
+    totals["missed_fraction"] = (
+        float(totals["missed"]) / totals["reference_results"]
+        if totals["reference_results"] > 0 else 0.0)
+    return totals
+
+
+def migrate_data_id_codec(database, profile="bulk-build"):
+    """Re-key an exposure index by canonically encoded data-ids.
+
+    The data-ids of all exposures (and source files) are decoded, and
+    replaced with their :func:`.encode_data_id` encodings, after which the
+    index uses the canonical encoding for newly stored exposures. Since
+    pickles of equal data-ids can differ, an index of pickled data-ids may
+    contain the same exposure more than once - only the last stored
+    occurrence is kept. The index is migrated in a single transaction, and
+    migrating an index that has already been migrated has no effect.
+
+    Parameters
+    ----------
+
+    database : sqlite3.Connection or str
+        A connection to (or filename of) an exposure index.
+
+    profile : str
+        The name of the :data:`.sqlite_profiles` entry applied if `database`
+        is a file name.
+
+    Returns
+    -------
+
+    dict
+        The number of ``exposures`` in the index before migration, the
+        number of them that were ``rekeyed``, and the number of
+        ``duplicates`` that were removed.
+    """
+    conn = _connect(database, profile)
+    try:
+        return _migrate_data_id_codec(conn)
+    finally:
+        _release(conn, database)
+
+
+def _migrate_data_id_codec(conn):
+    """Re-key an exposure index using an open connection (see
+    :func:`.migrate_data_id_codec`).
+    """
+    version = _get_metadata(conn, 'data_id_codec')[0]
+    if version is not None and version != DATA_ID_CODEC_VERSION:
+        raise RuntimeError(
+            'Unsupported data-id encoding version {}'.format(version))
+    # Execute DDL before any data is modified, since the sqlite3 module
+    # implicitly commits before executing it.
+    _create_metadata_table(conn)
+    _create_source_table(conn)
+    has_pixels = _has_table(conn, 'exposure_pixel')
+    # Note that in Python 2, BLOB columns are mapped to Python buffer
+    # objects, and so a conversion to str is necessary.
+    rows = conn.execute(
+        'SELECT rowid, pickled_data_id FROM exposure ORDER BY rowid'
+    ).fetchall()
+    last = {}
+    for row_id, data in rows:
+        last[encode_data_id(decode_data_id(data))] = row_id
+    data_ids = dict((row_id, str(data)) for row_id, data in rows)
+    # Re-key the exposures that are kept, after removing duplicates (which
+    # would otherwise violate the uniqueness of data-ids).
+    rekeyed = [(buffer(key), row_id) for key, row_id in last.iteritems()
+               if key != data_ids[row_id]]
+    duplicates = [(row_id,) for row_id in
+                  set(data_ids).difference(last.itervalues())]
+    sources = []
+    for data, in conn.execute(
+            'SELECT DISTINCT pickled_data_id FROM exposure_source'):
+        key = encode_data_id(decode_data_id(data))
+        if key != str(data):
+            sources.append((buffer(key), data))
+    with conn:
+        for table, column in [('exposure', 'rowid'),
+                              ('exposure_rtree', 'rowid'),
+                              ('exposure_pixel', 'exposure_id')]:
+            if table != 'exposure_pixel' or has_pixels:
+                conn.executemany(
+                    'DELETE FROM {} WHERE {} = ?'.format(table, column),
+                    duplicates)
+        conn.executemany(
+            'UPDATE exposure SET pickled_data_id = ? WHERE rowid = ?',
+            rekeyed)
+        conn.executemany(
+            'UPDATE exposure_source SET pickled_data_id = ?\n'
+            'WHERE pickled_data_id = ?', sources)
+        conn.execute(
+            'INSERT OR REPLACE INTO exposure_index_metadata (name, value)\n'
+            'VALUES (?, ?)', ('data_id_codec', DATA_ID_CODEC_VERSION))
+    return dict(exposures=len(rows), rekeyed=len(rekeyed),
+                duplicates=len(duplicates))
 
 
 class IndexExposureConfig(pex_config.Config):
@@ -282,12 +1437,42 @@ class IndexExposureConfig(pex_config.Config):
         bool, default=False
     )
 
+    incremental = pex_config.Field(
+        "If True, the path, size and modification time of the file each "
+        "exposure is read from are stored, and exposures whose files have "
+        "not changed since they were last indexed are skipped before their "
+        "headers are read. Exposures whose files have changed replace their "
+        "previous index entries, regardless of allow_replace.",
+        bool, default=False
+    )
+
+    incremental_checksum = pex_config.Field(
+        "If True (and incremental is True), a checksum of the FITS header of "
+        "each exposure file is stored as well. Files with a new size or "
+        "modification time but an unchanged header checksum are then also "
+        "skipped, at the cost of reading (but not parsing) their headers.",
+        bool, default=False
+    )
+
     init_statements = pex_config.ListField(
         "List of initialization statements (e.g. PRAGMAs) to run when the "
         "SQLite 3 database is first created. Useful for performance tuning.",
         str, default=[]
     )
 
+    sqlite_profile = pex_config.ChoiceField(
+        "Named set of PRAGMA statements applied to every connection used to "
+        "write the SQLite 3 database (see sqlite_profiles).",
+        str, default="append",
+        allowed={
+            "bulk-build": "Fastest, for building an index with no concurrent "
+                          "readers and a single writing process (e.g. with "
+                          "defer_writes set to True).",
+            "append": "Write-ahead logging, so that the index can be queried "
+                      "while exposures are added to it.",
+        }
+    )
+
     defer_writes = pex_config.Field(
         "If False, then exposure information is inserted directly into the "
         "database by IndexExposureTask. Otherwise, all exposure index "
@@ -299,6 +1484,29 @@ class IndexExposureConfig(pex_config.Config):
         bool, default=True
     )
 
+    write_batch_size = pex_config.Field(
+        "Number of exposures stored per transaction when defer_writes is "
+        "True. Results are stored as tasks finish, so larger batches mean "
+        "fewer transactions but more exposure information held in memory "
+        "and lost on failure. Zero or less stores all exposures in a single "
+        "transaction.",
+        int, default=1000
+    )
+
+    edge_samples = pex_config.RangeField(
+        "Number of segments each edge of the pixel-space bounding box of an "
+        "exposure is divided into. The segment end-points are mapped to the "
+        "sky, and the exposure boundary is their convex hull. With 1, only "
+        "the box corners are used, and they are connected by great circles, "
+        "which is exact for gnomonic (TAN) projections but can miss slivers "
+        "of sky covered by distorted WCSes (e.g. TAN-SIP) with edges that "
+        "bulge outwards. Larger values capture such edges, so that queries "
+        "near them do not miss the exposure, at the cost of larger polygons "
+        "and more WCS evaluations. Since the boundary always contains the "
+        "corners-only one, sampling never removes query results.",
+        int, default=1, min=1
+    )
+
     pad_pixels = pex_config.Field(
         "Number of pixels by which the pixel-space bounding box of an "
         "exposure is grown before it is converted to a spherical polygon. "
@@ -308,6 +1516,70 @@ class IndexExposureConfig(pex_config.Config):
         int, default=0
     )
 
+    pixelization = pex_config.ChoiceField(
+        "Pixelization used to build a pixelization index of exposures, in "
+        "addition to the R*Tree of exposure bounding boxes. The ids of the "
+        "pixels covering each exposure are stored, and queries are answered "
+        "by pixel id range lookups. This usually yields fewer false "
+        "candidates for thin or high-declination exposures. None means no "
+        "pixelization index is built.",
+        str, optional=True, default=None,
+        allowed={
+            "htm": "Hierarchical Triangular Mesh",
+            "q3c": "Quad Tree Cube",
+        }
+    )
+
+    pixelization_level = pex_config.RangeField(
+        "Subdivision level of the pixelization. Pixels should be somewhat "
+        "smaller than exposures (e.g. HTM level 7 pixels are roughly 0.6 "
+        "degrees across), but every pixel covering an exposure is stored, so "
+        "fine levels result in large indexes.",
+        int, default=7, min=0, max=24
+    )
+
+    data_id_columns = pex_config.DictField(
+        "Mapping from data-id key to SQLite 3 column type (e.g. INTEGER, "
+        "REAL or TEXT) for the typed data-id columns of the exposure table, "
+        "which allow spatial queries to be constrained by data-id values. "
+        "If empty, columns are inferred from the first indexed data-id.",
+        keytype=str, itemtype=str, default={}
+    )
+
+
+"""Matches the FITS header keywords needed to compute exposure boundaries:
+image dimensions, the image origin, and celestial WCS keywords (including
+SIP distortion coefficients and alternate WCS ``A``)."""
+_boundary_keyword_pattern = (
+    r"(NAXIS[12]|LTV[12]|LTM[12]_[12]|WCSAXES|"
+    r"CTYPE[12]|CUNIT[12]|CRPIX[12]|CRVAL[12]|CDELT[12]|CROTA[12]|"
+    r"CD[12]_[12]|PC[12]_[12]|PV[12]_\d+|RADE?C?SYS|EQUINOX|EPOCH|"
+    r"MJD-OBS|DATE-OBS|LONPOLE|LATPOLE|[AB]P?_ORDER|[AB]P?_\d+_\d+|"
+    r"[AB]_DMAX)A?$"
+)
+
+
+def _source_path(data_ref, dstype):
+    """Return the name of the file a dataset is read from."""
+    if dstype.endswith("_md"):
+        dstype = dstype[:-len("_md")]
+    path = data_ref.get(dstype + "_filename")[0]
+    # Strip any HDU specification, e.g. "[1]".
+    return re.sub(r"\[\d+\]$", "", path)
+
+
+def _imap_results(iterator, timeout):
+    """Yield the results of a :meth:`multiprocessing.Pool.imap_unordered`
+    iterator, waiting at most `timeout` seconds for each.
+
+    Waiting with a timeout allows keyboard interrupts to be delivered.
+    """
+    while True:
+        try:
+            yield iterator.next(timeout)
+        except StopIteration:
+            return
+
 
 class IndexExposureRunner(pipe_base.TaskRunner):
     """Runner for :class:`.IndexExposureTask`."""
@@ -316,14 +1588,31 @@ class IndexExposureRunner(pipe_base.TaskRunner):
     def getTargetList(parsed_cmd):
         """Add additional |run| method arguments by overloading |getTargetList|.
 
+        If the |incremental| configuration parameter is ``True``, targets
+        whose files have not changed since they were last indexed are
+        dropped, and the file fingerprints of the others are passed to
+        |run|.
+
         .. |getTargetList| replace::
             :meth:`~lsst.pipe.base.TaskRunner.getTargetList`
         """
-        return pipe_base.TaskRunner.getTargetList(
-            parsed_cmd,
-            dstype=parsed_cmd.dstype,
-            database=parsed_cmd.database
-        )
+        kwargs = dict(dstype=parsed_cmd.dstype, database=parsed_cmd.database)
+        targets = pipe_base.TaskRunner.getTargetList(parsed_cmd, **kwargs)
+        if not parsed_cmd.config.incremental:
+            return targets
+        source_filter = _SourceFilter(parsed_cmd.database,
+                                      parsed_cmd.config.incremental_checksum,
+                                      parsed_cmd.config.sqlite_profile)
+        changed = []
+        for data_ref, _ in targets:
+            source = source_filter.source(
+                _source_path(data_ref, parsed_cmd.dstype))
+            if source is not None:
+                changed.append((data_ref, dict(kwargs, source=source)))
+        source_filter.update(parsed_cmd.database)
+        parsed_cmd.log.info("Skipping %d unchanged exposures" %
+                            (source_filter.num_skipped,))
+        return changed
 
     def precall(self, parsed_cmd):
         """Prepare for task execution.
@@ -333,7 +1622,8 @@ class IndexExposureRunner(pipe_base.TaskRunner):
         - sets the task's name appropriately
         - does not write task schemata
         - attempts to write a task configuration (success is not required)
-        - initializes the SQLite 3 output database
+        - initializes the SQLite 3 output database (including a
+          pixelization index and typed data-id columns, if configured)
 
         .. |precall| replace:: :meth:`~lsst.pipe.base.TaskRunner.precall`
         """
@@ -345,20 +1635,58 @@ class IndexExposureRunner(pipe_base.TaskRunner):
             # Often no mapping for config, but in any case just skip
             task.log.warn("Could not persist config: %s" % (e,))
         create_exposure_tables(parsed_cmd.database,
-                               self.config.init_statements)
+                               self.config.init_statements,
+                               self.config.pixelization,
+                               self.config.pixelization_level,
+                               dict(self.config.data_id_columns),
+                               self.config.sqlite_profile)
         return True
 
     def run(self, parsed_cmd):
         """Run the task on all targets.
 
         If the |defer_writes| configuration parameter is ``True``, then
-        exposure information is stored after all targets have finished
-        running.
+        tasks only compute exposure information, and this process is the
+        single database writer. Results are streamed to it as tasks finish
+        (in completion order, when running with multiple processes), and are
+        stored in transactions of |write_batch_size| exposures. Computation
+        in the task processes thus overlaps with database writes, memory
+        usage does not grow with the number of targets, and batches stored
+        before a failure remain stored.
         """
-        results = pipe_base.TaskRunner.run(self, parsed_cmd)
-        if self.config.defer_writes:
-            store_exposure_info(
-                parsed_cmd.database, self.config.allow_replace, results)
+        if not self.config.defer_writes:
+            pipe_base.TaskRunner.run(self, parsed_cmd)
+            return
+        if not self.precall(parsed_cmd):
+            return
+        target_list = self.getTargetList(parsed_cmd)
+        if len(target_list) == 0:
+            parsed_cmd.log.warn("Not running the task because there is no "
+                                "data to process")
+            return
+        pool = None
+        try:
+            if self.numProcesses > 1:
+                self.prepareForMultiProcessing()
+                pool = multiprocessing.Pool(processes=self.numProcesses,
+                                            maxtasksperchild=1)
+                results = _imap_results(
+                    pool.imap_unordered(self, target_list), self.timeout)
+            else:
+                results = imap(self, target_list)
+            store_exposure_info(parsed_cmd.database,
+                                self.config.allow_replace or
+                                self.config.incremental, results,
+                                batch_size=self.config.write_batch_size,
+                                profile=self.config.sqlite_profile)
+        except:
+            if pool is not None:
+                pool.terminate()
+            raise
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
 
     def __call__(self, args):
         """Run the task on a single target.
@@ -400,14 +1728,14 @@ class IndexExposureTask(pipe_base.CmdLineTask):
     This task extracts the WCS from an input exposure and uses it to compute
     a corresponding spherical bounding polygon. The exposure data-id and
     bounding polygon are ether written to an SQLite 3 database or returned.
-    Both values are stored as binary strings - the data-id is pickled, and
-    the bounding polygon is |encoded|.
+    Both values are stored as binary strings - the data-id is canonically
+    encoded (see :mod:`.dataIdCodec`), and the bounding polygon is |encoded|.
 
-    This avoids the complexity of performing ORM on the data-id, but
-    also limits the kinds of queries that can be run on the database
-    to essentially just spatial ones. (Adding ORM for the data-id would allow
-    additional potentially useful query constraints to be expressed, like
-    restrictions on filter, visit number, etc...)
+    The values of data-id keys (e.g. filter or visit) are additionally
+    stored in typed, indexed columns, so that spatial queries can be
+    constrained by them. The columns are given by the |data_id_columns|
+    configuration parameter or, if it is empty, inferred from the first
+    exposure indexed.
 
     Additionally, a 3-D bounding box for each exposure is stored in an SQLite
     `R*Tree`_, allowing for fast spatial exposure queries.
@@ -427,25 +1755,43 @@ class IndexExposureTask(pipe_base.CmdLineTask):
     data id is still required, just as for :meth:`.run`, and that the database
     must be initialized beforehand by calling :func:`.create_exposure_tables`.
 
+    For very large repositories, :meth:`.index_files` indexes every file of a
+    dataset without a butler, reading only the required FITS header cards.
+
     Once an exposure index has been produced, other pipeline tasks (like the
     ones responsible for coaddition) can use it to quickly locate exposures
     overlapping a particular part of the sky by calling
-    :func:`.find_intersecting_exposures`.
+    :func:`.find_intersecting_exposures` (or, for many parts of the sky at
+    once, :func:`.find_intersecting_exposures_many`).
 
     To allow pre-existing exposure index information to be overwritten, set
     the |allow_replace| |configuration| parameter to ``True``. By default,
     attempting to index the same exposure twice will result in an error.
+    Alternatively, set |incremental| to ``True`` to record the files
+    exposures are read from, and to skip unchanged files when re-indexing;
+    only new and changed exposures are then read and stored.
+
+    Setting |pixelization| to ``"htm"`` or ``"q3c"`` adds a pixelization
+    index, containing the ids of the pixels that cover each exposure, to the
+    database. Queries then look up candidate exposures by pixel id rather
+    than by bounding box (see :class:`.ExposureIndexReader`).
 
     The |pad_pixels| parameter can be used to grow (or shrink, if the value
     is negative) the pixel space bounding box for an exposure before it is
-    converted to a spherical bounding polygon.
+    converted to a spherical bounding polygon. By default, the polygon
+    connects the sky coordinates of the box corners, which can cut off parts
+    of exposures with distorted WCSes, so that queries near their edges miss
+    them. Setting |edge_samples| to a value greater than 1 samples the box
+    edges, giving polygons that contain such parts (and are never smaller
+    than corners-only polygons). The query results missed without sampling
+    can be measured with :func:`.measure_missed_results`.
 
     Finally, set |defer_writes| to ``False`` to execute SQLite database writes
     directly from the task. Normally, database writes are executed by
-    :class:`.IndexTaskRunner` after all bounding polygons have been computed.
-    This allows for parallel task execution and speeds up database writes (since
-    many rows can be inserted in a single transaction, and since SQLite 3 does
-    not support concurrent writers).
+    :class:`.IndexTaskRunner` as bounding polygons are computed, in batches
+    of |write_batch_size| exposures. This allows for parallel task execution
+    and speeds up database writes (since many rows can be inserted in a single
+    transaction, and since SQLite 3 does not support concurrent writers).
 
     Examples
     --------
@@ -486,11 +1832,98 @@ class IndexExposureTask(pipe_base.CmdLineTask):
             help='Dataset data id to index')
         return parser
 
-    def run(self, data_ref, dstype, database):
+    def run(self, data_ref, dstype, database, source=None):
         """Index an exposure specified by a data ref and dataset type."""
-        return self.index(data_ref.get(dstype), data_ref.dataId, database)
+        return self.index(data_ref.get(dstype), data_ref.dataId, database,
+                          source)
+
+    def index_files(self, root, template, database):
+        """Spatially index all exposure files of a dataset in a repository.
 
-    def index(self, exposure_or_metadata, data_id, database):
+        This bypasses the butler: files are found by walking the repository
+        (see :func:`.find_exposure_files`), and only the FITS header cards
+        needed to compute exposure boundaries are read from each one (see
+        :func:`.read_fits_header`). The results are identical to those of
+        :meth:`.index` applied to the corresponding |metadata|.
+
+        Exposure information is stored as it is computed, in transactions of
+        |write_batch_size| exposures, regardless of |defer_writes|. If
+        |incremental| is ``True``, unchanged files are skipped without
+        reading their headers.
+
+        Parameters
+        ----------
+
+        root : str
+            The root directory of the data repository.
+
+        template : str
+            The butler mapper path template of the dataset, relative to
+            `root` (e.g. ``"calexp/v%(visit)d-f%(filter)s/c%(ccd)02d.fits"``).
+            Data-ids are dicts of the template keys and values.
+
+        database : sqlite3.Connection or str
+            A connection to (or filename of) a SQLite 3 database initialized
+            via :func:`.create_exposure_tables`.
+
+        Returns
+        -------
+
+        int
+            The number of exposure files found (including skipped ones).
+        """
+        num_files = [0]
+        source_filter = None
+        if self.config.incremental:
+            source_filter = _SourceFilter(database,
+                                          self.config.incremental_checksum,
+                                          self.config.sqlite_profile)
+
+        def items():
+            for path, data_id in find_exposure_files(root, template):
+                num_files[0] += 1
+                source = None
+                if source_filter is not None:
+                    source = source_filter.source(path)
+                    if source is None:
+                        continue
+                yield self.read_metadata(path), data_id, source
+
+        def exposure_info():
+            # Compute boundaries for batches of exposures at a time, so that
+            # WCS evaluation is vectorized over many exposures.
+            batch_size = self.config.write_batch_size
+            if batch_size <= 0:
+                batch_size = 1000
+            it = items()
+            while True:
+                batch = list(islice(it, batch_size))
+                if not batch:
+                    break
+                for info in self._exposure_info_batch(batch):
+                    yield info
+        store_exposure_info(database, self._allow_replace(), exposure_info(),
+                            batch_size=self.config.write_batch_size,
+                            profile=self.config.sqlite_profile)
+        if source_filter is not None:
+            source_filter.update(database)
+            self.log.info("Skipped %d unchanged exposures" %
+                          (source_filter.num_skipped,))
+        return num_files[0]
+
+    @staticmethod
+    def read_metadata(path):
+        """Return |metadata| containing only the FITS header cards of an
+        exposure file that are needed to compute its boundary.
+        """
+        md = daf_base.PropertySet()
+        header = read_fits_header(path, _boundary_keyword_pattern)
+        for keyword, value in sorted(header.iteritems()):
+            if value is not None:
+                md.set(keyword, value)
+        return md
+
+    def index(self, exposure_or_metadata, data_id, database, source=None):
         """Spatially index an |exposure| or |metadata| object.
 
         Parameters
@@ -501,61 +1934,97 @@ class IndexExposureTask(pipe_base.CmdLineTask):
 
         data_id : object
             An object identifying a single exposure (e.g. as used by the
-            butler). It must be possible to pickle `data_id`.
+            butler). It must be possible to encode `data_id` with
+            :func:`.encode_data_id`.
 
         database : sqlite3.Connection or str
             A connection to (or filename of) a SQLite 3 database.
 
+        source : lsst.daf.ingest.indexExposure.ExposureSource
+            The fingerprint of the file the exposure was read from, stored
+            so that unchanged exposures can be skipped when re-indexing with
+            the |incremental| configuration parameter set to ``True``.
+            Optional.
+
         Returns
         -------
 
         ``None``, unless the |defer_writes| coniguration parameter is ``True``.
-        In that case, an :class:`.ExposureInfo` object containing a pickled
+        In that case, an :class:`.ExposureInfo` object containing an encoded
         data-id and an |encoded| |polygon| is returned.
         """
-        # Get a pixel index bounding box for the exposure.
-        if isinstance(exposure_or_metadata, daf_base.PropertySet):
-            md = exposure_or_metadata
-            # Map (LTV1, LTV2) to LSST (x0, y0). LSST convention says that
-            # (x0, y0) is the location of the sub-image origin (the bottom-left
-            # corner) relative to the origin of the parent, whereas LTVi encode
-            # the origin of the parent relative to the origin of the subimage.
-            pixel_bbox = afw_image.bboxFromMetadata(md)
-            wcs = afw_image.makeWcs(md, False)
-        else:
-            pixel_bbox = exposure_or_metadata.getBBox()
-            wcs = exposure_or_metadata.getWcs()
-        # Pad the box by a configurable amount and bail if the result is empty.
-        pixel_bbox.grow(self.config.pad_pixels)
-        if pixel_bbox.isEmpty():
-            self.log.warn("skipping exposure indexing for dataId=%s: "
-                          "empty bounding box", data_id)
-            return
-        corners = []
-        for c in pixel_bbox.getCorners():
-            # Convert the box corners from pixel indexes to pixel positions,
-            # and then to sky coordinates.
-            c = wcs.pixelToSky(afw_image.indexToPosition(c.getX()),
-                               afw_image.indexToPosition(c.getY()))
-            c = (c.getLongitude().asRadians(), c.getLatitude().asRadians())
-            # Bail if any coordinate is not finite.
-            if any(math.isinf(x) or math.isnan(x) for x in c):
-                self.log.warn("skipping exposure indexing for dataId=%s: "
-                              "NaN or Inf in bounding box sky coordinate(s)"
-                              " - bad WCS?", data_id)
-                return
-            # Convert from sky coordinates to unit vectors.
-            corners.append(UnitVector3d(Angle.fromRadians(c[0]),
-                                        Angle.fromRadians(c[1])))
-        # Create a convex polygon containing the exposure pixels. When sphgeom
-        # gains support for non-convex polygons, this could be changed to map
-        # exposure.getPolygon() to a spherical equivalent, or to subdivide box
-        # edges in pixel space to account for non linear projections. This
-        # would have higher accuracy than the current approach of connecting
-        # corner sky coordinates with great circles.
-        poly = ConvexPolygon(corners)
-        # Finally, persist or return the exposure information.
-        info = ExposureInfo(pickle.dumps(data_id), poly.encode())
-        if self.config.defer_writes:
+        info = self._exposure_info(exposure_or_metadata, data_id, source)
+        if info is None or self.config.defer_writes:
             return info
-        store_exposure_info(database, self.config.allow_replace, info)
+        store_exposure_info(database, self._allow_replace(), info,
+                            profile=self.config.sqlite_profile)
+
+    def _allow_replace(self):
+        """Return ``True`` if stored exposures may be replaced."""
+        return self.config.allow_replace or self.config.incremental
+
+    def _exposure_info(self, exposure_or_metadata, data_id, source=None):
+        """Compute the :class:`.ExposureInfo` for an |exposure| or |metadata|
+        object, or return ``None`` if it cannot be indexed.
+        """
+        return self._exposure_info_batch(
+            [(exposure_or_metadata, data_id, source)], batch_wcs=False)[0]
+
+    def _exposure_info_batch(self, items, batch_wcs=True):
+        """Compute :class:`.ExposureInfo` objects for a sequence of
+        (|exposure| or |metadata|, data-id, source) tuples.
+
+        Returns a list with one entry per item, which is ``None`` if the
+        corresponding exposure cannot be indexed. See
+        :func:`.compute_polygons` for details on how boundaries are computed.
+        If `batch_wcs` is ``False``, the WCSes of |metadata| objects are
+        always evaluated with afw, rather than with NumPy when possible.
+        """
+        bboxes = []
+        for exposure_or_metadata, data_id, source in items:
+            # Get a pixel index bounding box and a WCS for the exposure.
+            if isinstance(exposure_or_metadata, daf_base.PropertySet):
+                md = exposure_or_metadata
+                # Map (LTV1, LTV2) to LSST (x0, y0). LSST convention says that
+                # (x0, y0) is the location of the sub-image origin (the
+                # bottom-left corner) relative to the origin of the parent,
+                # whereas LTVi encode the origin of the parent relative to the
+                # origin of the subimage.
+                pixel_bbox = afw_image.bboxFromMetadata(md)
+                # TAN and TAN-SIP WCSes are evaluated directly from metadata
+                # when processing batches.
+                wcs = md if batch_wcs else afw_image.makeWcs(md, False)
+            else:
+                pixel_bbox = exposure_or_metadata.getBBox()
+                wcs = exposure_or_metadata.getWcs()
+            # Pad the box by a configurable amount and skip the exposure if the
+            # result is empty.
+            pixel_bbox.grow(self.config.pad_pixels)
+            if pixel_bbox.isEmpty():
+                self.log.warn("skipping exposure indexing for dataId=%s: "
+                              "empty bounding box", data_id)
+                bboxes.append(None)
+            else:
+                bboxes.append((pixel_bbox, wcs))
+        # Create convex polygons containing the exposure pixels: the convex
+        # hulls of the sampled boundary points. With one sample per edge,
+        # corner sky coordinates are connected with great circles, which
+        # can cut off (or add) slivers of sky when the WCS is not a pure
+        # gnomonic projection. When sphgeom gains support for non-convex
+        # polygons, this could be changed to map exposure.getPolygon() to a
+        # spherical equivalent.
+        polygons = iter(compute_polygons([b for b in bboxes if b is not None],
+                                         self.config.edge_samples))
+        results = []
+        for (_, data_id, source), bbox in zip(items, bboxes):
+            poly = None if bbox is None else next(polygons)
+            if poly is None:
+                if bbox is not None:
+                    self.log.warn("skipping exposure indexing for dataId=%s: "
+                                  "NaN or Inf in bounding box sky "
+                                  "coordinate(s) - bad WCS?", data_id)
+                results.append(None)
+                continue
+            results.append(ExposureInfo(encode_data_id(data_id),
+                                        poly.encode(), source))
+        return results
@@ -37,17 +37,31 @@ field aliases.
 .. |schema|        replace::  :class:`schema <lsst.afw.table.Schema>`
 .. |task|          replace::  :class:`~lsst.pipe.base.Task`
 """
-from contextlib import closing
+from collections import Counter
+from contextlib import closing, contextmanager
+import functools
+from itertools import izip
+import json
+import multiprocessing
 import MySQLdb
 import math
+import numpy as np
+import os
+import Queue
 import re
+import shutil
 import struct
+import tempfile
+import threading
+import time
+import uuid
 
 import lsst.afw.table as afw_table
 from lsst.daf.persistence import DbAuth
 import lsst.pex.config as pex_config
 import lsst.pipe.base as pipe_base
 from lsst.utils.timer import timeMethod
+from lsst.daf.ingest.lruCache import LruCache
 
 
 __all__ = (
@@ -56,6 +70,8 @@ __all__ = (
     "canonicalize_field_name",
     "quote_mysql_identifier",
     "aliases_for",
+    "FitsCatalogStream",
+    "CatalogBatch",
     "IngestCatalogConfig",
     "IngestCatalogRunner",
     "IngestCatalogTask",
@@ -67,13 +83,17 @@ class FieldFormatter(object):
 
     This class is a container for a function that maps an |afw table| field to
     a MySQL type, and a function that maps a field value to a literal suitable
-    for use in a MySQL ``INSERT`` or ``REPLACE`` statement.
+    for use in a MySQL ``INSERT`` or ``REPLACE`` statement. Optionally, it
+    also contains a function that maps an entire column of field values to a
+    list of such literals in one batch.
     """
 
-    def __init__(self, sql_type_callable, format_value_callable):
+    def __init__(self, sql_type_callable, format_value_callable,
+                 format_column_callable=None):
         """Store the field formatting information."""
         self.sql_type_callable = sql_type_callable
         self.format_value_callable = format_value_callable
+        self.format_column_callable = format_column_callable
 
     def sql_type(self, field):
         """Return the SQL type of values for `field`."""
@@ -90,6 +110,19 @@ class FieldFormatter(object):
             return "NULL"
         return self.format_value_callable(value)
 
+    def format_column(self, column):
+        """Return a list of string representations of the values in `column`.
+
+        The result is identical to calling :meth:`.format_value` on each
+        value, but is computed column-at-a-time when possible. Numeric, flag
+        and angle columns are NumPy arrays (angles in radians), fixed-length
+        array columns are 2-D NumPy arrays, and all other columns are
+        sequences of field values.
+        """
+        if self.format_column_callable is None:
+            return [self.format_value(v) for v in column]
+        return self.format_column_callable(column)
+
 
 def _format_number(format_string, number):
     """Format a number for use as a literal in a SQL statement.
@@ -106,6 +139,28 @@ def _format_number(format_string, number):
     return format_string.format(number)
 
 
+def _format_number_column(format_string, column):
+    """Format a column of numbers for use as literals in a SQL statement.
+
+    This is the column-at-a-time equivalent of :func:`._format_number`.
+    """
+    column = np.asarray(column)
+    values = map(format_string.format, column.tolist())
+    for i in np.flatnonzero(~np.isfinite(column)).tolist():
+        values[i] = "NULL"
+    return values
+
+
+def _format_angle_column(column):
+    """Format a column of angles in radians as SQL literals in degrees.
+
+    Dividing by the size of a degree in radians (rather than multiplying by
+    its reciprocal) matches :meth:`lsst.afw.geom.Angle.asDegrees` exactly.
+    """
+    return _format_number_column("{:.17g}",
+                                 np.asarray(column) / (math.pi / 180.0))
+
+
 def _format_string(string):
     """Format a string for use as a literal in a SQL statement.
 
@@ -138,6 +193,22 @@ def _format_array(format_char, array):
     return "x'" + byte_string.encode("hex_codec") + "'"
 
 
+def _format_array_column(format_char, column):
+    """Format a column of arrays for use as literals in a SQL statement.
+
+    This is the column-at-a-time equivalent of :func:`._format_array`. If
+    `column` is a 2-D NumPy array (i.e. the arrays have a fixed length), then
+    all of its elements are packed and hex-encoded in a single pass.
+    """
+    if not isinstance(column, np.ndarray) or column.ndim != 2:
+        return [_format_array(format_char, array) for array in column]
+    hex_string = (column.astype(np.dtype("<" + format_char))
+                  .tostring().encode("hex_codec"))
+    width = 2 * column.shape[1] * struct.calcsize("<" + format_char)
+    return ["x'" + hex_string[i * width:(i + 1) * width] + "'"
+            for i in xrange(column.shape[0])]
+
+
 def _sql_type_for_string(field):
     """Compute the SQL column type of a string valued field."""
     sz = field.getSize()
@@ -186,32 +257,224 @@ to the |afw table| library, they should also be added here.
 """
 field_formatters = dict(
     U=FieldFormatter(lambda f: "SMALLINT UNSIGNED NOT NULL",
-                     lambda v: str(v)),
+                     lambda v: str(v),
+                     lambda c: map(str, np.asarray(c).tolist())),
     I=FieldFormatter(lambda f: "INT NOT NULL",
-                     lambda v: str(v)),
+                     lambda v: str(v),
+                     lambda c: map(str, np.asarray(c).tolist())),
     L=FieldFormatter(lambda f: "BIGINT NOT NULL",
-                     lambda v: str(v)),
+                     lambda v: str(v),
+                     lambda c: map(str, np.asarray(c).tolist())),
     F=FieldFormatter(lambda f: "FLOAT",
-                     lambda v: _format_number("{:.9g}", v)),
+                     lambda v: _format_number("{:.9g}", v),
+                     lambda c: _format_number_column("{:.9g}", c)),
     D=FieldFormatter(lambda f: "DOUBLE",
-                     lambda v: _format_number("{:.17g}", v)),
+                     lambda v: _format_number("{:.17g}", v),
+                     lambda c: _format_number_column("{:.17g}", c)),
     Flag=FieldFormatter(lambda f: "BIT NOT NULL",
-                        lambda v: "1" if v else "0"),
+                        lambda v: "1" if v else "0",
+                        lambda c: np.where(c, "1", "0").tolist()),
     Angle=FieldFormatter(lambda f: "DOUBLE",
-                         lambda v: _format_number("{:.17g}", v.asDegrees())),
+                         lambda v: _format_number("{:.17g}", v.asDegrees()),
+                         _format_angle_column),
     String=FieldFormatter(_sql_type_for_string,
-                          _format_string),
+                          _format_string,
+                          lambda c: map(_format_string, c)),
     ArrayU=FieldFormatter(lambda f: _sql_type_for_array("H", f),
-                          lambda v: _format_array("H", v)),
+                          lambda v: _format_array("H", v),
+                          lambda c: _format_array_column("H", c)),
     ArrayI=FieldFormatter(lambda f: _sql_type_for_array("i", f),
-                          lambda v: _format_array("i", v)),
+                          lambda v: _format_array("i", v),
+                          lambda c: _format_array_column("i", c)),
     ArrayF=FieldFormatter(lambda f: _sql_type_for_array("f", f),
-                          lambda v: _format_array("f", v)),
+                          lambda v: _format_array("f", v),
+                          lambda c: _format_array_column("f", c)),
     ArrayD=FieldFormatter(lambda f: _sql_type_for_array("d", f),
-                          lambda v: _format_array("d", v)),
+                          lambda v: _format_array("d", v),
+                          lambda c: _format_array_column("d", c)),
+)
+
+
+def _escape_infile_string(string):
+    """Escape a string for use as a field in a ``LOAD DATA INFILE`` stream.
+
+    Backslashes, tabs, newlines and NUL characters are backslash-escaped.
+    """
+    return (string.replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\x00", "\\0"))
+
+
+def _infile_number_column(type_string, column):
+    """Format a column of numbers for a ``LOAD DATA INFILE`` stream.
+
+    Numbers are formatted exactly as for SQL statements, except that
+    ``NULL`` is written as ``\\N``.
+    """
+    return ["\\N" if v == "NULL" else v
+            for v in field_formatters[type_string].format_column(column)]
+
+
+def _infile_array_column(type_string, column):
+    """Format a column of arrays for a ``LOAD DATA INFILE`` stream.
+
+    Arrays are packed as for SQL statements, and the resulting hexadecimal
+    digits are written without the surrounding ``x'...'``.
+    """
+    return [v[2:-1]
+            for v in field_formatters[type_string].format_column(column)]
+
+
+"""A mapping from |afw table| field type strings to ``LOAD DATA INFILE``
+formatting information.
+
+Each value is a 2-tuple. The first element maps a column of field values
+(see :meth:`.FieldFormatter.format_column`) to a list of tab-separated field
+strings. The second is either ``None``, if the field strings can be loaded
+directly, or a template for the ``SET`` clause expression that converts the
+user variable a field string is loaded into to a column value.
+"""
+_infile_formats = dict(
+    U=(lambda c: field_formatters["U"].format_column(c), None),
+    I=(lambda c: field_formatters["I"].format_column(c), None),
+    L=(lambda c: field_formatters["L"].format_column(c), None),
+    F=(lambda c: _infile_number_column("F", c), None),
+    D=(lambda c: _infile_number_column("D", c), None),
+    # BIT values cannot be loaded directly from text.
+    Flag=(lambda c: field_formatters["Flag"].format_column(c),
+          "CAST({} AS UNSIGNED)"),
+    Angle=(lambda c: _infile_number_column("Angle", c), None),
+    String=(lambda c: map(_escape_infile_string, c), None),
+    ArrayU=(lambda c: _infile_array_column("ArrayU", c), "UNHEX({})"),
+    ArrayI=(lambda c: _infile_array_column("ArrayI", c), "UNHEX({})"),
+    ArrayF=(lambda c: _infile_array_column("ArrayF", c), "UNHEX({})"),
+    ArrayD=(lambda c: _infile_array_column("ArrayD", c), "UNHEX({})"),
+)
+
+
+def _parameter_number_column(column):
+    """Convert a column of numbers to Python floats for use as parameters.
+
+    NaNs and infinities are mapped to ``None`` (i.e. ``NULL``), as in
+    :func:`._format_number`.
+    """
+    column = np.asarray(column)
+    values = column.tolist()
+    for i in np.flatnonzero(~np.isfinite(column)).tolist():
+        values[i] = None
+    return values
+
+
+def _parameter_array_column(format_char, column):
+    """Convert a column of arrays to byte strings for use as parameters.
+
+    The array elements are packed exactly as in :func:`._format_array`.
+    """
+    dtype = np.dtype("<" + format_char)
+    if isinstance(column, np.ndarray) and column.ndim == 2:
+        packed = column.astype(dtype)
+        return [packed[i].tostring() for i in xrange(packed.shape[0])]
+    return [np.asarray(array, dtype=dtype).tostring() for array in column]
+
+
+def _float_literal(value, conversions=None):
+    """Convert a float parameter to a literal without loss of precision.
+
+    This replaces the MySQLdb default, which may only retain 15 significant
+    digits. MySQLdb passes its mapping of encoders as `conversions`; as a
+    float literal never contains nested values, it is not needed.
+    """
+    return "{:.17g}".format(value)
+
+
+"""A mapping from |afw table| field type strings to functions that convert
+a column of field values (see :meth:`.FieldFormatter.format_column`) to a list
+of Python values, suitable for use as ``cursor.executemany`` parameters.
+"""
+_parameter_formats = dict(
+    U=lambda c: np.asarray(c).tolist(),
+    I=lambda c: np.asarray(c).tolist(),
+    L=lambda c: np.asarray(c).tolist(),
+    F=_parameter_number_column,
+    D=_parameter_number_column,
+    Flag=lambda c: np.asarray(c, dtype=np.int8).tolist(),
+    Angle=lambda c: _parameter_number_column(
+        np.asarray(c) / (math.pi / 180.0)),
+    String=list,
+    ArrayU=lambda c: _parameter_array_column("H", c),
+    ArrayI=lambda c: _parameter_array_column("i", c),
+    ArrayF=lambda c: _parameter_array_column("f", c),
+    ArrayD=lambda c: _parameter_array_column("d", c),
 )
 
 
+@contextmanager
+def _infile_pipe(lines):
+    """Stream lines of text through a named pipe.
+
+    A named pipe is created in a new temporary directory, and a thread that
+    writes `lines` to it is started. The pipe holds no data on disk, so it
+    can be passed to a ``LOAD DATA LOCAL INFILE`` statement without staging
+    the data anywhere. On exit, the writer thread is stopped and joined, and
+    any error it encountered is re-raised.
+
+    Parameters
+    ----------
+
+    lines : iterable of str
+        The text to write.
+
+    Returns
+    -------
+
+    str
+        The name of the pipe.
+    """
+    dir_name = tempfile.mkdtemp(prefix="ingest_catalog_")
+    path = os.path.join(dir_name, "infile")
+    cancelled = threading.Event()
+    errors = []
+
+    def write():
+        try:
+            with open(path, "wb") as f:
+                for line in lines:
+                    if cancelled.is_set():
+                        break
+                    f.write(line)
+        except Exception, e:
+            if not cancelled.is_set():
+                errors.append(e)
+
+    try:
+        os.mkfifo(path, 0o600)
+        writer = threading.Thread(target=write, name="infile_writer")
+        writer.daemon = True
+        writer.start()
+        try:
+            yield path
+        finally:
+            cancelled.set()
+            if writer.is_alive():
+                # The reader failed or never opened the pipe. Act as the
+                # reader until the writer notices the cancellation, so that
+                # it cannot remain blocked in open() or write().
+                fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+                try:
+                    while writer.is_alive():
+                        try:
+                            os.read(fd, 65536)
+                        except OSError:
+                            pass
+                        writer.join(0.01)
+                finally:
+                    os.close(fd)
+            writer.join()
+        if errors:
+            raise errors[0]
+    finally:
+        shutil.rmtree(dir_name, ignore_errors=True)
+
+
 def canonicalize_field_name(field_name):
     """Return a MySQL-compatible version of the given field name.
 
@@ -285,6 +548,360 @@ def aliases_for(name, mappings):
     return aliases
 
 
+def _catalog_column(cat, columns, item, start, stop):
+    """Return the values of a field for a range of records in a catalog.
+
+    Parameters
+    ----------
+
+    cat : lsst.afw.table.BaseCatalog or subclass
+        A contiguous catalog.
+
+    columns : lsst.afw.table.BaseColumnView
+        The column view of `cat`.
+
+    item : lsst.afw.table.SchemaItem
+        The schema item of the field to extract.
+
+    start, stop : int
+        The range of record indexes to extract values for.
+
+    Returns
+    -------
+
+    numpy.ndarray or list
+        A NumPy array for fields supported by column views, and a list of
+        field values otherwise (for strings and variable-length arrays).
+    """
+    field = item.field
+    type_string = field.getTypeString()
+    if type_string == "String" or (type_string.startswith("Array") and
+                                   field.getSize() == 0):
+        return [cat[i].get(item.key) for i in xrange(start, stop)]
+    return columns[item.key][start:stop]
+
+
+def _catalog_column_blocks(cat, items, block_size):
+    """Yield columns of field values for blocks of records in a catalog.
+
+    Parameters
+    ----------
+
+    cat : lsst.afw.table.BaseCatalog or subclass
+        The catalog to extract field values from.
+
+    items : sequence of lsst.afw.table.SchemaItem
+        The schema items of the fields to extract.
+
+    block_size : int
+        The maximum number of records per block.
+
+    Returns
+    -------
+
+    generator of (int, list)
+        The number of records in each block, and a list containing one
+        column (see :func:`._catalog_column`) per schema item.
+    """
+    if len(cat) == 0:
+        return
+    if not cat.isContiguous():
+        cat = cat.copy(deep=True)
+    columns = cat.getColumnView()
+    for start in xrange(0, len(cat), block_size):
+        stop = min(start + block_size, len(cat))
+        yield stop - start, [_catalog_column(cat, columns, item, start, stop)
+                             for item in items]
+
+
+def _import_fits():
+    """Return the :mod:`astropy.io.fits` module, which is required to stream
+    FITS catalogs, or raise if astropy is not available.
+    """
+    try:
+        import astropy.io.fits as fits
+    except ImportError:
+        raise RuntimeError("Streaming FITS catalogs (see the stream_fits "
+                           "configuration parameter) requires astropy, "
+                           "which is not available")
+    return fits
+
+
+class FitsCatalogStream(object):
+    """A FITS |afw catalog| file, read a window of records at a time.
+
+    Instances can be passed to :meth:`.IngestCatalogTask.ingest` in place of
+    an |afw catalog|. Rather than reading the entire catalog into memory,
+    the FITS binary table is memory-mapped, and only the records in the
+    window being ingested are converted to field values.  Peak memory use is
+    therefore bounded by the window size rather than the file size (with the
+    exception of variable-length array fields, which are converted for the
+    entire table on first access).
+
+    Reading is implemented with :mod:`astropy.io.fits` (an optional
+    dependency); a :class:`RuntimeError` is raised if it is not available.
+    """
+
+    def __init__(self, file_name, hdu=1):
+        """Read the |schema| and table dimensions of a FITS catalog.
+
+        Parameters
+        ----------
+
+        file_name : str
+            Name of a FITS file written by the |afw table| library.
+
+        hdu : int
+            Index of the binary table HDU containing the catalog.
+        """
+        fits = _import_fits()
+        self.file_name = file_name
+        self.hdu = hdu
+        self.schema = afw_table.Schema.readFits(file_name, hdu)
+        header = fits.getheader(file_name, hdu)
+        self._num_rows = header["NAXIS2"]
+        # afw packs flag fields into a single bit array column, and records
+        # the name of the flag stored in bit n - 1 in the TFLAGn keyword.
+        self._flag_bits = {}
+        n = 1
+        while "TFLAG{}".format(n) in header:
+            self._flag_bits[header["TFLAG{}".format(n)]] = n - 1
+            n += 1
+
+    def __len__(self):
+        """Return the number of records in the catalog."""
+        return self._num_rows
+
+    def column_blocks(self, items, block_size):
+        """Yield columns of field values for windows of records.
+
+        This is the equivalent of :func:`._catalog_column_blocks` for a
+        catalog in a FITS file.
+        """
+        fits = _import_fits()
+        if self._num_rows == 0:
+            return
+        with closing(fits.open(self.file_name, memmap=True)) as hdus:
+            data = hdus[self.hdu].data
+            column_names = set(data.columns.names)
+            for start in xrange(0, self._num_rows, block_size):
+                window = data[start:start + block_size]
+                yield len(window), [self._column(window, column_names, item)
+                                    for item in items]
+
+    def _column(self, window, column_names, item):
+        """Return the values of a field for a window of records."""
+        field = item.field
+        name = field.getName()
+        type_string = field.getTypeString()
+        if type_string == "Flag":
+            return window.field("flags")[:, self._flag_bits[name]]
+        if name not in column_names:
+            # Some afw versions replace periods in field names.
+            name = name.replace(".", "_")
+            if name not in column_names:
+                raise RuntimeError("FITS table has no column for field " +
+                                   field.getName())
+        column = window.field(name)
+        if type_string == "String":
+            # Avoid the implicit stripping of trailing spaces by astropy.
+            return [str(s) for s in np.asarray(column)]
+        if type_string.startswith("Array"):
+            if field.getSize() == 0:
+                return [np.asarray(a) for a in column]
+            # astropy returns the values of single element array fields
+            # (e.g. TFORM = '1E') as a 1-D array.
+            return np.asarray(column).reshape(len(window), field.getSize())
+        return np.asarray(column)
+
+
+class CatalogBatch(object):
+    """A sequence of catalogs with identical schemas, ingested as one.
+
+    Instances can be passed to :meth:`.IngestCatalogTask.ingest` in place of
+    an |afw catalog|, in which case the records of all member catalogs are
+    formatted and sent to the database as a single stream. Members are only
+    loaded when their records are needed, so at most one of them is held in
+    memory at a time.
+    """
+
+    def __init__(self, catalogs, stream_fits=False):
+        """Create a batch of catalogs.
+
+        Parameters
+        ----------
+
+        catalogs : iterable
+            The member catalogs. Each is either an |afw catalog|, a
+            :class:`.FitsCatalogStream`, the name of a FITS file containing
+            an |afw catalog|, or a callable that returns one of these when
+            called with no arguments. All members must have the same keys
+            and field names.
+
+        stream_fits : bool
+            If ``True``, members specified by file name are read via
+            :class:`.FitsCatalogStream` rather than read into memory.
+        """
+        self.catalogs = list(catalogs)
+        if not self.catalogs:
+            raise RuntimeError("A catalog batch must have at least one member")
+        self.stream_fits = stream_fits
+        self._first = self._load(self.catalogs[0])
+        self.schema = self._first.schema
+
+    def _load(self, catalog):
+        """Load a member catalog."""
+        if callable(catalog):
+            catalog = catalog()
+        if isinstance(catalog, basestring):
+            if self.stream_fits:
+                return FitsCatalogStream(catalog)
+            return afw_table.BaseCatalog.readFits(catalog)
+        return catalog
+
+    def column_blocks(self, items, block_size):
+        """Yield columns of field values for blocks of member records.
+
+        This is the equivalent of :func:`._catalog_column_blocks` for a batch
+        of catalogs. An exception is raised if a member has a different
+        schema from the first one.
+        """
+        flags = afw_table.Schema.EQUAL_KEYS | afw_table.Schema.EQUAL_NAMES
+        for i, catalog in enumerate(self.catalogs):
+            if i == 0:
+                cat, self._first = self._first, None
+                if cat is None:
+                    cat = self._load(catalog)
+            else:
+                cat = self._load(catalog)
+                if cat.schema.compare(self.schema, flags) & flags != flags:
+                    raise RuntimeError(
+                        "Catalog {} of the batch has a different schema from "
+                        "the first catalog".format(i))
+            if isinstance(cat, FitsCatalogStream):
+                blocks = cat.column_blocks(items, block_size)
+            else:
+                blocks = _catalog_column_blocks(cat, items, block_size)
+            for block in blocks:
+                yield block
+            cat = None
+
+
+def _insert_statements(sql_prefix, rows, max_query_len):
+    """Pack formatted rows into as few SQL statements as possible.
+
+    Parameters
+    ----------
+
+    sql_prefix : str
+        The statement prefix, e.g. ``"INSERT INTO t (a, b) VALUES "``.
+
+    rows : iterable of str
+        Formatted rows, e.g. ``"(1,'a')"``.
+
+    max_query_len : int
+        The maximum length of a statement.
+
+    Returns
+    -------
+
+    generator of str
+        Statements containing every row, in order.
+    """
+    sql_rows = []
+    max_value_len = max_query_len - len(sql_prefix)
+    for row in rows:
+        value_len = len(row) + 1
+        if value_len > max_value_len:
+            if not sql_rows:
+                raise RuntimeError("Single row is too large to insert")
+            yield sql_prefix + ",".join(sql_rows)
+            sql_rows = []
+            max_value_len = max_query_len - len(sql_prefix)
+            if value_len > max_value_len:
+                raise RuntimeError("Single row is too large to insert")
+        sql_rows.append(row)
+        max_value_len -= value_len
+    if sql_rows:
+        yield sql_prefix + ",".join(sql_rows)
+
+
+def _schema_fingerprint(schema):
+    """Return a hashable fingerprint of the field layout of a |schema|.
+
+    Two schemas with equal fingerprints have the same fields (names, types
+    and sizes) in the same order, and hence identical keys.
+    """
+    fingerprint = []
+    for item in schema:
+        field = item.field
+        type_string = field.getTypeString()
+        if type_string == "String" or type_string.startswith("Array"):
+            fingerprint.append((field.getName(), type_string, field.getSize()))
+        else:
+            fingerprint.append((field.getName(), type_string))
+    return tuple(fingerprint)
+
+
+class _CatalogCodec(object):
+    """A compiled plan for converting records with a given |schema| to SQL.
+
+    A codec is built once per schema (see :meth:`.IngestCatalogTask._codec`)
+    and holds everything that depends only on the schema and configuration:
+    the ingestible schema items, their column names, the column formatting
+    functions of every ingest mode, and row templates that assemble a block of
+    formatted columns into rows without any per-field dispatch.
+
+    Formatting functions are looked up in :data:`.field_formatters` when the
+    codec is built, so changes to that mapping only affect new codecs.
+    """
+
+    def __init__(self, items, column_names):
+        """Compile a codec for the given schema items and column names."""
+        self.items = items
+        self.column_names = column_names
+        type_strings = [item.field.getTypeString() for item in items]
+        self.sql_formats = [field_formatters[t].format_column
+                            for t in type_strings]
+        self.infile_formats = [_infile_formats[t][0] for t in type_strings]
+        self.parameter_formats = [_parameter_formats[t] for t in type_strings]
+        # Compute the column list and SET clause of LOAD DATA statements.
+        self.infile_targets = []
+        self.infile_assignments = []
+        for i, (column, t) in enumerate(izip(column_names, type_strings)):
+            template = _infile_formats[t][1]
+            if template is None:
+                self.infile_targets.append(column)
+            else:
+                variable = "@v{}".format(i)
+                self.infile_targets.append(variable)
+                self.infile_assignments.append(
+                    column + " = " + template.format(variable))
+        n = len(items)
+        self._row_template = "(" + ",".join(["{}"] * n) + ")"
+        self._line_template = "\t".join(["{}"] * n) + "\n"
+
+    def rows(self, n, columns):
+        """Return a list of `n` SQL row literals, given formatted columns."""
+        if not columns:
+            return [self._row_template] * n
+        return map(self._row_template.format, *columns)
+
+    def lines(self, n, columns):
+        """Return `n` tab-separated lines as one string, given formatted
+        columns.
+        """
+        if not columns:
+            return self._line_template * n
+        return "".join(map(self._line_template.format, *columns))
+
+
+"""The most recently used catalog codecs, keyed by schema fingerprint and the
+relevant configuration parameters.
+"""
+_codec_cache = LruCache(32)
+
+
 class IngestCatalogConfig(pex_config.Config):
     """Configuration for :class:`~IngestCatalogTask`."""
 
@@ -305,6 +922,12 @@ class IngestCatalogConfig(pex_config.Config):
         int, default=64, min=1, max=64, inclusiveMin=True, inclusiveMax=True
     )
 
+    block_size = pex_config.RangeField(
+        "Number of catalog records formatted at a time. Fields are converted "
+        "to SQL literals one column (of at most this many values) at a time.",
+        int, default=10000, min=1
+    )
+
     id_field_name = pex_config.Field(
         "Name of the unique ID field",
         str, optional=True, default="id"
@@ -322,6 +945,101 @@ class IngestCatalogConfig(pex_config.Config):
         str, optional=True, default=""
     )
 
+    stream_fits = pex_config.Field(
+        "If True, run_file() ingests FITS catalogs a window of block_size "
+        "records at a time (see FitsCatalogStream), rather than reading "
+        "them into memory first.",
+        bool, default=False
+    )
+
+    single_session = pex_config.Field(
+        "If True, the command line task ingests the catalogs for all data "
+        "ids using a single database session (see IngestCatalogTask."
+        "ingest_many), and processes are not used even if requested.",
+        bool, default=False
+    )
+
+    commit_interval = pex_config.RangeField(
+        "Number of catalogs ingested per transaction by ingest_many. 0 "
+        "means all catalogs are ingested in a single transaction.",
+        int, default=0, min=0
+    )
+
+    ingest_mode = pex_config.ChoiceField(
+        "Method used to send catalog rows to the database",
+        str, default="insert",
+        allowed={
+            "insert": "Multi-row INSERT (or REPLACE) statements, each at "
+                      "most max_query_len characters long",
+            "load_data": "A single LOAD DATA LOCAL INFILE statement, "
+                         "reading tab-separated rows from a named pipe",
+            "executemany": "A parameterized INSERT (or REPLACE) statement, "
+                           "executed with cursor.executemany() for each "
+                           "block of block_size records",
+        }
+    )
+
+    num_connections = pex_config.RangeField(
+        "Number of database connections used to execute INSERT statements "
+        "concurrently (only used when ingest_mode is 'insert'). If greater "
+        "than 1, the statements executed on each connection form one branch "
+        "of an XA transaction, and all branches are committed or rolled back "
+        "together.",
+        int, default=1, min=1
+    )
+
+    max_queued_statements = pex_config.RangeField(
+        "Maximum number of formatted INSERT statements waiting to be "
+        "executed when num_connections is greater than 1. Formatting blocks "
+        "while the queue is full.",
+        int, default=4, min=1
+    )
+
+    defer_indexes = pex_config.Field(
+        "If True, tables are created without a unique index on the ID "
+        "column. The index is added (after checking for duplicate IDs) once "
+        "loading is complete, along with any extra_indexes. Incompatible "
+        "with allow_replace.",
+        bool, default=False
+    )
+
+    extra_indexes = pex_config.ListField(
+        "Additional indexes to build once loading is complete. Each entry is "
+        "a comma-separated list of the afw table field names to index, e.g. "
+        "'coord_ra,coord_dec' or 'parent'.",
+        str, optional=True, default=[]
+    )
+
+    metrics_file = pex_config.Field(
+        "Name of a file to which the ingest metrics of each ingested catalog "
+        "(or group of catalogs ingested together) are appended, as a line "
+        "of JSON. None means metrics are only recorded in task metadata.",
+        str, optional=True, default=None
+    )
+
+    def validate(self):
+        pex_config.Config.validate(self)
+        if self.defer_indexes and self.allow_replace:
+            raise ValueError("defer_indexes cannot be used with "
+                             "allow_replace: replacing rows requires the "
+                             "unique ID index to exist while loading")
+
+
+def _read_catalog_schema(data_ref, dstype):
+    """Return the |schema| of the catalog of type `dstype` for a data ref,
+    without reading its records.
+
+    The schema is read from the ``<dstype>_schema`` dataset if there is one,
+    and from the header of the catalog's FITS file otherwise.
+    """
+    try:
+        if data_ref.datasetExists(dstype + "_schema"):
+            return data_ref.get(dstype + "_schema", immediate=True).schema
+    except Exception:
+        # The mapper has no schema dataset for this dataset type.
+        pass
+    return afw_table.Schema.readFits(data_ref.get(dstype + "_filename")[0])
+
 
 class IngestCatalogRunner(pipe_base.TaskRunner):
     """Runner for :class:`~IngestCatalogTask`."""
@@ -341,7 +1059,8 @@ class IngestCatalogRunner(pipe_base.TaskRunner):
             host=parsed_cmd.host,
             db=parsed_cmd.db,
             port=parsed_cmd.port,
-            user=parsed_cmd.user
+            user=parsed_cmd.user,
+            build_indexes=False
         )
 
     def precall(self, parsed_cmd):
@@ -352,6 +1071,12 @@ class IngestCatalogRunner(pipe_base.TaskRunner):
         - sets the task's name appropriately
         - does not write task schemata
         - attempts to write a task configuration (success is not required)
+        - creates the destination table and view from the schema of the
+          first catalog to ingest, so that parallel task invocations do not
+          race to create them. Only the schema is read, not the catalog.
+          Targets whose schema cannot be read are logged and skipped in
+          favor of the next target; their failure to ingest is reported
+          when they are run.
 
         .. |precall| replace:: :meth:`~lsst.pipe.base.TaskRunner.precall`
         """
@@ -362,8 +1087,216 @@ class IngestCatalogRunner(pipe_base.TaskRunner):
         except Exception, e:
             # Often no mapping for config, but in any case just skip
             task.log.warn("Could not persist config: %s" % (e,))
+        targets = self.getTargetList(parsed_cmd)
+        if len(targets) == 0:
+            return True
+        for data_ref, kwargs in targets:
+            try:
+                schema = _read_catalog_schema(data_ref, kwargs["dstype"])
+                break
+            except Exception, e:
+                task.log.warn("Could not read schema for dataId=%s: %s" %
+                              (data_ref.dataId, e))
+        else:
+            msg = "Could not read the schema of any catalog to ingest"
+            if self.doRaise:
+                raise RuntimeError(msg)
+            task.log.fatal(msg)
+            return False
+        task.setup_database(schema, kwargs["table_name"], kwargs["host"],
+                            kwargs["db"], kwargs["port"], kwargs["user"],
+                            kwargs["view_name"])
         return True
 
+    def run(self, parsed_cmd):
+        """Run the task on all targets.
+
+        If the |single_session| configuration parameter is ``True``, then
+        the catalogs for all targets are ingested by a single call to
+        :meth:`.IngestCatalogTask.run_many`.
+
+        Indexes that are built after loading (see |defer_indexes| and
+        |extra_indexes|) are built once all targets have been processed.
+
+        .. |defer_indexes| replace::
+            :attr:`~.IngestCatalogConfig.defer_indexes`
+        .. |extra_indexes| replace::
+            :attr:`~.IngestCatalogConfig.extra_indexes`
+        .. |single_session| replace::
+            :attr:`~.IngestCatalogConfig.single_session`
+        """
+        if not self.config.single_session:
+            if self.numProcesses > 1:
+                results = self._run_pool(parsed_cmd)
+            else:
+                results = pipe_base.TaskRunner.run(self, parsed_cmd)
+        elif not self.precall(parsed_cmd):
+            return None
+        else:
+            results = []
+            targets = self.getTargetList(parsed_cmd)
+            if len(targets) > 0:
+                task = self.makeTask(parsedCmd=parsed_cmd)
+                task.run_many([data_ref for data_ref, _ in targets],
+                              **targets[0][1])
+        if results is not None:
+            self._build_indexes(parsed_cmd)
+        return results
+
+    def _build_indexes(self, parsed_cmd):
+        """Build the indexes that were deferred until after loading."""
+        if not (self.config.defer_indexes or self.config.extra_indexes):
+            return
+        targets = self.getTargetList(parsed_cmd)
+        if len(targets) == 0:
+            return
+        kwargs = targets[0][1]
+        task = self.TaskClass(config=self.config, log=self.log)
+        task.build_indexes(kwargs["table_name"], kwargs["host"], kwargs["db"],
+                           kwargs["port"], kwargs["user"])
+
+    def _run_pool(self, parsed_cmd):
+        """Ingest the catalogs of all targets using a pool of processes.
+
+        Each worker process keeps a single database connection open for its
+        lifetime, and reads, formats and inserts one catalog per target it is
+        given. A summary of ingestion throughput and of the utilization of
+        each worker is logged once all targets have been processed.
+
+        Returns
+        -------
+
+        list of dict
+            The statistics returned by :func:`._ingest_in_worker` for each
+            target.
+        """
+        if not self.precall(parsed_cmd):
+            return None
+        targets = self.getTargetList(parsed_cmd)
+        if len(targets) == 0:
+            return []
+        kwargs = targets[0][1]
+        pool = multiprocessing.Pool(
+            processes=self.numProcesses,
+            initializer=_init_ingest_worker,
+            initargs=(self.config, kwargs["host"], kwargs["port"],
+                      kwargs["db"], kwargs["user"])
+        )
+        start = time.time()
+        results = []
+        try:
+            it = pool.imap_unordered(_ingest_in_worker, targets)
+            for _ in targets:
+                # A timeout allows the pool to be interrupted.
+                results.append(it.next(self.timeout))
+        except:
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+        self._log_summary(results, time.time() - start)
+        failures = [r for r in results if r["error"] is not None]
+        for r in failures:
+            self.log.fatal("Failed on dataId=%s: %s" % (r["data_id"], r["error"]))
+        if failures and self.doRaise:
+            raise RuntimeError(
+                "Failed to ingest {} of {} catalogs".format(
+                    len(failures), len(results)))
+        return results
+
+    def _log_summary(self, results, elapsed):
+        """Log the throughput of a process pool ingest.
+
+        Parameters
+        ----------
+
+        results : list of dict
+            Statistics returned by :func:`._ingest_in_worker`.
+
+        elapsed : float
+            Wall clock time (seconds) spent ingesting.
+        """
+        rows = sum(r["rows"] for r in results)
+        num_bytes = sum(r["bytes"] for r in results)
+        elapsed = max(elapsed, 1e-9)
+        self.log.info(
+            "Ingested %d rows (%d bytes) from %d catalogs in %.3f s: "
+            "%.1f rows/s, %.1f bytes/s" % (
+                rows, num_bytes, len(results), elapsed,
+                rows / elapsed, num_bytes / elapsed))
+        workers = {}
+        for r in results:
+            workers.setdefault(r["pid"], []).append(r)
+        for pid in sorted(workers):
+            busy = sum(r["time"] for r in workers[pid])
+            self.log.info(
+                "Worker %d: %d catalogs, %d rows, %.3f s busy, "
+                "%.1f%% utilization" % (
+                    pid, len(workers[pid]), sum(r["rows"] for r in workers[pid]),
+                    busy, 100.0 * busy / elapsed))
+
+
+"""The task and database connection of an ingest worker process."""
+_worker_state = {}
+
+
+def _init_ingest_worker(config, host, port, db, user):
+    """Initialize a process pool worker for catalog ingestion.
+
+    The worker task and its database connection are stored in
+    :data:`._worker_state`. The connection is closed when the worker exits.
+    """
+    task = IngestCatalogTask(config=config)
+    conn = task.connect(host, port, db, user,
+                        local_infile=config.ingest_mode == "load_data")
+    multiprocessing.util.Finalize(None, conn.close, exitpriority=10)
+    _worker_state.update(task=task, conn=conn)
+
+
+def _ingest_in_worker(target):
+    """Ingest the catalog for one target in a process pool worker.
+
+    The destination table must already exist.
+
+    Parameters
+    ----------
+
+    target : tuple
+        A data ref and a dictionary of keyword arguments for
+        :meth:`.IngestCatalogTask.run`.
+
+    Returns
+    -------
+
+    dict
+        The data id, the worker process id, the number of rows ingested,
+        the number of bytes of SQL (or tab-separated text) sent, the time
+        taken, and the error message if ingestion failed (or ``None``).
+    """
+    data_ref, kwargs = target
+    task, conn = _worker_state["task"], _worker_state["conn"]
+    task.counters.clear()
+    start = time.time()
+    error = None
+    try:
+        with task._recording_metrics(kwargs["table_name"], data_ref.dataId):
+            with task._timed("read"):
+                cat = data_ref.get(kwargs["dstype"])
+            task.ingest_on(conn, cat, kwargs["table_name"], kwargs["host"],
+                           kwargs["db"], kwargs["port"], kwargs["user"])
+    except Exception, e:
+        error = str(e)
+        try:
+            conn.rollback()
+        except Exception:
+            # The connection may be unusable; report the original error.
+            pass
+    return dict(data_id=str(data_ref.dataId), pid=os.getpid(),
+                rows=task.counters["rows"], bytes=task.counters["bytes"],
+                time=time.time() - start, error=error)
+
 
 class IngestCatalogTask(pipe_base.CmdLineTask):
     r"""A |task| for ingesting an |afw catalog| into a MySQL table.
@@ -387,24 +1320,41 @@ class IngestCatalogTask(pipe_base.CmdLineTask):
     explicitly or by passing the name of a FITS file containing the catalog.
     Both, like :meth:`.run`, require database connection information.
 
+    Many catalogs with the same schema (e.g. patch-level catalogs) are more
+    efficiently ingested by :meth:`.ingest_many`, which uses one connection
+    and does all table, view and formatting setup once. From the command
+    line, this is enabled by setting |single_session| to ``True``.
+
     The ingestion process creates the destination table in the database if it
     doesn't already exist.  The database schema is translated from the input
     catalog's |schema|, and may contain a (configurable) unique identifier
-    field.  The only index provided is a unique one on this field.  (Additional
-    ones can be created later, of course.)  Additionally, a database view that
-    provides the field aliases of the input catalog's schema can be created.
-
-    Rows are inserted into the database via ``INSERT`` statements.  As many
-    rows as possible are packed into each ``INSERT`` to maximize throughput.
-    The limit on ``INSERT`` statement length is either set by configuration or
-    determined by querying the database (in a MySQL-specific way).  This may
-    not be as efficient in its use of the database as converting to CSV and
-    doing a bulk load, but it eliminates the use of (often shared) disk
-    resources.  The use of ``INSERT`` (committed once at the end) may not be
-    fully parallelizable (particularly if a unique id index exists), but tests
-    seem to indicate that it is at least not much slower to execute many
+    field.  By default, the only index provided is a unique one on this field,
+    and it is maintained while rows are loaded. For large initial loads, it is
+    usually much faster to set |defer_indexes| to ``True``: the table is then
+    created without the index, which is added (after a check for duplicate
+    ids) once loading is complete. Further indexes can be built after loading
+    via |extra_indexes|. Additionally, a database view that provides the field
+    aliases of the input catalog's schema can be created.
+
+    By default, rows are inserted into the database via ``INSERT`` statements.
+    As many rows as possible are packed into each ``INSERT`` to maximize
+    throughput. The limit on ``INSERT`` statement length is either set by
+    configuration or determined by querying the database (in a MySQL-specific
+    way).  The use of ``INSERT`` (committed once at the end) may not be fully
+    parallelizable (particularly if a unique id index exists), but tests seem
+    to indicate that it is at least not much slower to execute many
     ``INSERT`` statements in parallel compared with executing them all
-    sequentially. This remains an area for future optimization.
+    sequentially. Setting |num_connections| to a value greater than 1 does
+    exactly that: statements are formatted by the calling thread while a
+    pool of connections executes them. The connections take part in a single
+    XA transaction, so the ingest is still committed (or rolled back) as a
+    whole.
+
+    Alternatively, setting |ingest_mode| to ``"load_data"`` converts the
+    catalog to tab-separated text and bulk loads it with a single ``LOAD DATA
+    LOCAL INFILE`` statement. The text is streamed to the database client
+    library through a named pipe, so, as for ``INSERT``, no (often shared)
+    disk resources are used. The server must allow ``local_infile``.
 
     The important |configuration| parameters are:
 
@@ -444,16 +1394,53 @@ class IngestCatalogTask(pipe_base.CmdLineTask):
 
     .. |canonicalized|  replace:: :func:`.canonicalize_field_name`
     .. |DbAuth|         replace:: :class:`~lsst.daf.persistence.DbAuth`
+    .. |defer_indexes|  replace:: :attr:`~.IngestCatalogConfig.defer_indexes`
     .. |extra_columns|  replace:: :attr:`~.IngestCatalogConfig.extra_columns`
+    .. |extra_indexes|  replace:: :attr:`~.IngestCatalogConfig.extra_indexes`
     .. |id_field_name|  replace:: :attr:`~.IngestCatalogConfig.id_field_name`
+    .. |ingest_mode|    replace:: :attr:`~.IngestCatalogConfig.ingest_mode`
     .. |max_column_len| replace:: :attr:`~.IngestCatalogConfig.max_column_len`
+    .. |num_connections| replace:: :attr:`~.IngestCatalogConfig.num_connections`
     .. |remap|          replace:: :attr:`~.IngestCatalogConfig.remap`
+    .. |single_session| replace:: :attr:`~.IngestCatalogConfig.single_session`
     """
 
     ConfigClass = IngestCatalogConfig
     _DefaultName = "ingest_catalog"
     RunnerClass = IngestCatalogRunner
 
+    def __init__(self, *args, **kwargs):
+        """Construct the task, and zero its statistics counters.
+
+        The ``counters`` attribute is a :class:`~collections.Counter`
+        recording:
+
+        - the number of ``"rows"`` formatted,
+        - the number of ``"bytes"`` of SQL (or tab-separated text, in
+          ``load_data`` mode) generated,
+        - the number of ``"statements"`` executed (``executemany`` calls,
+          in ``executemany`` mode),
+        - and the time, in seconds, spent in each phase of ingestion:
+          ``"read_time"`` (reading catalogs), ``"ddl_time"`` (creating
+          tables and views), ``"format_time"`` (converting records to SQL),
+          ``"execute_time"`` (sending statements to, and executing them on,
+          the server), ``"commit_time"`` and ``"index_time"`` (building
+          deferred indexes).
+
+        Formatting and execution overlap when |ingest_mode| is
+        ``"load_data"`` or |num_connections| is greater than 1, and
+        execution times are summed over connections, so phase times may add
+        up to more than the wall clock time.
+
+        .. |ingest_mode| replace:: :attr:`~.IngestCatalogConfig.ingest_mode`
+        .. |num_connections| replace::
+            :attr:`~.IngestCatalogConfig.num_connections`
+        """
+        pipe_base.CmdLineTask.__init__(self, *args, **kwargs)
+        self.counters = Counter()
+        self._counters_lock = threading.Lock()
+        self._recording = False
+
     @classmethod
     def _makeArgumentParser(cls):
         """Extend the default argument parser.
@@ -489,25 +1476,84 @@ class IngestCatalogTask(pipe_base.CmdLineTask):
 
     def run_file(self, file_name, table_name, host, db,
                  port=3306, user=None, view_name=None):
-        """Ingest an |afw catalog| specified by a filename."""
-        cat = afw_table.BaseCatalog.readFits(file_name)
-        self.ingest(cat, table_name, host, db, port, user, view_name)
+        """Ingest an |afw catalog| specified by a filename.
+
+        If the |stream_fits| configuration parameter is ``True``, the catalog
+        is streamed from the file via a :class:`.FitsCatalogStream`.
+
+        .. |stream_fits| replace:: :attr:`~.IngestCatalogConfig.stream_fits`
+        """
+        with self._recording_metrics(table_name, file_name):
+            with self._timed("read"):
+                if self.config.stream_fits:
+                    cat = FitsCatalogStream(file_name)
+                else:
+                    cat = afw_table.BaseCatalog.readFits(file_name)
+            self.ingest(cat, table_name, host, db, port, user, view_name)
 
     def run(self, data_ref, dstype, table_name, host, db,
-            port=3306, user=None, view_name=None):
+            port=3306, user=None, view_name=None, build_indexes=True):
         """Ingest an |afw catalog| specified by a data ref and dataset type."""
-        self.ingest(data_ref.get(dstype), table_name, host, db,
-                    port, user, view_name)
+        with self._recording_metrics(table_name, data_ref.dataId):
+            with self._timed("read"):
+                cat = data_ref.get(dstype)
+            self.ingest(cat, table_name, host, db,
+                        port, user, view_name, build_indexes)
+
+    def run_many(self, data_refs, dstype, table_name, host, db,
+                 port=3306, user=None, view_name=None, build_indexes=True):
+        """Ingest the |afw catalog| for each of a sequence of data refs.
+
+        See :meth:`.ingest_many`.
+        """
+        self.ingest_many(
+            [functools.partial(data_ref.get, dstype) for data_ref in data_refs],
+            table_name, host, db, port, user, view_name, build_indexes)
+
+    @timeMethod
+    def ingest_many(self, cats, table_name, host, db,
+                    port=3306, user=None, view_name=None, build_indexes=True):
+        """Ingest many catalogs with identical schemas in one session.
+
+        A single database connection is used for all catalogs, and the
+        destination table and view are created (and the maximum query length
+        determined) only once. The catalogs are then ingested as one stream
+        of records, which is committed every |commit_interval| catalogs.
+
+        Parameters
+        ----------
+
+        cats : iterable
+            The catalogs to ingest, specified as for :class:`.CatalogBatch`.
+            If the |stream_fits| configuration parameter is ``True``,
+            catalogs specified by file name are streamed.
+
+        table_name, host, db, port, user, view_name, build_indexes
+            See :meth:`.ingest`.
+
+        .. |commit_interval| replace::
+            :attr:`~.IngestCatalogConfig.commit_interval`
+        .. |stream_fits| replace:: :attr:`~.IngestCatalogConfig.stream_fits`
+        """
+        cats = list(cats)
+        if not cats:
+            return
+        interval = self.config.commit_interval or len(cats)
+        batches = (CatalogBatch(cats[i:i + interval], self.config.stream_fits)
+                   for i in xrange(0, len(cats), interval))
+        with self._recording_metrics(table_name):
+            self._ingest_batches(batches, table_name, host, db,
+                                 port, user, view_name, build_indexes)
 
     @timeMethod
     def ingest(self, cat, table_name, host, db,
-               port=3306, user=None, view_name=None):
+               port=3306, user=None, view_name=None, build_indexes=True):
         """Ingest an |afw catalog| passed as an object.
 
         Parameters
         ----------
 
-        cat : lsst.afw.table.BaseCatalog or subclass
+        cat : lsst.afw.table.BaseCatalog or subclass, FitsCatalogStream or CatalogBatch
             Catalog to ingest.
 
         table_name : str
@@ -527,35 +1573,326 @@ class IngestCatalogTask(pipe_base.CmdLineTask):
 
         view_name : str
             Name of the database view to create.
+
+        build_indexes : bool
+            If ``True``, build the indexes that are deferred until after
+            loading (see :meth:`.build_indexes`). Pass ``False`` when more
+            catalogs will be ingested into the same table, and call
+            :meth:`.build_indexes` once they have all been ingested.
+        """
+        with self._recording_metrics(table_name):
+            self._ingest_batches([cat], table_name, host, db,
+                                 port, user, view_name, build_indexes)
+
+    def _ingest_batches(self, cats, table_name, host, db,
+                        port=3306, user=None, view_name=None,
+                        build_indexes=True):
+        """Ingest catalogs with identical schemas over one connection.
+
+        The destination table and view are created from the schema of the
+        first catalog. Each catalog is then ingested (and committed) in turn
+        by the configured ingest mode. Finally, deferred indexes are built if
+        `build_indexes` is ``True``.
+        """
+        quoted_table_name = quote_mysql_identifier(table_name)
+        view_name = quote_mysql_identifier(view_name) if view_name else None
+        load_data = self.config.ingest_mode == "load_data"
+        with closing(self.connect(host, port, db, user,
+                                  local_infile=load_data)) as conn:
+            max_query_len = None
+            for i, cat in enumerate(cats):
+                if i == 0:
+                    self._create_table(conn, quoted_table_name, cat.schema)
+                    if view_name is not None:
+                        self._create_view(conn, quoted_table_name, view_name,
+                                          cat.schema)
+                    if not load_data:
+                        max_query_len = self._max_query_len(conn)
+                self.ingest_on(conn, cat, table_name, host, db, port, user,
+                               max_query_len)
+            if build_indexes:
+                self._build_indexes(conn, quoted_table_name)
+
+    def build_indexes(self, table_name, host, db, port=3306, user=None):
+        """Build the indexes that are deferred until after loading.
+
+        If the |defer_indexes| configuration parameter is ``True``, the table
+        is checked for duplicate IDs and a unique index on the ID column is
+        added. Indexes on the field lists in |extra_indexes| are added as
+        well. Indexes that already exist are not rebuilt, and all others are
+        added by a single ``ALTER TABLE`` statement, so that the table is
+        only scanned once.
+
+        See :meth:`.ingest` for a description of the parameters.
+
+        Raises
+        ------
+
+        RuntimeError
+            If the table contains duplicate IDs.
+
+        .. |defer_indexes| replace::
+            :attr:`~.IngestCatalogConfig.defer_indexes`
+        .. |extra_indexes| replace::
+            :attr:`~.IngestCatalogConfig.extra_indexes`
+        """
+        with closing(self.connect(host, port, db, user)) as conn:
+            self._build_indexes(conn, quote_mysql_identifier(table_name))
+
+    def setup_database(self, schema, table_name, host, db,
+                       port=3306, user=None, view_name=None):
+        """Create the table (and view) for catalogs with the given |schema|.
+
+        Nothing is done to a table that already exists. See :meth:`.ingest`
+        for a description of the parameters.
         """
         table_name = quote_mysql_identifier(table_name)
         view_name = quote_mysql_identifier(view_name) if view_name else None
         with closing(self.connect(host, port, db, user)) as conn:
-            # Determine the maximum query length (MySQL-specific) if not
-            # configured.
-            if self.config.max_query_len is None:
-                with closing(conn.cursor()) as cursor:
-                    cursor.execute(
-                        """SELECT variable_value
-                        FROM information_schema.session_variables
-                        WHERE variable_name = 'max_allowed_packet'
-                        """
-                    )
-                    max_query_len = int(cursor.fetchone()[0])
-            else:
-                max_query_len = self.config.max_query_len
-            self.log.debug("max_query_len: %d", max_query_len)
-            self._create_table(conn, table_name, cat.schema)
+            self._create_table(conn, table_name, schema)
             if view_name is not None:
-                self._create_view(conn, table_name, view_name, cat.schema)
+                self._create_view(conn, table_name, view_name, schema)
+
+    def ingest_on(self, conn, cat, table_name, host, db,
+                  port=3306, user=None, max_query_len=None):
+        """Ingest a catalog over an existing connection.
+
+        The destination table must already exist (see :meth:`.setup_database`).
+        The catalog is ingested by the configured ingest mode and committed.
+
+        Parameters
+        ----------
+
+        conn : MySQLdb.Connection
+            A connection obtained from :meth:`.connect`. In ``load_data``
+            mode, it must allow ``LOAD DATA LOCAL INFILE``.
+
+        cat, table_name, host, db, port, user
+            See :meth:`.ingest`. The connection information is only used if
+            additional connections are required.
+
+        max_query_len : int
+            The maximum length of a query string. If ``None``, it is
+            determined as described for |max_query_len|.
+
+        .. |max_query_len| replace:: :attr:`~.IngestCatalogConfig.max_query_len`
+        """
+        table_name = quote_mysql_identifier(table_name)
+        if self.config.ingest_mode == "load_data":
+            self._load_data(conn, cat, table_name)
+            return
+        if max_query_len is None:
+            max_query_len = self._max_query_len(conn)
+        if self.config.ingest_mode == "executemany":
+            self._executemany(conn, cat, table_name, max_query_len)
+        elif self.config.num_connections > 1:
+            self._ingest_parallel(lambda: self.connect(host, port, db, user),
+                                  cat, table_name, max_query_len)
+        else:
             self._ingest(conn, cat, table_name, max_query_len)
 
+    @contextmanager
+    def _timed(self, phase):
+        """Add the time spent in the context to the counter for `phase`."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            with self._counters_lock:
+                self.counters[phase + "_time"] += elapsed
+
+    @contextmanager
+    def _recording_metrics(self, table_name, source=None):
+        """Record ingest metrics for the work done in the context.
+
+        If the context exits normally, the changes to :attr:`counters` made
+        inside it, the elapsed time, and the throughput figures derived from
+        them (see :meth:`._metrics`) are stored in the task metadata and
+        appended to the |metrics_file|. Nested contexts are ignored, so that
+        a single record is produced per (outermost) ingest call.
+
+        Parameters
+        ----------
+
+        table_name : str
+            Name of the table being ingested into.
+
+        source : object
+            A description of what is being ingested (e.g. a data id or file
+            name), or ``None``.
+
+        .. |metrics_file| replace:: :attr:`~.IngestCatalogConfig.metrics_file`
+        """
+        if self._recording:
+            yield
+            return
+        self._recording = True
+        before = Counter(self.counters)
+        start = time.time()
+        try:
+            yield
+        finally:
+            self._recording = False
+        counters = Counter(self.counters)
+        counters.subtract(before)
+        metrics = self._metrics(counters, time.time() - start)
+        for name, value in sorted(metrics.iteritems()):
+            self.metadata.set("ingest_" + name, value)
+        self.log.info(
+            "Ingested %d rows (%d bytes, %d statements) into %s in %.3f s: "
+            "read %.3f s, ddl %.3f s, format %.3f s, execute %.3f s, "
+            "commit %.3f s, index %.3f s" % (
+                metrics["rows"], metrics["bytes"], metrics["statements"],
+                table_name, metrics["elapsed"], metrics["read_time"],
+                metrics["ddl_time"], metrics["format_time"],
+                metrics["execute_time"], metrics["commit_time"],
+                metrics["index_time"]))
+        if self.config.metrics_file:
+            record = dict(metrics)
+            record.update(
+                timestamp=time.time(),
+                table=table_name,
+                source=None if source is None else str(source),
+                ingest_mode=self.config.ingest_mode,
+                num_connections=self.config.num_connections,
+                block_size=self.config.block_size,
+            )
+            with open(self.config.metrics_file, "a") as f:
+                f.write(json.dumps(record, sort_keys=True) + "\n")
+
+    @staticmethod
+    def _metrics(counters, elapsed):
+        """Return a dict of ingest metrics, given counter values and the
+        elapsed wall clock time (seconds).
+
+        In addition to the counters described in :meth:`.__init__` and the
+        elapsed time, the metrics include ``rows_per_sec`` (overall
+        throughput), ``format_rows_per_sec`` (formatting throughput),
+        ``bytes_per_sec`` and ``sec_per_statement`` (mean statement
+        execution time).
+        """
+        metrics = dict(elapsed=elapsed)
+        for name in ("rows", "bytes", "statements"):
+            metrics[name] = int(counters[name])
+        for phase in ("read", "ddl", "format", "execute", "commit", "index"):
+            metrics[phase + "_time"] = float(counters[phase + "_time"])
+
+        def ratio(numerator, denominator):
+            return numerator / denominator if denominator > 0 else 0.0
+
+        metrics["rows_per_sec"] = ratio(metrics["rows"], elapsed)
+        metrics["bytes_per_sec"] = ratio(metrics["bytes"], elapsed)
+        metrics["format_rows_per_sec"] = ratio(metrics["rows"],
+                                               metrics["format_time"])
+        metrics["sec_per_statement"] = ratio(metrics["execute_time"],
+                                             metrics["statements"])
+        return metrics
+
+    def _build_indexes(self, conn, table_name):
+        """Add deferred and extra indexes to a table that has been loaded."""
+        if not (self.config.defer_indexes or self.config.extra_indexes):
+            return
+        with closing(conn.cursor()) as cursor:
+            cursor.execute("SHOW COLUMNS FROM " + table_name)
+            columns = set(row[0] for row in cursor.fetchall())
+            # Map each existing index to its (ordered) columns.
+            cursor.execute("SHOW INDEX FROM " + table_name)
+            indexes = {}
+            unique_keys = set()
+            for row in cursor.fetchall():
+                non_unique, key_name, seq, column = row[1:5]
+                indexes.setdefault(key_name, []).append((seq, column))
+                if not int(non_unique):
+                    unique_keys.add(key_name)
+            indexed = dict((k, tuple(c for _, c in sorted(v)))
+                           for k, v in indexes.iteritems())
+            unique = set(indexed[k] for k in unique_keys)
+            indexed = set(indexed.itervalues())
+        clauses = []
+        if self.config.defer_indexes and self.config.id_field_name:
+            id_column = self._column_name(self.config.id_field_name)
+            if id_column.strip("`") not in columns:
+                self.log.warn(
+                    "No column matches the configured unique ID field name "
+                    "(%s)", self.config.id_field_name)
+            elif (id_column.strip("`"),) not in unique:
+                with self._timed("index"):
+                    self._check_unique(conn, table_name, id_column)
+                clauses.append("ADD UNIQUE({})".format(id_column))
+        for field_names in self.config.extra_indexes:
+            index_columns = [self._column_name(f.strip())
+                             for f in field_names.split(",")]
+            if tuple(c.strip("`") for c in index_columns) in indexed:
+                continue
+            missing = [c for c in index_columns if c.strip("`") not in columns]
+            if missing:
+                raise RuntimeError(
+                    "Cannot index {}: no such column(s) {}".format(
+                        field_names, ", ".join(missing)))
+            clauses.append("ADD INDEX({})".format(",".join(index_columns)))
+        if clauses:
+            start = time.time()
+            with self._timed("index"):
+                self._execute_sql(conn, "ALTER TABLE {}\n\t{}".format(
+                    table_name, ",\n\t".join(clauses)))
+            self.log.info("Built %d index(es) on %s in %.3f s" % (
+                len(clauses), table_name, time.time() - start))
+
+    def _check_unique(self, conn, table_name, column):
+        """Raise if `column` of a table contains duplicate values.
+
+        A few of the duplicated values are included in the error message.
+        """
+        duplicates = ("SELECT {0} AS value, COUNT(*) AS n FROM {1} "
+                      "WHERE {0} IS NOT NULL GROUP BY {0} "
+                      "HAVING COUNT(*) > 1").format(column, table_name)
+        with closing(conn.cursor()) as cursor:
+            cursor.execute(
+                "SELECT COUNT(*), SUM(n) FROM ({}) AS d".format(duplicates))
+            num_values, num_rows = cursor.fetchall()[0]
+            if not num_values:
+                return
+            cursor.execute(duplicates + " ORDER BY n DESC LIMIT 10")
+            examples = ", ".join("{} ({} rows)".format(value, count)
+                                 for value, count in cursor.fetchall())
+        raise RuntimeError(
+            "Cannot create a unique index on {} of {}: {} values are shared "
+            "by {} rows in total, e.g. {}".format(
+                column, table_name, num_values, int(num_rows), examples))
+
+    def _max_query_len(self, conn):
+        """Return the maximum length of a query string.
+
+        The maximum is determined in a MySQL-specific way if it is not
+        configured.
+        """
+        if self.config.max_query_len is None:
+            with closing(conn.cursor()) as cursor:
+                cursor.execute(
+                    """SELECT variable_value
+                    FROM information_schema.session_variables
+                    WHERE variable_name = 'max_allowed_packet'
+                    """
+                )
+                max_query_len = int(cursor.fetchone()[0])
+        else:
+            max_query_len = self.config.max_query_len
+        self.log.debug("max_query_len: %d", max_query_len)
+        return max_query_len
+
     @staticmethod
-    def connect(host, port, db, user=None):
-        """Connect to the specified MySQL database server."""
+    def connect(host, port, db, user=None, local_infile=False):
+        """Connect to the specified MySQL database server.
+
+        If `local_infile` is ``True``, the connection is allowed to run
+        ``LOAD DATA LOCAL INFILE`` statements.
+        """
         kwargs = dict(host=host, port=port, db=db)
         if user is not None:
             kwargs["user"] = user
+        if local_infile:
+            kwargs["local_infile"] = 1
         try:
             # See if we can connect without a password (e.g. via my.cnf)
             return MySQLdb.connect(**kwargs)
@@ -570,6 +1907,18 @@ class IngestCatalogTask(pipe_base.CmdLineTask):
         self.log.debug(sql)
         conn.query(sql)
 
+    def _execute_statement(self, conn, sql):
+        """Execute a statement that loads rows, and record its timing."""
+        with self._timed("execute"):
+            self._execute_sql(conn, sql)
+        with self._counters_lock:
+            self.counters["statements"] += 1
+
+    def _commit(self, conn):
+        """Commit the current transaction of `conn`, and record its timing."""
+        with self._timed("commit"):
+            conn.commit()
+
     def _schema_items(self, schema):
         """Yield ingestible schema items."""
         for item in schema:
@@ -592,36 +1941,298 @@ class IngestCatalogTask(pipe_base.CmdLineTask):
         REPLACE statements, executing those statements, and committing the
         result.
         """
+        for sql in self._statements(cat, table_name, max_query_len):
+            self._execute_statement(conn, sql)
+        self._commit(conn)
+
+    def _ingest_parallel(self, connect, cat, table_name, max_query_len):
+        """Ingest an afw catalog using several database connections.
+
+        The calling thread converts the catalog to INSERT or REPLACE
+        statements and places them in a bounded queue, from which one worker
+        thread per connection executes them. Each connection runs its
+        statements inside a branch of an XA transaction. The branches are
+        prepared once all statements have been executed, and are committed
+        only if every branch was successfully prepared.
+
+        If formatting or executing any statement fails, or if any branch
+        cannot be prepared, then no more statements are executed, all
+        branches are rolled back, and the first error is re-raised.
+
+        Parameters
+        ----------
+
+        connect : callable
+            Returns a new database connection when called with no arguments.
+
+        cat : lsst.afw.table.BaseCatalog or subclass, FitsCatalogStream or CatalogBatch
+            Catalog to ingest.
+
+        table_name : str
+            Quoted name of the database table to insert into.
+
+        max_query_len : int
+            Maximum length of a statement.
+        """
+        gtrid = uuid.uuid4().hex
+        branches = []
+        try:
+            for i in xrange(self.config.num_connections):
+                conn = connect()
+                branches.append((conn, "'{}_{}'".format(gtrid, i)))
+                self._execute_sql(conn, "XA START " + branches[-1][1])
+        except:
+            self._rollback_branches(branches)
+            raise
+        statements = Queue.Queue(maxsize=self.config.max_queued_statements)
+        errors = []
+
+        def execute(conn):
+            # Drain the queue until the end marker is seen, even after a
+            # failure, so that the producer never blocks indefinitely.
+            while True:
+                sql = statements.get()
+                if sql is None:
+                    return
+                if errors:
+                    continue
+                try:
+                    self._execute_statement(conn, sql)
+                except Exception, e:
+                    errors.append(e)
+
+        workers = [threading.Thread(target=execute, args=(conn,),
+                                    name="ingest_worker_{}".format(i))
+                   for i, (conn, _) in enumerate(branches)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        try:
+            for sql in self._statements(cat, table_name, max_query_len):
+                if errors:
+                    break
+                statements.put(sql)
+        except Exception, e:
+            errors.append(e)
+        finally:
+            for _ in workers:
+                statements.put(None)
+            for worker in workers:
+                worker.join()
+        try:
+            if errors:
+                raise errors[0]
+            with self._timed("commit"):
+                for conn, xid in branches:
+                    self._execute_sql(conn, "XA END " + xid)
+                    self._execute_sql(conn, "XA PREPARE " + xid)
+        except:
+            self._rollback_branches(branches)
+            raise
+        # All branches are prepared, so a commit failure can only be caused
+        # by a lost connection or server. The affected branches stay prepared
+        # on the server, and can be committed with XA RECOVER and XA COMMIT.
+        uncommitted = []
+        for conn, xid in branches:
+            try:
+                with self._timed("commit"):
+                    self._execute_sql(conn, "XA COMMIT " + xid)
+            except Exception, e:
+                self.log.fatal("Failed to commit XA transaction %s: %s",
+                               xid, e)
+                uncommitted.append(xid)
+            finally:
+                conn.close()
+        if uncommitted:
+            raise RuntimeError(
+                "Prepared XA transactions {} could not be committed".format(
+                    ", ".join(uncommitted)))
+
+    def _executemany(self, conn, cat, table_name, max_query_len):
+        """Ingest an afw catalog with a parameterized INSERT statement.
+
+        Field values are converted to typed Python values a column at a time,
+        and passed to ``cursor.executemany`` in blocks of |block_size| rows.
+        Non-finite floating point values are passed as ``None``, and arrays
+        as packed byte strings, so that the stored values are identical to
+        those produced by the literal SQL formatters.
+
+        .. |block_size| replace:: :attr:`~.IngestCatalogConfig.block_size`
+        """
+        codec = self._codec(cat.schema)
+        sql = "REPLACE" if self.config.allow_replace else "INSERT"
+        sql += " INTO {} ({}) VALUES ({})".format(
+            table_name.replace("%", "%%"),
+            ",".join(codec.column_names).replace("%", "%%"),
+            ",".join(["%s"] * len(codec.items)))
+        self.log.debug(sql)
+        # The float encoder is only replaced while this catalog is ingested,
+        # so that other users of the connection are unaffected.
+        float_encoder = conn.encoders.get(float)
+        conn.encoders[float] = _float_literal
+        try:
+            with closing(conn.cursor()) as cursor:
+                # MySQLdb rewrites executemany() INSERTs into multi-row
+                # INSERTs no longer than this.
+                cursor.max_stmt_length = max_query_len
+                for _, columns in self._format_columns(
+                        cat, codec.items, codec.parameter_formats):
+                    with self._timed("execute"):
+                        cursor.executemany(sql, zip(*columns))
+                    with self._counters_lock:
+                        self.counters["statements"] += 1
+        finally:
+            if float_encoder is None:
+                del conn.encoders[float]
+            else:
+                conn.encoders[float] = float_encoder
+        self._commit(conn)
+
+    def _rollback_branches(self, branches):
+        """Roll back and close the XA transaction branches of a failed ingest.
+
+        Failures are logged rather than raised, so that the error that caused
+        the rollback is the one reported.
+        """
+        for conn, xid in branches:
+            try:
+                try:
+                    self._execute_sql(conn, "XA END " + xid)
+                except Exception:
+                    # The branch has already been ended (or even prepared).
+                    pass
+                self._execute_sql(conn, "XA ROLLBACK " + xid)
+            except Exception, e:
+                self.log.warn("Failed to roll back XA transaction %s: %s",
+                              xid, e)
+            finally:
+                conn.close()
+
+    def _statements(self, cat, table_name, max_query_len):
+        """Return a generator over INSERT or REPLACE statements for a catalog.
+
+        Each statement is at most `max_query_len` characters long.
+        """
         sql_prefix = "REPLACE" if self.config.allow_replace else "INSERT"
         sql_prefix += " INTO {} (".format(table_name)
-        keys = []
-        column_names = []
-        for item in self._schema_items(cat.schema):
-            keys.append((item.key, field_formatters[item.field.getTypeString()]))
-            column_names.append(self._column_name(item.field.getName()))
-        sql_prefix += ",".join(column_names)
+        sql_prefix += ",".join(self._codec(cat.schema).column_names)
         sql_prefix += ") VALUES "
-        pos = 0
-        while pos < len(cat):
-            sql = sql_prefix
-            initial_pos = pos
-            max_value_len = max_query_len - len(sql)
-            while pos < len(cat):
-                row = cat[pos]
-                value = "("
-                value += ",".join([f.format_value(row.get(k)) for (k, f) in keys])
-                value += "),"
-                max_value_len -= len(value)
-                if max_value_len < 0:
-                    break
-                else:
-                    sql += value
-                    pos += 1
-            if pos == initial_pos:
-                # Have not made progress
-                raise RuntimeError("Single row is too large to insert")
-            self._execute_sql(conn, sql[:-1])
-        conn.commit()
+        rows = self._format_rows(cat)
+        return self._counted(_insert_statements(sql_prefix, rows, max_query_len))
+
+    def _counted(self, strings):
+        """Add the lengths of `strings` to the bytes counter as they are yielded."""
+        for string in strings:
+            with self._counters_lock:
+                self.counters["bytes"] += len(string)
+            yield string
+
+    def _load_data(self, conn, cat, table_name):
+        """Ingest an afw catalog with ``LOAD DATA LOCAL INFILE``.
+
+        The catalog is converted to tab-separated text, which is streamed to
+        the server through a named pipe. Binary array and flag columns are
+        loaded into user variables and converted with a ``SET`` clause.
+
+        When the ``LOCAL`` keyword is used, the server ignores (rather than
+        fails on) rows with duplicate unique ids. To preserve the semantics
+        of ``INSERT``, an error is raised and nothing is committed if any row
+        was skipped.
+        """
+        codec = self._codec(cat.schema)
+        lines = self._counted(self._format_infile_lines(cat))
+        with _infile_pipe(lines) as path:
+            sql = "LOAD DATA LOCAL INFILE " + _format_string(path)
+            if self.config.allow_replace:
+                sql += " REPLACE"
+            sql += (" INTO TABLE {} CHARACTER SET binary\n"
+                    "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\'\n"
+                    "LINES TERMINATED BY '\\n'\n({})").format(
+                        table_name, ",".join(codec.infile_targets))
+            if codec.infile_assignments:
+                sql += "\nSET " + ",".join(codec.infile_assignments)
+            self._execute_statement(conn, sql)
+        info = conn.info()
+        self.log.debug("LOAD DATA result: %s", info)
+        match = re.search(r"Skipped:\s*(\d+)", info or "")
+        if match is not None and int(match.group(1)) != 0:
+            conn.rollback()
+            raise RuntimeError(
+                "{} rows were skipped while loading {}, most likely because "
+                "they have duplicate unique ids. Set allow_replace to replace "
+                "existing rows.".format(match.group(1), table_name))
+        self._commit(conn)
+
+    def _format_columns(self, cat, items, format_callables):
+        """Yield formatted columns for blocks of records in an afw catalog.
+
+        Each field is extracted as a column of at most |block_size| values
+        (see :func:`._catalog_column`), which is formatted with a single call
+        to the corresponding element of `format_callables`.  A list of
+        formatted columns is yielded per block.
+
+        .. |block_size| replace:: :attr:`~.IngestCatalogConfig.block_size`
+        """
+        if isinstance(cat, (FitsCatalogStream, CatalogBatch)):
+            blocks = cat.column_blocks(items, self.config.block_size)
+        else:
+            blocks = _catalog_column_blocks(cat, items, self.config.block_size)
+        blocks = iter(blocks)
+        while True:
+            # Extracting columns may involve reading catalogs from disk.
+            with self._timed("read"):
+                block = next(blocks, None)
+            if block is None:
+                return
+            n, columns = block
+            with self._counters_lock:
+                self.counters["rows"] += n
+            with self._timed("format"):
+                formatted = [f(c) for (f, c) in izip(format_callables, columns)]
+            yield n, formatted
+
+    def _format_rows(self, cat):
+        """Yield SQL literals for the records of an afw catalog.
+
+        Rather than dispatching on every field of every record, each field is
+        formatted a column at a time with :meth:`.FieldFormatter.format_column`.
+        Rows are then assembled from the pre-formatted columns by the codec
+        for the catalog schema.
+        """
+        codec = self._codec(cat.schema)
+        for n, formatted in self._format_columns(cat, codec.items,
+                                                 codec.sql_formats):
+            with self._timed("format"):
+                rows = codec.rows(n, formatted)
+            for row in rows:
+                yield row
+
+    def _format_infile_lines(self, cat):
+        """Yield tab-separated lines for blocks of records in an afw catalog."""
+        codec = self._codec(cat.schema)
+        for n, formatted in self._format_columns(cat, codec.items,
+                                                 codec.infile_formats):
+            with self._timed("format"):
+                lines = codec.lines(n, formatted)
+            yield lines
+
+    def _codec(self, schema):
+        """Return the codec for catalogs with the given |schema|.
+
+        Codecs are cached by schema fingerprint (see
+        :func:`._schema_fingerprint`), so schema analysis is only performed
+        the first time a schema is seen.
+        """
+        key = (_schema_fingerprint(schema),
+               self.config.max_column_len,
+               tuple(sorted(self.config.remap.iteritems())))
+        codec = _codec_cache.get(key)
+        if codec is None:
+            items = list(self._schema_items(schema))
+            codec = _CatalogCodec(
+                items, [self._column_name(i.field.getName()) for i in items])
+            _codec_cache.put(key, codec)
+        return codec
 
     def _column_name(self, field_name):
         """Return the SQL column name for the given afw table field."""
@@ -638,9 +2249,10 @@ class IngestCatalogTask(pipe_base.CmdLineTask):
         """Create a table corresponding to the given afw table schema.
 
         Any extra columns specified in the task config are added in. If a
-        unique id column exists, it is given a key.
+        unique id column exists, it is given a key, unless building the key
+        is deferred until after loading.
         """
-        fields = [item.field for item in self._schema_items(schema)]
+        fields = [item.field for item in self._codec(schema).items]
         names = [f.getName() for f in fields]
         equivalence_classes = {}
         for name in names:
@@ -660,15 +2272,16 @@ class IngestCatalogTask(pipe_base.CmdLineTask):
         if self.config.extra_columns:
             sql += ",\n\t" + self.config.extra_columns
         if self.config.id_field_name:
-            if self.config.id_field_name in names:
-                sql += ",\n\tUNIQUE({})".format(
-                    self._column_name(self.config.id_field_name))
-            else:
+            if self.config.id_field_name not in names:
                 self.log.warn(
                     "No field matches the configured unique ID field name "
                     "(%s)", self.config.id_field_name)
+            elif not self.config.defer_indexes:
+                sql += ",\n\tUNIQUE({})".format(
+                    self._column_name(self.config.id_field_name))
         sql += "\n)"
-        self._execute_sql(conn, sql)
+        with self._timed("ddl"):
+            self._execute_sql(conn, sql)
 
     def _create_view(self, conn, table_name, view_name, schema):
         """Create a view allowing columns to be referred to by their aliases."""
@@ -686,7 +2299,7 @@ class IngestCatalogTask(pipe_base.CmdLineTask):
         #
         # For now, construct an invalid view and fail in this case.
         mappings = sorted((s, t) for (s, t) in schema.getAliasMap().iteritems())
-        for item in self._schema_items(schema):
+        for item in self._codec(schema).items:
             field_name = item.field.getName()
             aliases = sorted(aliases_for(field_name, mappings))
             column = self._column_name(field_name)
@@ -699,4 +2312,5 @@ class IngestCatalogTask(pipe_base.CmdLineTask):
                 sql += ",\n\t{} AS {}".format(column, alias)
         sql += "\nFROM "
         sql += table_name
-        self._execute_sql(conn, sql)
+        with self._timed("ddl"):
+            self._execute_sql(conn, sql)
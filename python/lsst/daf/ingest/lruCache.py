@@ -0,0 +1,95 @@
+#
+# LSST Data Management System
+#
+# Copyright 2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+"""This module provides a small, thread-safe least-recently-used cache.
+
+:class:`.LruCache` is used to memoize expensive derived objects, such as the
+compiled per-schema codecs used for catalog ingestion, and decoded exposure
+index entries.
+"""
+from collections import OrderedDict
+import threading
+
+
+__all__ = ("LruCache",)
+
+
+class LruCache(object):
+    """A bounded mapping that evicts its least recently used entries.
+
+    Lookups and insertions are protected by a lock, so instances may be
+    shared between threads. The numbers of lookups that found (``hits``) and
+    did not find (``misses``) an entry are recorded.
+    """
+
+    def __init__(self, max_size):
+        """Create an empty cache holding at most `max_size` entries.
+
+        A `max_size` of zero disables caching.
+        """
+        if max_size < 0:
+            raise RuntimeError("Cache size must be non-negative")
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Return the number of cached entries."""
+        return len(self._entries)
+
+    def __contains__(self, key):
+        """Return ``True`` if `key` is cached, without updating recency."""
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """Return the value cached for `key`, or `default` if there is none.
+
+        A successful lookup marks the entry as the most recently used one.
+        """
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Cache `value` for `key`, evicting the least recently used entry
+        if the cache is full.
+        """
+        if self.max_size == 0:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Remove all entries. The hit and miss counts are not reset."""
+        with self._lock:
+            self._entries.clear()
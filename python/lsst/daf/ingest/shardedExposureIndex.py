@@ -0,0 +1,371 @@
+#
+# LSST Data Management System
+#
+# Copyright 2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+"""This module provides exposure indexes sharded over many SQLite 3 files.
+
+SQLite 3 supports a single writer per database, so building one large
+exposure index (see :mod:`.indexExposure`) serializes all writes. A sharded
+index is instead a set of ordinary exposure index files (shards), each of
+which has its own writer. Shards can be assigned to workers (e.g. one file
+per node), or to regions of the sky via :func:`.store_exposure_info_sharded`,
+which assigns exposures to shards by the HTM pixel containing their centroid.
+
+:class:`.ShardedExposureIndex` answers spatial queries over all shards,
+skipping shards whose contents cannot intersect a query region, and
+optionally querying shards in parallel threads. Finally,
+:func:`.merge_exposure_indexes` compacts shards into a single exposure index
+(see also ``mergeExposureIndexes.py``).
+
+Shards are expected to contain disjoint sets of exposures; if an exposure
+appears in more than one shard, query results contain it more than once.
+"""
+from collections import defaultdict
+import glob
+from multiprocessing.pool import ThreadPool
+import os
+
+from lsst.sphgeom import ConvexPolygon, HtmPixelization
+from lsst.daf.ingest.indexExposure import (
+    create_exposure_tables,
+    ExposureIndexReader,
+    ExposureInfo,
+    ExposureSource,
+    store_exposure_info,
+    _connect,
+    _get_data_id_columns,
+    _get_metadata,
+    _has_table,
+    _release,
+)
+
+
+__all__ = (
+    "shard_paths",
+    "store_exposure_info_sharded",
+    "ShardedExposureIndex",
+    "merge_exposure_indexes",
+)
+
+
+"""File name extension of exposure index shards."""
+_shard_extension = ".sqlite3"
+
+
+def shard_paths(shards):
+    """Return the sorted list of shard file names in a directory, or
+    `shards` itself if it is a list of file names.
+    """
+    if isinstance(shards, basestring):
+        return sorted(glob.glob(os.path.join(shards, "*" + _shard_extension)))
+    return list(shards)
+
+
+def store_exposure_info_sharded(directory, allow_replace, exposure_info,
+                                level=3, batch_size=10000, profile="append",
+                                **kwargs):
+    """Store exposure information in shards partitioned by sky region.
+
+    Each exposure is stored in the shard named after the HTM pixel (at the
+    given subdivision level) containing the centroid of its boundary, e.g.
+    ``htm3_1234.sqlite3``. Shards are created as needed. Processes storing
+    exposures from different parts of the sky therefore do not contend for
+    database locks. Note that re-indexing an exposure only replaces its
+    previous entry (when `allow_replace` is ``True``) if its centroid
+    remains in the same pixel.
+
+    Parameters
+    ----------
+
+    directory : str
+        The shard directory. It is created if necessary.
+
+    allow_replace : bool
+        See :func:`.store_exposure_info`.
+
+    exposure_info : iterable
+        :class:`.ExposureInfo` objects (or ``None`` entries, which are
+        skipped).
+
+    level : int
+        The HTM subdivision level used to assign exposures to shards. Level
+        ``L`` yields at most ``8 * 4**L`` shards.
+
+    batch_size : int
+        The maximum number of exposures buffered per shard before they are
+        stored. Zero or less buffers all exposures.
+
+    profile : str
+        The name of the :data:`~lsst.daf.ingest.indexExposure.sqlite_profiles`
+        entry used to write shards.
+
+    kwargs
+        Passed to :func:`.create_exposure_tables` when creating shards.
+
+    Returns
+    -------
+
+    dict
+        A mapping from shard file name to the number of exposures stored in
+        it.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    pixelization = HtmPixelization(level)
+    batches = defaultdict(list)
+    counts = defaultdict(int)
+
+    def flush(path):
+        if path not in counts:
+            create_exposure_tables(path, profile=profile, **kwargs)
+        store_exposure_info(path, allow_replace, batches[path],
+                            profile=profile)
+        counts[path] += len(batches[path])
+        del batches[path]
+
+    for info in exposure_info:
+        if info is None:
+            continue
+        centroid = ConvexPolygon.decode(info.boundary).getCentroid()
+        path = os.path.join(directory, "htm{}_{}{}".format(
+            level, pixelization.index(centroid), _shard_extension))
+        batches[path].append(info)
+        if batch_size > 0 and len(batches[path]) >= batch_size:
+            flush(path)
+    for path in batches.keys():
+        flush(path)
+    return dict(counts)
+
+
+class _Shard(object):
+    """A reader for one shard, and the bounding box of its exposures."""
+
+    def __init__(self, path, cache_size):
+        # Shards are queried from pool threads, but never from two threads
+        # at once.
+        self.conn = _connect(path, "serve", check_same_thread=False)
+        self.reader = ExposureIndexReader(self.conn, cache_size)
+        self._version = None
+        self._bbox = None
+
+    def bbox(self):
+        """Return the bounding box (x_min, x_max, y_min, y_max, z_min, z_max)
+        of all exposures in the shard, or ``None`` if it is empty.
+
+        The box is recomputed whenever the shard changes.
+        """
+        row = self.conn.execute("PRAGMA data_version").fetchone()
+        version = (None if row is None else row[0], self.conn.total_changes)
+        if version != self._version:
+            bbox = self.conn.execute(
+                "SELECT MIN(x_min), MAX(x_max), MIN(y_min), MAX(y_max),\n"
+                "       MIN(z_min), MAX(z_max)\n"
+                "FROM exposure_rtree"
+            ).fetchone()
+            self._bbox = None if bbox[0] is None else bbox
+            self._version = version
+        return self._bbox
+
+    def close(self):
+        self.reader.close()
+        self.conn.close()
+
+
+class ShardedExposureIndex(object):
+    """A query front-end for a sharded exposure index.
+
+    Queries are answered by every shard whose exposure bounding box
+    intersects the bounding box of the query region, and the results are
+    concatenated in shard order. Each shard is read with an
+    :class:`.ExposureIndexReader`, so decoded exposures are cached per shard.
+
+    Instances are not thread-safe, but can use a pool of threads to query
+    shards in parallel. The sqlite3 module releases the global interpreter
+    lock while SQLite 3 runs queries, so this pays off when there are many
+    shards, or when shards are on high-latency storage.
+
+    Instances can be used as context managers, and close all shards on exit.
+    """
+
+    def __init__(self, shards, num_threads=1, cache_size=10000):
+        """Open a sharded exposure index.
+
+        Parameters
+        ----------
+
+        shards : str or list of str
+            A shard directory, or a list of shard file names.
+
+        num_threads : int
+            The number of threads used to query shards. With 1 (the
+            default), shards are queried sequentially.
+
+        cache_size : int
+            Maximum number of decoded exposures to cache per shard.
+        """
+        self.paths = shard_paths(shards)
+        self._shards = [_Shard(path, cache_size) for path in self.paths]
+        self._pool = ThreadPool(num_threads) if num_threads > 1 else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def close(self):
+        """Close all shards, and stop the query threads."""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        for shard in self._shards:
+            shard.close()
+        self._shards = []
+
+    def find_intersecting_exposures(self, region, constraints=None):
+        """Find exposures that intersect a spherical region.
+
+        See :func:`.find_intersecting_exposures`.
+        """
+        bbox = region.getBoundingBox3d()
+        x, y, z = bbox.x(), bbox.y(), bbox.z()
+        shards = []
+        for shard in self._shards:
+            b = shard.bbox()
+            if (b is not None and
+                    b[0] <= x.getB() and b[1] >= x.getA() and
+                    b[2] <= y.getB() and b[3] >= y.getA() and
+                    b[4] <= z.getB() and b[5] >= z.getA()):
+                shards.append(shard)
+
+        def query(shard):
+            return shard.reader.find_intersecting_exposures(region,
+                                                            constraints)
+        if self._pool is None or len(shards) < 2:
+            results = map(query, shards)
+        else:
+            results = self._pool.map(query, shards)
+        return [info for shard_results in results for info in shard_results]
+
+    def find_intersecting_exposures_many(self, regions, constraints=None):
+        """Find the exposures that intersect each of a sequence of regions.
+
+        See :func:`.find_intersecting_exposures_many`.
+        """
+        for region in regions:
+            yield self.find_intersecting_exposures(region, constraints)
+
+
+def _shard_exposure_info(conn):
+    """Yield the :class:`.ExposureInfo` objects (with encoded data-ids,
+    encoded polygons and source file fingerprints) stored in a shard.
+    """
+    if _has_table(conn, "exposure_source"):
+        # Pick one source file per exposure (the one stored last).
+        query = ("SELECT e.pickled_data_id, e.encoded_polygon,\n"
+                 "       s.path, s.size, s.mtime, s.checksum\n"
+                 "FROM exposure AS e LEFT JOIN (\n"
+                 "    SELECT pickled_data_id, path, size, mtime, checksum,\n"
+                 "           MAX(rowid)\n"
+                 "    FROM exposure_source GROUP BY pickled_data_id\n"
+                 ") AS s ON (s.pickled_data_id = e.pickled_data_id)\n"
+                 "ORDER BY e.rowid")
+    else:
+        query = ("SELECT pickled_data_id, encoded_polygon,\n"
+                 "       NULL, NULL, NULL, NULL\n"
+                 "FROM exposure ORDER BY rowid")
+    for row in conn.execute(query):
+        # Note that in Python 2, BLOB columns are mapped to Python buffer
+        # objects, and so a conversion to str is necessary.
+        source = None if row[2] is None else ExposureSource(*row[2:])
+        yield ExposureInfo(str(row[0]), str(row[1]), source)
+
+
+def merge_exposure_indexes(shards, database, allow_replace=False,
+                           batch_size=10000, profile="bulk-build", **kwargs):
+    """Merge exposure index shards into a single exposure index.
+
+    Parameters
+    ----------
+
+    shards : str or list of str
+        A shard directory, or a list of shard file names.
+
+    database : sqlite3.Connection or str
+        A connection to (or filename of) the output SQLite 3 database. It is
+        initialized via :func:`.create_exposure_tables` if necessary, and may
+        already contain exposures.
+
+    allow_replace : bool
+        If ``True``, exposures in later shards replace exposures with the
+        same data-id in earlier shards (or in the output database).
+        Otherwise, duplicate data-ids raise :class:`sqlite3.IntegrityError`.
+
+    batch_size : int
+        The number of exposures stored per transaction (see
+        :func:`.store_exposure_info`).
+
+    profile : str
+        The name of the :data:`~lsst.daf.ingest.indexExposure.sqlite_profiles`
+        entry used to write `database`, if it is a file name. By default,
+        the output is written as fast as possible, and cannot be read until
+        the merge is complete.
+
+    kwargs
+        Passed to :func:`.create_exposure_tables`. If ``pixelization`` and
+        ``data_id_columns`` are not given, they are copied from the first
+        shard that has them.
+
+    Returns
+    -------
+
+    int
+        The number of exposures read from the shards.
+    """
+    paths = shard_paths(shards)
+    for path in paths:
+        conn = _connect(path, "serve")
+        try:
+            pixelization, level = _get_metadata(
+                conn, "pixelization", "pixelization_level")
+            if pixelization is not None and "pixelization" not in kwargs:
+                kwargs.update(pixelization=pixelization, level=level)
+            columns = _get_data_id_columns(conn)
+            if columns and "data_id_columns" not in kwargs:
+                kwargs.update(data_id_columns=columns)
+        finally:
+            _release(conn, path)
+    kwargs.update(profile=profile)
+    create_exposure_tables(database, **kwargs)
+    num_exposures = 0
+    for path in paths:
+        conn = _connect(path, "serve")
+        try:
+            num_exposures += conn.execute(
+                "SELECT COUNT(*) FROM exposure").fetchone()[0]
+            store_exposure_info(database, allow_replace,
+                                _shard_exposure_info(conn),
+                                batch_size=batch_size, profile=profile)
+        finally:
+            _release(conn, path)
+    return num_exposures
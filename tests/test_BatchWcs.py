@@ -0,0 +1,117 @@
+#
+# LSST Data Management System
+#
+# Copyright 2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+"""Unit tests for batched exposure boundary computation."""
+
+import unittest
+
+import lsst.utils.tests
+import lsst.daf.base as daf_base
+import lsst.afw.geom as afw_geom
+import lsst.afw.image as afw_image
+from lsst.daf.ingest.batchWcs import compute_polygons, tan_sip_parameters
+from test_IndexExposure import PolygonAssertions
+
+
+def make_metadata(**kwargs):
+    """Return WCS metadata for a 2000x2000 pixel TAN exposure."""
+    md = daf_base.PropertySet()
+    cards = dict(
+        NAXIS1=2000, NAXIS2=2000, RADECSYS="ICRS", EQUINOX=2000.0,
+        CTYPE1="RA---TAN", CTYPE2="DEC--TAN",
+        CRPIX1=1001.0, CRPIX2=1001.0, CRVAL1=45.0, CRVAL2=30.0,
+        CD1_1=-1.0e-4, CD1_2=2.0e-5, CD2_1=1.0e-5, CD2_2=1.0e-4,
+    )
+    cards.update(kwargs)
+    for key, value in sorted(cards.iteritems()):
+        if value is not None:
+            md.add(key, value)
+    return md
+
+
+class BatchWcsTest(PolygonAssertions, unittest.TestCase):
+    """Tests for :mod:`lsst.daf.ingest.batchWcs`."""
+
+    def setUp(self):
+        self.bbox = afw_geom.Box2I(afw_geom.Point2I(-10, -10),
+                                   afw_geom.Extent2I(2020, 2020))
+        sip = dict(CTYPE1="RA---TAN-SIP", CTYPE2="DEC--TAN-SIP",
+                   A_ORDER=3, B_ORDER=3, AP_ORDER=3, BP_ORDER=3,
+                   A_2_0=2.0e-6, A_1_1=-1.0e-6, A_0_3=1.0e-9,
+                   B_0_2=3.0e-6, B_2_0=1.0e-5, B_2_1=-2.0e-10)
+        pc = dict(CD1_1=None, CD1_2=None, CD2_1=None, CD2_2=None,
+                  CDELT1=-1.0e-4, CDELT2=1.0e-4, PC1_2=0.2, PC2_1=-0.1)
+        self.metadata = [
+            make_metadata(),
+            make_metadata(**sip),
+            make_metadata(**pc),
+            make_metadata(CRVAL1=300.0, CRVAL2=-85.0, **sip),
+            # Subimages of a parent image, and a non-ICRS frame.
+            make_metadata(LTV1=-500.0, LTV2=250.0),
+            make_metadata(LTV1=100.0, LTV2=-1000.0, **sip),
+            make_metadata(RADECSYS="FK5", **pc),
+        ]
+
+    def test_tan_sip_parameters(self):
+        """Test recognition of supported WCSes."""
+        for md in self.metadata:
+            self.assertIsNotNone(tan_sip_parameters(md))
+        self.assertIsNotNone(tan_sip_parameters(dict(
+            CTYPE1="RA---TAN", CTYPE2="DEC--TAN", CRPIX1=1.0, CRPIX2=1.0,
+            CRVAL1=0.0, CRVAL2=0.0, CDELT1=1.0, CDELT2=1.0)))
+        for kwargs in (dict(CTYPE1="RA---SIN", CTYPE2="DEC--SIN"),
+                       dict(CTYPE2="DEC--TAN-SIP"),
+                       dict(PV2_1=0.0),
+                       dict(A_ORDER=2),
+                       dict(CRVAL2=90.0)):
+            self.assertIsNone(tan_sip_parameters(make_metadata(**kwargs)))
+
+    def test_compute_polygons(self):
+        """Test that vectorized WCS evaluation matches afw."""
+        sin = make_metadata(CTYPE1="RA---SIN", CTYPE2="DEC--SIN")
+        metadata = self.metadata + [sin]
+        for edge_samples in (1, 5):
+            polygons = compute_polygons(
+                [(self.bbox, md) for md in metadata], edge_samples)
+            self.assertEqual(len(polygons), len(metadata))
+            expected = compute_polygons(
+                [(self.bbox, afw_image.makeWcs(md, False)) for md in metadata],
+                edge_samples)
+            for poly1, poly2 in zip(polygons, expected):
+                self.assertPolygonsAlmostEqual(poly1, poly2)
+        # Non-finite sky coordinates produce no polygon.
+        bad = make_metadata(CD1_1=float("nan"))
+        self.assertEqual(compute_polygons([(self.bbox, bad)]), [None])
+        self.assertEqual(compute_polygons([]), [])
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
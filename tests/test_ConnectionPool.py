@@ -0,0 +1,156 @@
+#
+# LSST Data Management System
+#
+# Copyright 2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+"""Unit tests for the SQLite 3 connection pool."""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+import lsst.utils.tests
+from lsst.daf.ingest.connectionPool import ConnectionPool
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    """Tests for :class:`lsst.daf.ingest.connectionPool.ConnectionPool`."""
+
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.dir_name, "index.sqlite3")
+        self.profiles = []
+        self.pool = ConnectionPool(
+            lambda conn, profile: self.profiles.append(profile))
+
+    def tearDown(self):
+        self.pool.close()
+        shutil.rmtree(self.dir_name, ignore_errors=True)
+
+    def test_reuse(self):
+        """Test that connections are reused per file, thread and profile."""
+        with self.pool.connection(self.file_name, "serve") as conn:
+            conn.execute("CREATE TABLE t (a)")
+        with self.pool.connection(os.path.join(self.dir_name, ".",
+                                               "index.sqlite3"),
+                                  "serve") as other:
+            self.assertIs(other, conn)
+        with self.pool.connection(self.file_name, "append") as other:
+            self.assertIsNot(other, conn)
+        others = []
+
+        def acquire():
+            with self.pool.connection(self.file_name, "serve") as other:
+                others.append(other)
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        thread.join()
+        self.assertIsNot(others[0], conn)
+        self.assertEqual(len(self.pool), 3)
+        self.assertEqual(self.profiles, ["serve", "append", "serve"])
+        with self.pool.cursor(self.file_name, "serve") as cursor:
+            cursor.execute("SELECT COUNT(*) FROM t")
+            self.assertEqual(cursor.fetchone(), (0,))
+        self.pool.close()
+        self.assertEqual(len(self.pool), 0)
+        with self.assertRaises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+
+    def test_replaced_file(self):
+        """Test that connections to replaced files are not reused."""
+        conn = self.pool.acquire(self.file_name)
+        conn.execute("CREATE TABLE t (a)")
+        self.pool.release(conn)
+        os.remove(self.file_name)
+        sqlite3.connect(self.file_name).execute("CREATE TABLE u (b)")
+        other = self.pool.acquire(self.file_name)
+        self.assertIsNot(other, conn)
+        self.assertEqual(other.execute("SELECT name FROM sqlite_master")
+                         .fetchall(), [("u",)])
+        self.pool.release(other)
+
+    def test_bounds(self):
+        """Test that idle connections are closed when the pool is full,
+        when their thread exits, or when their profile is transient."""
+        pool = ConnectionPool(max_size=1, transient_profiles=("append",))
+        try:
+            names = [os.path.join(self.dir_name, "{}.sqlite3".format(i))
+                     for i in range(3)]
+            conns = [pool.acquire(name) for name in names]
+            # Connections in use are never closed.
+            self.assertEqual(len(pool), 3)
+            for conn in conns:
+                pool.release(conn)
+            self.assertEqual(len(pool), 1)
+            for conn in conns[:2]:
+                with self.assertRaises(sqlite3.ProgrammingError):
+                    conn.execute("SELECT 1")
+            self.assertIs(pool.acquire(names[2]), conns[2])
+            pool.release(conns[2])
+            # Connections opened by exited threads are closed.
+            others = []
+
+            def acquire():
+                others.append(pool.acquire(names[0]))
+                pool.release(others[0])
+            thread = threading.Thread(target=acquire)
+            thread.start()
+            thread.join()
+            self.assertEqual(len(pool), 1)
+            pool.release(pool.acquire(names[1]))
+            with self.assertRaises(sqlite3.ProgrammingError):
+                others[0].execute("SELECT 1")
+            # Connections with transient profiles are never pooled.
+            conn = pool.acquire(names[0], "append")
+            other = pool.acquire(names[0], "append")
+            self.assertIsNot(other, conn)
+            pool.release(other)
+            pool.release(conn)
+            with self.assertRaises(sqlite3.ProgrammingError):
+                conn.execute("SELECT 1")
+        finally:
+            pool.close()
+
+    def test_memory(self):
+        """Test that in-memory databases are never pooled."""
+        conn = self.pool.acquire(":memory:")
+        other = self.pool.acquire(":memory:")
+        self.assertIsNot(other, conn)
+        self.pool.release(other)
+        self.pool.release(conn)
+        self.assertEqual(len(self.pool), 0)
+        with self.assertRaises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
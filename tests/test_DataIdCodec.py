@@ -0,0 +1,93 @@
+#
+# LSST Data Management System
+#
+# Copyright 2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+"""Unit tests for the canonical data-id encoding."""
+
+try:
+    import cPickle as pickle
+except:
+    import pickle
+import unittest
+
+import lsst.utils.tests
+from lsst.daf.ingest.dataIdCodec import (decode_data_id, encode_data_id,
+                                         is_encoded_data_id)
+
+
+class DataIdCodecTest(unittest.TestCase):
+    """Tests for :mod:`lsst.daf.ingest.dataIdCodec`."""
+
+    def test_round_trip(self):
+        """Test that data-ids survive encoding and decoding."""
+        for data_id in (None, 0, -1, 127, 128, -129, 2**15, 2**31, -2**63,
+                        2**64, -2**100, 0.5, float("inf"), "", "r",
+                        "x" * 1000, u"\xe9t\xe9", (), [1, (2, "a")],
+                        {}, dict(visit=903334, ccd=22, filter="r"),
+                        dict(tract=0, patch="1,2", extra=dict(a=[None]))):
+            data = encode_data_id(data_id)
+            self.assertTrue(is_encoded_data_id(data))
+            self.assertEqual(decode_data_id(data), data_id)
+            self.assertEqual(decode_data_id(buffer(data)), data_id)
+        self.assertEqual(decode_data_id(encode_data_id(set([1]))), set([1]))
+
+    def test_canonical(self):
+        """Test that equal data-ids have identical encodings."""
+        data_id = dict(visit=1, ccd=2, filter="r")
+        other = {}
+        for key in ("filter", "ccd", "visit"):
+            other[key] = data_id[key]
+        self.assertEqual(encode_data_id(data_id), encode_data_id(other))
+        self.assertEqual(encode_data_id(data_id),
+                         encode_data_id(dict(visit=1L, ccd=2.0,
+                                             filter=u"r")))
+        self.assertEqual(encode_data_id(True), encode_data_id(1))
+        self.assertNotEqual(encode_data_id(data_id),
+                            encode_data_id(dict(visit=1, ccd=3, filter="r")))
+        self.assertNotEqual(encode_data_id((1, 2)), encode_data_id([1, 2]))
+        self.assertLess(len(encode_data_id(data_id)),
+                        len(pickle.dumps(data_id, 2)))
+
+    def test_decode(self):
+        """Test decoding of pickles and invalid encodings."""
+        data_id = dict(visit=1, filter="r")
+        for protocol in (0, 2):
+            data = pickle.dumps(data_id, protocol)
+            self.assertFalse(is_encoded_data_id(data))
+            self.assertEqual(decode_data_id(data), data_id)
+        data = encode_data_id(data_id)
+        for bad in (data[:2] + "?" + data[3:], data[:-1], data + "\0",
+                    data[:1] + "\x7f" + data[2:]):
+            with self.assertRaises(RuntimeError):
+                decode_data_id(bad)
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
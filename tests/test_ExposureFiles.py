@@ -0,0 +1,120 @@
+#
+# LSST Data Management System
+#
+# Copyright 2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+"""Unit tests for butler-free exposure file access."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import lsst.utils.tests
+from lsst.daf.ingest.exposureFiles import find_exposure_files, read_fits_header
+
+
+def make_header(cards):
+    """Return a FITS header block sequence for (keyword, value) pairs."""
+    lines = []
+    for keyword, value in cards:
+        if value is None:
+            lines.append(keyword.ljust(80))
+        else:
+            lines.append("{:<8}= {:>20} / test card".format(keyword, value)[:80].ljust(80))
+    text = "".join(lines) + "END".ljust(80)
+    return text + " " * (-len(text) % 2880)
+
+
+class ExposureFilesTest(unittest.TestCase):
+    """Tests for :mod:`lsst.daf.ingest.exposureFiles`."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        primary = make_header([
+            ("SIMPLE", "T"), ("BITPIX", "8"), ("NAXIS", "0"), ("EXTEND", "T"),
+            ("MJD-OBS", "51000.5"), ("COMMENT a = 'b'", None),
+        ])
+        extension = make_header([
+            ("XTENSION", "'IMAGE   '"), ("BITPIX", "-32"), ("NAXIS", "2"),
+            ("NAXIS1", "100"), ("NAXIS2", "50"),
+            ("CTYPE1", "'RA---TAN-SIP'"), ("CRVAL1", "1.5D2"),
+            ("CD1_1", "-1.0E-4"), ("LTV1", "-5"), ("OBJECT", "'it''s  '"),
+            ("MJD-OBS", "51001.5"),
+        ])
+        self.paths = []
+        for path in ("calexp/v12-fr/c01.fits", "calexp/v12-fr/c02.fits",
+                     "calexp/v13-fg/c01.fits", "calexp/v13-fg/bogus.fits",
+                     "calexp/c01.fits", "raw/v12-fr/c01.fits"):
+            path = os.path.join(self.root, path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, "wb") as f:
+                f.write(primary + extension + "\0" * 2880)
+            self.paths.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_read_fits_header(self):
+        """Test reading selected cards of the image HDU header."""
+        header = read_fits_header(self.paths[0])
+        self.assertEqual(header["NAXIS1"], 100)
+        self.assertEqual(header["CTYPE1"], "RA---TAN-SIP")
+        self.assertEqual(header["CRVAL1"], 150.0)
+        self.assertEqual(header["CD1_1"], -1.0e-4)
+        self.assertEqual(header["LTV1"], -5)
+        self.assertEqual(header["OBJECT"], "it's")
+        self.assertEqual(header["MJD-OBS"], 51001.5)
+        self.assertIs(header["EXTEND"], True)
+        self.assertNotIn("COMMENT", header)
+        header = read_fits_header(self.paths[0], r"(NAXIS\d|CRVAL\d)$")
+        self.assertEqual(header, dict(NAXIS1=100, NAXIS2=50, CRVAL1=150.0))
+        with open(self.paths[0], "wb") as f:
+            f.write(" " * 100)
+        with self.assertRaises(RuntimeError):
+            read_fits_header(self.paths[0])
+
+    def test_find_exposure_files(self):
+        """Test recovering data-ids from repository paths."""
+        results = list(find_exposure_files(
+            self.root, "calexp/v%(visit)d-f%(filter)s/c%(ccd)02d.fits"))
+        self.assertEqual(results, [
+            (self.paths[0], dict(visit=12, filter="r", ccd=1)),
+            (self.paths[1], dict(visit=12, filter="r", ccd=2)),
+            (self.paths[2], dict(visit=13, filter="g", ccd=1)),
+        ])
+        results = list(find_exposure_files(
+            self.root, "%(dataset)s/v%(visit)d-f%(filter)s/c01.fits"))
+        self.assertEqual([r[1]["dataset"] for r in results],
+                         ["calexp", "calexp", "raw"])
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
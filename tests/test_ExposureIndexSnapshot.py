@@ -0,0 +1,123 @@
+#
+# LSST Data Management System
+#
+# Copyright 2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+"""Unit tests for read-only exposure index snapshots."""
+
+import unittest
+
+import math
+try:
+    import cPickle as pickle
+except:
+    import pickle
+import random
+import shutil
+import sqlite3
+import tempfile
+
+import lsst.utils.tests
+import lsst.sphgeom as sphgeom
+from lsst.daf.ingest.indexExposure import (
+    create_exposure_tables,
+    ExposureInfo,
+    find_intersecting_exposures,
+    store_exposure_info,
+)
+from lsst.daf.ingest.exposureIndexSnapshot import (
+    ExposureIndexSnapshot,
+    write_exposure_index_snapshot,
+)
+
+
+class ExposureIndexSnapshotTest(unittest.TestCase):
+    """Tests for :class:`.ExposureIndexSnapshot`."""
+
+    def setUp(self):
+        """Index exposures distributed uniformly at random over the sky."""
+        random.seed(27182818)
+        infos = []
+        for data_id in xrange(1000):
+            lon = random.uniform(0.0, 360.0)
+            lat = math.degrees(math.asin(random.uniform(-0.99, 0.99)))
+            corners = [
+                sphgeom.UnitVector3d(sphgeom.LonLat.fromDegrees(
+                    lon + dlon / math.cos(math.radians(lat)), lat + dlat))
+                for dlon, dlat in ((-1, -1), (1, -1), (1, 1), (-1, 1))
+            ]
+            poly = sphgeom.ConvexPolygon(corners)
+            infos.append(ExposureInfo(pickle.dumps(dict(visit=data_id)),
+                                      poly.encode()))
+        self.database = sqlite3.connect(":memory:")
+        create_exposure_tables(self.database)
+        store_exposure_info(self.database, False, infos)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.database.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_queries(self):
+        """Test that snapshot and database queries give the same results."""
+        self.assertEqual(
+            write_exposure_index_snapshot(self.database, self.directory), 1000)
+        regions = [sphgeom.Circle(sphgeom.UnitVector3d(
+                   sphgeom.LonLat.fromDegrees(lon, lat)),
+                   sphgeom.Angle.fromDegrees(5.0))
+                   for lon in range(0, 360, 30) for lat in (-60, 0, 60)]
+        regions.append(sphgeom.Circle(sphgeom.UnitVector3d.Z(),
+                                      sphgeom.Angle.fromDegrees(30.0)))
+        expected = [sorted(e.data_id["visit"] for e in
+                           find_intersecting_exposures(self.database, r))
+                    for r in regions]
+        self.assertGreater(sum(len(e) for e in expected), 0)
+        for mmap in (True, False):
+            snapshot = ExposureIndexSnapshot(self.directory, mmap=mmap)
+            self.assertEqual(len(snapshot), 1000)
+            results = snapshot.find_intersecting_exposures_many(regions)
+            for e, r in zip(expected, results):
+                self.assertEqual(sorted(i.data_id["visit"] for i in r), e)
+
+    def test_empty(self):
+        """Test snapshots of empty indexes."""
+        database = sqlite3.connect(":memory:")
+        create_exposure_tables(database)
+        self.assertEqual(
+            write_exposure_index_snapshot(database, self.directory), 0)
+        snapshot = ExposureIndexSnapshot(self.directory)
+        self.assertEqual(len(snapshot), 0)
+        circle = sphgeom.Circle(sphgeom.UnitVector3d.Z(),
+                                sphgeom.Angle.fromDegrees(30.0))
+        self.assertEqual(snapshot.find_intersecting_exposures(circle), [])
+        database.close()
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
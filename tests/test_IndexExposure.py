@@ -29,18 +29,31 @@ try:
     import cPickle as pickle
 except:
     import pickle
+import os
 import random
+import shutil
 import sqlite3
+import tempfile
 
 import lsst.utils.tests
 import lsst.daf.base as daf_base
+import lsst.afw.geom as afw_geom
 import lsst.afw.image as afw_image
 import lsst.pipe.base as pipe_base
 import lsst.sphgeom as sphgeom
 from lsst.log import Log
+from lsst.daf.ingest.dataIdCodec import decode_data_id, encode_data_id
 from lsst.daf.ingest.indexExposure import (
     create_exposure_tables,
+    ExposureIndexReader,
+    ExposureInfo,
+    ExposureSource,
     find_intersecting_exposures,
+    find_intersecting_exposures_many,
+    measure_candidate_tightness,
+    measure_missed_results,
+    migrate_data_id_codec,
+    sqlite_profiles,
     store_exposure_info,
     IndexExposureConfig,
     IndexExposureRunner,
@@ -65,9 +78,58 @@ class MockDataRef(object):
         return self.value
 
 
-class IndexExposureTest(unittest.TestCase):
+def info(data_id, lon, encode=encode_data_id):
+    """Return information for a 2 by 2 degree exposure on the equator.
+
+    Parameters
+    ----------
+
+    data_id : object
+        Data id of the exposure.
+
+    lon : float
+        Longitude (degrees) of the exposure center.
+
+    encode : callable
+        Encodes the data id; defaults to the canonical encoding.
+    """
+    corners = [sphgeom.UnitVector3d(sphgeom.LonLat.fromDegrees(
+        lon + dlon, dlat)) for dlon, dlat in
+        ((-1.0, -1.0), (1.0, -1.0), (1.0, 1.0), (-1.0, 1.0))]
+    return ExposureInfo(encode(data_id),
+                        sphgeom.ConvexPolygon(corners).encode())
+
+
+class PolygonAssertions(object):
+    """A :class:`unittest.TestCase` mixin for comparing polygons."""
+
+    def assertPolygonsAlmostEqual(self, poly1, poly2):
+        """Assert that two polygons have almost equal vertices."""
+        vertices1 = poly1.getVertices()
+        vertices2 = poly2.getVertices()
+        self.assertEqual(len(vertices1), len(vertices2))
+        for v1, v2 in zip(vertices1, vertices2):
+            self.assertAlmostEqual(v1.x(), v2.x(), places=12)
+            self.assertAlmostEqual(v1.y(), v2.y(), places=12)
+            self.assertAlmostEqual(v1.z(), v2.z(), places=12)
+
+
+class IndexExposureTest(PolygonAssertions, unittest.TestCase):
     """Test for spatial indexing of afw exposures."""
 
+    def setUp(self):
+        """Create a temporary directory, and a circle of radius 1 degree
+        on the equator.
+        """
+        self.dir_name = tempfile.mkdtemp()
+        self.circle = sphgeom.Circle(
+            sphgeom.UnitVector3d(sphgeom.LonLat.fromDegrees(1.0, 0.0)),
+            sphgeom.Angle.fromDegrees(1.0))
+
+    def tearDown(self):
+        """Remove the temporary directory."""
+        shutil.rmtree(self.dir_name, ignore_errors=True)
+
     def test_basic(self):
         """Perform basic correctness testing."""
         ps = []
@@ -99,6 +161,7 @@ class IndexExposureTest(unittest.TestCase):
         config = IndexExposureConfig()
         config.allow_replace = True
         config.defer_writes = True
+        config.write_batch_size = 1
         config.init_statements = ['PRAGMA page_size = 4096']
         database = sqlite3.connect(":memory:")
         # Avoid the command line parser.
@@ -124,7 +187,7 @@ class IndexExposureTest(unittest.TestCase):
             runner.run(parsed_cmd)
         # Now, verify the contents of the database. First, check that
         # data ids are recoverable.
-        data_ids = sorted(pickle.loads(str(r[0])) for r in database.execute(
+        data_ids = sorted(decode_data_id(r[0]) for r in database.execute(
             "SELECT pickled_data_id FROM exposure"))
         self.assertEqual(data_ids, [0, 1])
         # Next, run a spatial query and check that it returns the
@@ -177,15 +240,413 @@ class IndexExposureTest(unittest.TestCase):
         rtree_ids = sorted(e.data_id for e in
                            find_intersecting_exposures(database, circle))
         self.assertEqual(brute_ids, rtree_ids)
+        # Search many overlapping regions at once, with a cache too small
+        # to hold all candidates.
+        circles = [sphgeom.Circle(sphgeom.UnitVector3d(
+                   sphgeom.LonLat.fromDegrees(lon, 45.0)),
+                   sphgeom.Angle.fromDegrees(20.0))
+                   for lon in range(0, 360, 15)]
+        many = find_intersecting_exposures_many(database, circles,
+                                                cache_size=50)
+        for circle, infos in zip(circles, many):
+            self.assertEqual(sorted(e.data_id for e in infos),
+                             self._brute_search(database, circle))
+        # Add pixelization indexes, and check that pixel index search gives
+        # the same results as well.
+        for pixelization, level in (("htm", 5), ("q3c", 5)):
+            pixel_database = sqlite3.connect(":memory:")
+            create_exposure_tables(pixel_database, [], pixelization, level)
+            store_exposure_info(pixel_database, False, results[:500])
+            # Exposures stored before the pixelization index was created
+            # must be indexed as well.
+            if pixelization == "q3c":
+                pixel_database.close()
+                pixel_database = sqlite3.connect(":memory:")
+                create_exposure_tables(pixel_database)
+                store_exposure_info(pixel_database, False, results[:500])
+                create_exposure_tables(pixel_database, [], pixelization, level)
+            store_exposure_info(pixel_database, False, results[500:])
+            with ExposureIndexReader(pixel_database) as reader:
+                self.assertEqual(reader.candidate_index, "pixel")
+                for circle in circles:
+                    self.assertEqual(
+                        sorted(e.data_id for e in
+                               reader.find_intersecting_exposures(circle)),
+                        self._brute_search(database, circle))
+            report = measure_candidate_tightness(pixel_database, circles)
+            self.assertEqual(sorted(report), ["pixel", "rtree"])
+            for stats in report.values():
+                self.assertEqual(stats["results"], report["rtree"]["results"])
+                self.assertGreaterEqual(stats["candidates"], stats["results"])
+            pixel_database.close()
+        database.close()
+
+    def test_store(self):
+        """Test bulk storage of exposure information, with replacement."""
+        def contents(database):
+            rows = database.execute(
+                "SELECT e.rowid, pickled_data_id, encoded_polygon, x_min\n"
+                "FROM exposure AS e JOIN exposure_rtree USING (rowid)")
+            return sorted((decode_data_id(r[1]), r[0], str(r[2]), r[3])
+                          for r in rows)
+
+        database = sqlite3.connect(":memory:")
+        create_exposure_tables(database)
+        store_exposure_info(database, False,
+                            [info(i, 10.0 * i) for i in range(3)] + [None])
+        before = contents(database)
+        self.assertEqual([r[0] for r in before], [0, 1, 2])
+        # Duplicates must be rejected without storing anything.
+        with self.assertRaises(sqlite3.IntegrityError):
+            store_exposure_info(database, False, [info(3, 30.0), info(1, 0.0)])
+        self.assertEqual(contents(database), before)
+        # Replacement must keep rowids, update both tables, and store the
+        # last occurrence of a data id.
+        store_exposure_info(database, True,
+                            [info(1, 50.0), info(3, 30.0), info(1, 60.0)])
+        after = contents(database)
+        self.assertEqual(len(after), 4)
+        self.assertEqual(database.execute(
+            "SELECT COUNT(*) FROM exposure_rtree").fetchone()[0], 4)
+        self.assertEqual(after[0], before[0])
+        self.assertEqual(after[2], before[2])
+        self.assertEqual(after[1][1], before[1][1])
+        self.assertEqual(after[1][2], info(1, 60.0).boundary)
+        self.assertNotEqual(after[1][3], before[1][3])
+        # Batches stored before a failure must remain stored.
+        with self.assertRaises(sqlite3.IntegrityError):
+            store_exposure_info(database, False,
+                                (info(i % 10, 10.0 * i)
+                                 for i in range(4, 15)),
+                                batch_size=4)
+        self.assertEqual([r[0] for r in contents(database)], range(8))
         database.close()
 
+    def test_reader(self):
+        """Test that the index reader caches decoded exposures."""
+        file_name = os.path.join(self.dir_name, "index.sqlite3")
+        create_exposure_tables(file_name)
+        store_exposure_info(file_name, False, [info(0, 0.0), info(1, 1.5)])
+        with ExposureIndexReader(file_name) as reader:
+            for i in range(2):
+                results = reader.find_intersecting_exposures(self.circle)
+                self.assertEqual(sorted(r.data_id for r in results), [0, 1])
+                self.assertEqual((reader.hits, reader.misses), (2 * i, 2))
+            # Changes made via another connection must invalidate the
+            # cache.
+            store_exposure_info(file_name, True, [info(1, 10.0)])
+            results = reader.find_intersecting_exposures(self.circle)
+            self.assertEqual([r.data_id for r in results], [0])
+            self.assertEqual(reader.misses, 3)
+            # ... and so must changes made via the reader's connection.
+            store_exposure_info(reader.conn, False, [info(2, 2.0)])
+            results = reader.find_intersecting_exposures(self.circle)
+            self.assertEqual(sorted(r.data_id for r in results), [0, 2])
+            self.assertEqual(reader.misses, 5)
+
+    def test_sqlite_profiles(self):
+        """Test that readers can query while exposures are appended."""
+        file_name = os.path.join(self.dir_name, "index.sqlite3")
+        create_exposure_tables(file_name, profile="bulk-build")
+        store_exposure_info(file_name, False, [info(0, 0.0)],
+                            profile="bulk-build")
+        conn = sqlite3.connect(file_name)
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone(),
+                         ("wal",))
+        # Hold a write transaction open, as a long append would.
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM exposure")
+        with ExposureIndexReader(file_name) as reader:
+            results = reader.find_intersecting_exposures(self.circle)
+            self.assertEqual([r.data_id for r in results], [0])
+            conn.rollback()
+            store_exposure_info(file_name, False, [info(1, 1.5)])
+            results = reader.find_intersecting_exposures(self.circle)
+            self.assertEqual(sorted(r.data_id for r in results), [0, 1])
+        conn.close()
+        with self.assertRaises(RuntimeError):
+            store_exposure_info(file_name, False, [info(2, 2.0)],
+                                profile="bogus")
+        self.assertEqual(set(sqlite_profiles),
+                         set(["bulk-build", "append", "serve"]))
+
+    def test_data_id_columns(self):
+        """Test spatial queries constrained by typed data-id columns."""
+        def data_ids(results):
+            return sorted((r.data_id["visit"], r.data_id["filter"])
+                          for r in results)
+
+        circle = sphgeom.Circle(
+            sphgeom.UnitVector3d(sphgeom.LonLat.fromDegrees(5.0, 0.0)),
+            sphgeom.Angle.fromDegrees(4.5))
+        exposures = [info(dict(visit=v, filter="gri"[v % 3]), v)
+                     for v in range(12)]
+        # Columns inferred when storing into an index created without any.
+        database = sqlite3.connect(":memory:")
+        create_exposure_tables(database)
+        store_exposure_info(database, False, exposures)
+        everything = data_ids(find_intersecting_exposures(database, circle))
+        self.assertEqual(everything, sorted(
+            (d["visit"], d["filter"])
+            for d in self._brute_search(database, circle)))
+        self.assertTrue(0 < len(everything) < len(exposures))
+        for constraints in (dict(filter="r"),
+                            dict(visit=(3, 7)),
+                            dict(visit=(None, 4), filter=["g", "i"]),
+                            dict(filter=set(["g"]), visit=(6, None))):
+            expected = [(v, f) for v, f in everything if
+                        all(self._matches(dict(visit=v, filter=f)[k], c)
+                            for k, c in constraints.iteritems())]
+            results = find_intersecting_exposures(database, circle, constraints)
+            self.assertEqual(data_ids(results), expected)
+        with self.assertRaises(RuntimeError):
+            find_intersecting_exposures(database, circle, dict(ccd=1))
+        database.close()
+        # Indexes without typed columns must be migrated.
+        database = sqlite3.connect(":memory:")
+        database.execute(
+            "CREATE VIRTUAL TABLE exposure_rtree USING rtree(\n"
+            "    rowid, x_min, x_max, y_min, y_max, z_min, z_max)")
+        database.execute(
+            "CREATE TABLE exposure (\n"
+            "    rowid INTEGER PRIMARY KEY,\n"
+            "    pickled_data_id BLOB NOT NULL UNIQUE,\n"
+            "    encoded_polygon BLOB NOT NULL)")
+        for e in exposures:
+            bbox = sphgeom.ConvexPolygon.decode(e.boundary).getBoundingBox3d()
+            row_id = database.execute(
+                "INSERT INTO exposure (pickled_data_id, encoded_polygon)\n"
+                "VALUES (?, ?)",
+                (buffer(pickle.dumps(decode_data_id(e.data_id))),
+                 buffer(e.boundary))).lastrowid
+            database.execute(
+                "INSERT INTO exposure_rtree VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (row_id, bbox.x().getA(), bbox.x().getB(), bbox.y().getA(),
+                 bbox.y().getB(), bbox.z().getA(), bbox.z().getB()))
+        database.commit()
+        with self.assertRaises(RuntimeError):
+            find_intersecting_exposures(database, circle, dict(filter="r"))
+        create_exposure_tables(database)
+        self.assertEqual(database.execute(
+            "SELECT COUNT(*) FROM exposure WHERE visit IS NULL").fetchone()[0],
+            0)
+        results = find_intersecting_exposures(database, circle,
+                                              dict(filter="r"))
+        self.assertEqual(data_ids(results),
+                         [(v, f) for v, f in everything if f == "r"])
+        # Configured columns must not be changed.
+        with self.assertRaises(RuntimeError):
+            create_exposure_tables(database, data_id_columns=dict(ccd="TEXT"))
+        database.close()
+        # Column names may contain separators, also when replacing.
+        database = sqlite3.connect(":memory:")
+        create_exposure_tables(database,
+                               data_id_columns={"visit, filter": "TEXT"})
+        for lon in (1.0, 2.0):
+            store_exposure_info(database, True, [
+                info({"visit, filter": "1, r", "visit": 1, "filter": "r"},
+                     lon)])
+        self.assertEqual(database.execute(
+            'SELECT "visit, filter" FROM exposure').fetchall(), [("1, r",)])
+        database.close()
+
+    def test_migrate_data_id_codec(self):
+        """Test re-keying an index of pickled data-ids."""
+        def contents(database):
+            return sorted((str(r[0]), r[1], str(r[2])) for r in
+                          database.execute(
+                              "SELECT pickled_data_id, e.rowid, path\n"
+                              "FROM exposure AS e LEFT JOIN exposure_source\n"
+                              "    USING (pickled_data_id)"))
+
+        database = sqlite3.connect(":memory:")
+        create_exposure_tables(database, pixelization="htm", level=6)
+        store_exposure_info(database, False, [
+            info(dict(visit=1, filter="r"), 0.0, pickle.dumps)._replace(
+                source=ExposureSource("a.fits", 1, 0.0, None)),
+            info(dict(visit=2, filter="r"), 10.0, pickle.dumps),
+        ])
+        # Simulate an index created before data-ids were encoded.
+        with database:
+            for table in ("exposure", "exposure_source"):
+                for data, in database.execute(
+                        "SELECT pickled_data_id FROM {}".format(table)
+                ).fetchall():
+                    database.execute(
+                        "UPDATE {} SET pickled_data_id = ?\n"
+                        "WHERE pickled_data_id = ?".format(table),
+                        (buffer(pickle.dumps(decode_data_id(data))), data))
+            database.execute("DELETE FROM exposure_index_metadata\n"
+                             "WHERE name = 'data_id_codec'")
+        # Pickles of equal data-ids can differ, so an index of pickled
+        # data-ids can contain duplicates.
+        store_exposure_info(database, False, [
+            info(dict(visit=1, filter=u"r"), 20.0, pickle.dumps)])
+        self.assertEqual(len(contents(database)), 3)
+        self.assertEqual(
+            migrate_data_id_codec(database),
+            dict(exposures=3, rekeyed=2, duplicates=1))
+        self.assertEqual(contents(database), [
+            (encode_data_id(dict(visit=1, filter="r")), 3, "a.fits"),
+            (encode_data_id(dict(visit=2, filter="r")), 2, None),
+        ])
+        for table, column in (("exposure_rtree", "rowid"),
+                              ("exposure_pixel", "exposure_id")):
+            self.assertEqual([r[0] for r in database.execute(
+                "SELECT DISTINCT {} FROM {} ORDER BY 1".format(
+                    column, table))], [2, 3])
+        self.assertEqual(migrate_data_id_codec(database),
+                         dict(exposures=2, rekeyed=0, duplicates=0))
+        # Migrated indexes reject duplicates, however they are encoded.
+        with self.assertRaises(sqlite3.IntegrityError):
+            store_exposure_info(database, False, [
+                info(dict(filter=u"r", visit=2.0), 30.0, pickle.dumps)])
+        database.close()
+
+    @staticmethod
+    def _matches(value, constraint):
+        if isinstance(constraint, tuple):
+            return ((constraint[0] is None or value >= constraint[0]) and
+                    (constraint[1] is None or value <= constraint[1]))
+        if isinstance(constraint, (list, set)):
+            return value in constraint
+        return value == constraint
+
+    def test_index_files(self):
+        """Test that indexing files directly matches indexing metadata."""
+        config = IndexExposureConfig()
+        config.defer_writes = True
+        config.write_batch_size = 2
+        task = IndexExposureTask(config=config)
+        root = self.dir_name
+        expected = []
+        for visit in range(3):
+            props = daf_base.PropertySet()
+            props.add("RADECSYS", "ICRS")
+            props.add("EQUINOX", 2000.0)
+            props.add("CTYPE1", "RA---TAN")
+            props.add("CTYPE2", "DEC--TAN")
+            props.add("CRPIX1", 5.0)
+            props.add("CRPIX2", 5.0)
+            props.add("CRVAL1", 30.0 * visit)
+            props.add("CRVAL2", 10.0 * visit)
+            props.add("CD1_1", 1.0e-3)
+            props.add("CD2_1", 0.0)
+            props.add("CD1_2", 0.0)
+            props.add("CD2_2", 1.0e-3)
+            exposure = afw_image.ExposureF(8 + visit, 9,
+                                           afw_image.makeWcs(props))
+            exposure.setXY0(afw_geom.Point2I(visit, -visit))
+            path = os.path.join(root, "calexp", "v{}".format(visit),
+                                "c07.fits")
+            os.makedirs(os.path.dirname(path))
+            exposure.writeFits(path)
+            data_id = dict(visit=visit, ccd=7)
+            expected.append(task.index(afw_image.readMetadata(path),
+                                       data_id, None))
+        database = sqlite3.connect(":memory:")
+        create_exposure_tables(database)
+        self.assertEqual(task.index_files(
+            root, "calexp/v%(visit)d/c%(ccd)02d.fits", database), 3)
+        rows = database.execute(
+            "SELECT pickled_data_id, encoded_polygon FROM exposure\n"
+            "ORDER BY visit").fetchall()
+        self.assertEqual([decode_data_id(r[0]) for r in rows],
+                         [decode_data_id(e.data_id) for e in expected])
+        # Files are indexed in batches, with NumPy WCS evaluation, while
+        # index() uses afw. The exposures are subimages (with LTV1 and
+        # LTV2 header cards), so this also checks their handling.
+        for r, e in zip(rows, expected):
+            self.assertPolygonsAlmostEqual(
+                sphgeom.ConvexPolygon.decode(str(r[1])),
+                sphgeom.ConvexPolygon.decode(e.boundary))
+        # Incremental re-indexing must only read new or changed files.
+        task.config.incremental = True
+        paths = []
+
+        def read_metadata(path):
+            paths.append(path)
+            return IndexExposureTask.read_metadata(path)
+        task.read_metadata = read_metadata
+        template = "calexp/v%(visit)d/c%(ccd)02d.fits"
+        self.assertEqual(task.index_files(root, template, database), 3)
+        self.assertEqual(len(paths), 3)
+        self.assertEqual(database.execute(
+            "SELECT COUNT(*) FROM exposure_source").fetchone()[0], 3)
+        del paths[:]
+        self.assertEqual(task.index_files(root, template, database), 3)
+        self.assertEqual(paths, [])
+        exposure.setXY0(afw_geom.Point2I(5, 5))
+        exposure.writeFits(path)
+        os.utime(path, (1.0e9, 1.0e9))
+        self.assertEqual(task.index_files(root, template, database), 3)
+        self.assertEqual(paths, [path])
+        boundary = database.execute(
+            "SELECT encoded_polygon FROM exposure WHERE visit = 2"
+        ).fetchone()[0]
+        self.assertNotEqual(str(boundary), expected[2].boundary)
+        database.close()
+
+    def test_edge_samples(self):
+        """Test that sampling box edges captures WCS distortion."""
+        md = daf_base.PropertySet()
+        md.add("NAXIS1", 2000)
+        md.add("NAXIS2", 2000)
+        md.add("RADECSYS", "ICRS")
+        md.add("EQUINOX", 2000.0)
+        md.add("CTYPE1", "RA---TAN-SIP")
+        md.add("CTYPE2", "DEC--TAN-SIP")
+        md.add("CRPIX1", 1001.0)
+        md.add("CRPIX2", 1001.0)
+        md.add("CRVAL1", 45.0)
+        md.add("CRVAL2", 30.0)
+        md.add("CD1_1", 1.0e-4)
+        md.add("CD2_1", 0.0)
+        md.add("CD1_2", 0.0)
+        md.add("CD2_2", 1.0e-4)
+        # Quadratic distortion along y moves the corners of the bottom and
+        # top edges by 10 pixels relative to their midpoints, so the edges
+        # bulge outwards.
+        for prefix in ("A", "B", "AP", "BP"):
+            md.add(prefix + "_ORDER", 2)
+        md.add("B_2_0", 1.0e-5)
+        wcs = afw_image.makeWcs(md, False)
+        # A small circle 3 pixels inside the middle of the bottom edge.
+        sky = wcs.pixelToSky(999.5, 3.0)
+        circle = sphgeom.Circle(
+            sphgeom.UnitVector3d(
+                sphgeom.Angle.fromRadians(sky.getLongitude().asRadians()),
+                sphgeom.Angle.fromRadians(sky.getLatitude().asRadians())),
+            sphgeom.Angle.fromDegrees(1.0e-5))
+        databases = []
+        for edge_samples in (1, 16):
+            config = IndexExposureConfig()
+            config.defer_writes = False
+            config.edge_samples = edge_samples
+            database = sqlite3.connect(":memory:")
+            create_exposure_tables(database)
+            IndexExposureTask(config=config).index(md, 0, database)
+            databases.append(database)
+        self.assertEqual(find_intersecting_exposures(databases[0], circle), [])
+        self.assertEqual(len(find_intersecting_exposures(databases[1],
+                                                         circle)), 1)
+        # Without sampling, the index misses a true result.
+        report = measure_missed_results(databases[1], databases[0],
+                                        [circle])
+        self.assertEqual(report["reference_results"], 1)
+        self.assertEqual(report["missed"], 1)
+        self.assertEqual(report["extra"], 0)
+        self.assertEqual(report["missed_fraction"], 1.0)
+        for database in databases:
+            database.close()
+
     def _brute_search(self, conn, region):
         results = []
         query = "SELECT pickled_data_id, encoded_polygon FROM exposure"
         for row in conn.execute(query):
             poly = sphgeom.ConvexPolygon.decode(str(row[1]))
             if region.relate(poly) != sphgeom.DISJOINT:
-                results.append(pickle.loads(str(row[0])))
+                results.append(decode_data_id(row[0]))
         results.sort()
         return results
 
@@ -27,17 +27,139 @@ from __future__ import division
 import unittest
 
 from contextlib import closing
+import json
 import math
 import numpy as np
 import os
+import re
+import shutil
 import struct
+import tempfile
 import uuid
 
 import lsst.utils.tests
 import lsst.afw.table as afw_table
 
 from lsst.afw.geom import Angle
-from lsst.daf.ingest.ingestCatalog import IngestCatalogTask, IngestCatalogConfig
+from lsst.daf.ingest.ingestCatalog import (
+    CatalogBatch,
+    field_formatters,
+    FitsCatalogStream,
+    IngestCatalogConfig,
+    IngestCatalogRunner,
+    IngestCatalogTask,
+    _ingest_in_worker,
+    _worker_state,
+)
+
+
+class RecordingConnection(object):
+    """A MySQLdb connection impostor that records executed statements.
+
+    This class allows SQL generation to be tested without a database server.
+    """
+
+    def __init__(self):
+        """Start with no recorded statements, streams or commits."""
+        self.statements = []
+        self.streams = []
+        self.parameters = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.encoders = {}
+
+    def cursor(self):
+        """Return a cursor that records ``executemany`` calls."""
+        return RecordingCursor(self)
+
+    def query(self, sql):
+        """Record a statement.
+
+        The contents of files read by ``LOAD DATA LOCAL INFILE`` statements
+        are recorded as well.
+        """
+        self.statements.append(sql)
+        match = re.match(r"LOAD DATA LOCAL INFILE '([^']*)'", sql)
+        if match is not None:
+            with open(match.group(1), "rb") as f:
+                self.streams.append(f.read())
+
+    def info(self):
+        """Return information about the most recently executed statement."""
+        return "Records: 2  Deleted: 0  Skipped: 0  Warnings: 0"
+
+    def commit(self):
+        """Record a commit."""
+        self.commits += 1
+
+    def rollback(self):
+        """Record a rollback."""
+        self.rollbacks += 1
+
+    def close(self):
+        """Ignore a close."""
+        pass
+
+
+class RecordingCursor(object):
+    """A MySQLdb cursor impostor that records ``executemany`` calls."""
+
+    def __init__(self, conn):
+        """Record statements and parameters in `conn`."""
+        self.conn = conn
+
+    def executemany(self, sql, args):
+        """Record a statement and its parameters."""
+        self.conn.statements.append(sql)
+        self.conn.parameters.append(list(args))
+
+    def close(self):
+        """Ignore a close."""
+        pass
+
+
+class FailingConnection(RecordingConnection):
+    """A :class:`RecordingConnection` that fails to execute INSERTs."""
+
+    def query(self, sql):
+        """Record a statement, and raise if it is an INSERT."""
+        RecordingConnection.query(self, sql)
+        if sql.startswith("INSERT"):
+            raise RuntimeError("INSERT failed")
+
+
+class BrokenConnection(FailingConnection):
+    """A :class:`FailingConnection` that also fails to roll back."""
+
+    def rollback(self):
+        """Record a rollback, and raise."""
+        FailingConnection.rollback(self)
+        raise RuntimeError("connection lost")
+
+
+class StubDataRef(object):
+    """A data reference impostor that returns a fixed catalog."""
+
+    def __init__(self, data_id, catalog):
+        """Return `catalog` for any dataset type of `data_id`."""
+        self.dataId = data_id
+        self.catalog = catalog
+
+    def get(self, dstype, **kwargs):
+        """Return the catalog."""
+        return self.catalog
+
+
+class RecordingLog(object):
+    """A log impostor that records info messages."""
+
+    def __init__(self):
+        """Start with no recorded messages."""
+        self.messages = []
+
+    def info(self, msg, *args):
+        """Record a message."""
+        self.messages.append(msg % args if args else msg)
 
 
 class IngestCatalogTest(unittest.TestCase):
@@ -175,14 +297,379 @@ class IngestCatalogTest(unittest.TestCase):
         else:
             self.assertEqual(original_value, roundtrip_value)
 
+    def test_format_rows(self):
+        """Test that columnar formatting matches per-record formatting."""
+        config = IngestCatalogConfig()
+        config.block_size = 1
+        task = IngestCatalogTask(config=config)
+        items = list(task._schema_items(self.catalog.schema))
+        expected_rows = []
+        for record in self.catalog:
+            values = [field_formatters[i.field.getTypeString()].format_value(
+                record.get(i.key)) for i in items]
+            expected_rows.append("(" + ",".join(values) + ")")
+        self.assertEqual(list(task._format_rows(self.catalog)), expected_rows)
+        # Check statement packing: a query length limit that is only large
+        # enough for a single row must result in one statement per row.
+        conn = RecordingConnection()
+        sql_prefix = "INSERT INTO t ({}) VALUES ".format(",".join(
+            task._column_name(i.field.getName()) for i in items))
+        max_query_len = len(sql_prefix) + max(len(r) for r in expected_rows) + 1
+        task.counters.clear()
+        task._ingest(conn, self.catalog, "t", max_query_len)
+        self.assertEqual(conn.statements, [sql_prefix + r for r in expected_rows])
+        self.assertEqual(conn.commits, 1)
+        self.assertEqual(task.counters["rows"], len(self.catalog))
+        self.assertEqual(task.counters["bytes"],
+                         sum(len(sql) for sql in conn.statements))
+        with self.assertRaises(RuntimeError):
+            task._ingest(RecordingConnection(), self.catalog, "t", len(sql_prefix))
+
+    def test_metrics(self):
+        """Test that ingest metrics are recorded."""
+        dir_name = tempfile.mkdtemp()
+        try:
+            config = IngestCatalogConfig()
+            config.block_size = 1
+            config.metrics_file = os.path.join(dir_name, "metrics.jsonl")
+            task = IngestCatalogTask(config=config)
+            conn = RecordingConnection()
+            for _ in range(2):
+                with task._recording_metrics("t", "source"):
+                    with task._recording_metrics("t"):
+                        task._ingest(conn, self.catalog, "t", 100000)
+            with open(config.metrics_file) as f:
+                records = [json.loads(line) for line in f]
+        finally:
+            shutil.rmtree(dir_name, ignore_errors=True)
+        # Nested recording contexts must not produce extra records.
+        self.assertEqual(len(records), 2)
+        for record in records:
+            self.assertEqual(record["source"], "source")
+            self.assertEqual(record["table"], "t")
+            self.assertEqual(record["ingest_mode"], "insert")
+            self.assertEqual(record["rows"], len(self.catalog))
+            self.assertEqual(record["statements"], 1)
+            self.assertEqual(record["bytes"], len(conn.statements[0]))
+            for phase in ("read", "ddl", "format", "execute", "commit"):
+                self.assertGreaterEqual(record[phase + "_time"], 0.0)
+            self.assertLessEqual(record["execute_time"], record["elapsed"])
+        self.assertEqual(task.metadata.get("ingest_rows"), len(self.catalog))
+        self.assertEqual(task.counters["statements"], 2)
+
+    def test_fits_stream(self):
+        """Test that streaming a FITS catalog matches reading it."""
+        try:
+            import astropy.io.fits
+        except ImportError:
+            self.skipTest("astropy is not available")
+        config = IngestCatalogConfig()
+        config.block_size = 1
+        task = IngestCatalogTask(config=config)
+        dir_name = tempfile.mkdtemp()
+        try:
+            file_name = os.path.join(dir_name, "catalog.fits")
+            self.catalog.writeFits(file_name)
+            stream = FitsCatalogStream(file_name)
+            self.assertEqual(len(stream), len(self.catalog))
+            items = list(task._schema_items(stream.schema))
+            catalog_items = list(task._schema_items(self.catalog.schema))
+            self.assertEqual([i.field.getName() for i in items],
+                             [i.field.getName() for i in catalog_items])
+            self.assertEqual(list(task._format_rows(stream)),
+                             list(task._format_rows(self.catalog)))
+        finally:
+            shutil.rmtree(dir_name, ignore_errors=True)
+
+    def test_fits_stream_single_element_arrays(self):
+        """Test streaming array fields with a single element."""
+        try:
+            import astropy.io.fits
+        except ImportError:
+            self.skipTest("astropy is not available")
+        schema = afw_table.Schema()
+        key_f = schema.addField("one.f", type="ArrayF", size=1)
+        key_d = schema.addField("one.d", type="ArrayD", size=1)
+        catalog = afw_table.BaseCatalog(schema)
+        for i in range(3):
+            record = catalog.addNew()
+            record.set(key_f, np.array([i + 0.5], dtype=np.float32))
+            record.set(key_d, np.array([-i * math.pi], dtype=np.float64))
+        config = IngestCatalogConfig()
+        config.block_size = 2
+        task = IngestCatalogTask(config=config)
+        dir_name = tempfile.mkdtemp()
+        try:
+            file_name = os.path.join(dir_name, "catalog.fits")
+            catalog.writeFits(file_name)
+            stream = FitsCatalogStream(file_name)
+            self.assertEqual(list(task._format_rows(stream)),
+                             list(task._format_rows(catalog)))
+        finally:
+            shutil.rmtree(dir_name, ignore_errors=True)
+
+    def test_catalog_batch(self):
+        """Test that a batch of catalogs is formatted as one catalog."""
+        task = IngestCatalogTask(config=IngestCatalogConfig())
+        rows = list(task._format_rows(self.catalog))
+        batch = CatalogBatch([self.catalog, lambda: self.catalog])
+        self.assertEqual(list(task._format_rows(batch)), rows + rows)
+        # Members with a different schema must be rejected.
+        schema = afw_table.Schema()
+        schema.addField("other", type="D")
+        other = afw_table.BaseCatalog(schema)
+        other.addNew()
+        batch = CatalogBatch([self.catalog, other])
+        with self.assertRaises(RuntimeError):
+            list(task._format_rows(batch))
+
+    def test_codec_cache(self):
+        """Test that codecs are shared between catalogs with equal schemas."""
+        task = IngestCatalogTask(config=IngestCatalogConfig())
+        codec = task._codec(self.catalog.schema)
+        copy = self.catalog.copy(deep=True)
+        other = IngestCatalogTask(config=IngestCatalogConfig())
+        self.assertIs(other._codec(copy.schema), codec)
+        self.assertEqual(
+            [i.field.getName() for i in codec.items],
+            [i.field.getName() for i in task._schema_items(copy.schema)])
+        # Configuration that changes column names must not share codecs.
+        config = IngestCatalogConfig()
+        config.remap = {"scalar.d": "renamed_d"}
+        remapped = IngestCatalogTask(config=config)._codec(copy.schema)
+        self.assertIsNot(remapped, codec)
+        self.assertIn("renamed_d", remapped.column_names)
+        # A schema with an extra field must get its own codec.
+        mapper = afw_table.SchemaMapper(self.catalog.schema)
+        mapper.addMinimalSchema(self.catalog.schema)
+        mapper.editOutputSchema().addField("extra_d", type="D")
+        self.assertIsNot(task._codec(mapper.getOutputSchema()), codec)
+
+    def test_ingest_many(self):
+        """Test ingestion of several catalogs in one session."""
+        if self.conn is None:
+            self.skipTest("Could not connect to database")
+        config = IngestCatalogConfig()
+        config.commit_interval = 2
+        task = IngestCatalogTask(config=config)
+        task.ingest_many([self.catalog] * 3, self.table_name, self.host,
+                         self.db, port=self.port, view_name=self.view_name)
+        with closing(self.conn.cursor()) as cursor:
+            cursor.execute("SELECT COUNT(*) FROM " + self.table_name)
+            self.assertEqual(cursor.fetchall()[0][0], 3 * len(self.catalog))
+
+    def test_deferred_indexes(self):
+        """Test that indexes can be built after loading."""
+        config = IngestCatalogConfig()
+        config.id_field_name = "scalar.l"
+        config.defer_indexes = True
+        config.extra_indexes = ["scalar.d", "scalar.f, scalar.i"]
+        config.validate()
+        task = IngestCatalogTask(config=config)
+        conn = RecordingConnection()
+        task._create_table(conn, "t", self.catalog.schema)
+        self.assertNotIn("UNIQUE", conn.statements[0])
+        config.allow_replace = True
+        with self.assertRaises(ValueError):
+            config.validate()
+        config.allow_replace = False
+        if self.conn is None:
+            self.skipTest("Could not connect to database")
+        # Ingest the catalog twice without building indexes: adding the
+        # unique index must then fail.
+        for _ in range(2):
+            task.ingest(self.catalog, self.table_name, self.host, self.db,
+                        port=self.port, build_indexes=False)
+        with self.assertRaises(RuntimeError):
+            task.build_indexes(self.table_name, self.host, self.db,
+                               port=self.port)
+        self.conn.query("DELETE FROM {} LIMIT 2".format(self.table_name))
+        self.conn.commit()
+        task.build_indexes(self.table_name, self.host, self.db, port=self.port)
+        with closing(self.conn.cursor()) as cursor:
+            cursor.execute("SHOW INDEX FROM " + self.table_name)
+            indexes = {}
+            for row in cursor.fetchall():
+                indexes.setdefault(row[2], []).append((row[3], row[4], row[1]))
+        self.assertEqual(
+            sorted(tuple(c for _, c, _ in sorted(v)) for v in indexes.values()),
+            [("scalar_d",), ("scalar_f", "scalar_i"), ("scalar_l",)])
+        unique = [k for k, v in indexes.items() if v[0][2] == 0]
+        self.assertEqual([tuple(c for _, c, _ in indexes[k]) for k in unique],
+                         [("scalar_l",)])
+        # Building indexes again must not add duplicate indexes.
+        task.build_indexes(self.table_name, self.host, self.db, port=self.port)
+        with closing(self.conn.cursor()) as cursor:
+            cursor.execute("SHOW INDEX FROM " + self.table_name)
+            self.assertEqual(len(cursor.fetchall()), 4)
+
+    def test_ingest_parallel(self):
+        """Test ingestion of a catalog over several connections."""
+        config = IngestCatalogConfig()
+        config.block_size = 1
+        config.num_connections = 3
+        config.max_queued_statements = 1
+        task = IngestCatalogTask(config=config)
+        max_query_len = 1000
+        expected = list(task._statements(self.catalog, "t", max_query_len))
+        conns = []
+
+        def connect(cls=RecordingConnection):
+            conns.append(cls())
+            return conns[-1]
+
+        task._ingest_parallel(connect, self.catalog, "t", max_query_len)
+        self.assertEqual(len(conns), 3)
+        self.assertEqual(sorted(sql for c in conns for sql in c.statements
+                                if sql.startswith("INSERT")),
+                         sorted(expected))
+        for c in conns:
+            xa = [sql.split()[1] for sql in c.statements
+                  if sql.startswith("XA")]
+            self.assertEqual(xa, ["START", "END", "PREPARE", "COMMIT"])
+        # If a single connection fails, every branch must be rolled back.
+        del conns[:]
+        with self.assertRaises(RuntimeError):
+            task._ingest_parallel(lambda: connect(FailingConnection),
+                                  self.catalog, "t", max_query_len)
+        for c in conns:
+            self.assertEqual(c.statements[-1].split()[:2], ["XA", "ROLLBACK"])
+            self.assertNotIn("PREPARE", " ".join(c.statements))
+
+    def test_ingest_in_worker(self):
+        """Test ingestion of a catalog by a process pool worker."""
+        config = IngestCatalogConfig()
+        config.block_size = 1
+        config.max_query_len = 100000
+        task = IngestCatalogTask(config=config)
+        data_ref = StubDataRef(dict(visit=1, ccd=2), self.catalog)
+        target = (data_ref, dict(dstype="src", table_name="t", host="h",
+                                 db="d", port=3306, user=None))
+        try:
+            conn = RecordingConnection()
+            _worker_state.update(task=task, conn=conn)
+            result = _ingest_in_worker(target)
+            self.assertIsNone(result["error"])
+            self.assertEqual(result["data_id"], str(data_ref.dataId))
+            self.assertEqual(result["pid"], os.getpid())
+            self.assertEqual(result["rows"], len(self.catalog))
+            self.assertEqual(result["bytes"],
+                             sum(len(sql) for sql in conn.statements))
+            self.assertGreaterEqual(result["time"], 0.0)
+            self.assertEqual((conn.commits, conn.rollbacks), (1, 0))
+            # Failures are reported in the result, after rolling back.
+            for cls in (FailingConnection, BrokenConnection):
+                conn = cls()
+                _worker_state.update(conn=conn)
+                result = _ingest_in_worker(target)
+                self.assertEqual(result["error"], "INSERT failed")
+                self.assertTrue(conn.statements[-1].startswith("INSERT"))
+                self.assertEqual((conn.commits, conn.rollbacks), (0, 1))
+        finally:
+            _worker_state.clear()
+
+    def test_log_summary(self):
+        """Test the summary logged after a process pool ingest."""
+        runner = IngestCatalogRunner.__new__(IngestCatalogRunner)
+        runner.log = RecordingLog()
+        results = [
+            dict(data_id="a", pid=2, rows=10, bytes=100, time=1.0, error=None),
+            dict(data_id="b", pid=1, rows=20, bytes=200, time=2.0, error=None),
+            dict(data_id="c", pid=2, rows=0, bytes=0, time=0.5, error="x"),
+        ]
+        runner._log_summary(results, 4.0)
+        self.assertEqual(runner.log.messages, [
+            "Ingested 30 rows (300 bytes) from 3 catalogs in 4.000 s: "
+            "7.5 rows/s, 75.0 bytes/s",
+            "Worker 1: 1 catalogs, 20 rows, 2.000 s busy, 50.0% utilization",
+            "Worker 2: 2 catalogs, 10 rows, 1.500 s busy, 37.5% utilization",
+        ])
+
+    def test_executemany_parameters(self):
+        """Test that parameters passed to executemany match SQL literals."""
+        config = IngestCatalogConfig()
+        config.ingest_mode = "executemany"
+        task = IngestCatalogTask(config=config)
+        conn = RecordingConnection()
+        encoder = object()
+        conn.encoders[float] = encoder
+        task._executemany(conn, self.catalog, "t", 1000)
+        self.assertEqual(conn.commits, 1)
+        # The connection's float encoder must be restored.
+        self.assertEqual(conn.encoders, {float: encoder})
+        self.assertEqual(len(conn.parameters), 1)
+        rows = conn.parameters[0]
+        self.assertEqual(len(rows), len(self.catalog))
+        items = list(task._schema_items(self.catalog.schema))
+        self.assertEqual(conn.statements[0].count("%s"), len(items))
+        formats = dict(F="{:.9g}", D="{:.17g}", Angle="{:.17g}")
+        for record, row in zip(self.catalog, rows):
+            for item, param in zip(items, row):
+                type_string = item.field.getTypeString()
+                value = record.get(item.key)
+                literal = field_formatters[type_string].format_value(value)
+                if type_string == "String":
+                    self.assertEqual(param, value)
+                elif type_string.startswith("Array"):
+                    self.assertEqual(
+                        "x'" + param.encode("hex_codec") + "'", literal)
+                elif param is None:
+                    self.assertEqual(literal, "NULL")
+                else:
+                    self.assertEqual(
+                        formats.get(type_string, "{}").format(param), literal)
+
+    def test_load_data_stream(self):
+        """Test the tab-separated stream sent by LOAD DATA LOCAL INFILE."""
+        config = IngestCatalogConfig()
+        config.ingest_mode = "load_data"
+        task = IngestCatalogTask(config=config)
+        conn = RecordingConnection()
+        task._load_data(conn, self.catalog, "t")
+        self.assertEqual(len(conn.statements), 1)
+        self.assertEqual(len(conn.streams), 1)
+        self.assertEqual(conn.commits, 1)
+        self.assertIn("fix_array_d = UNHEX(", conn.statements[0])
+        self.assertIn("scalar_flag = CAST(", conn.statements[0])
+        lines = conn.streams[0].split("\n")
+        self.assertEqual(lines[-1], "")
+        self.assertEqual(len(lines) - 1, len(self.catalog))
+        items = list(task._schema_items(self.catalog.schema))
+        for record, line in zip(self.catalog, lines):
+            fields = line.split("\t")
+            self.assertEqual(len(fields), len(items))
+            for item, field in zip(items, fields):
+                type_string = item.field.getTypeString()
+                value = record.get(item.key)
+                literal = field_formatters[type_string].format_value(value)
+                if type_string == "String":
+                    self.assertEqual(field, value)
+                elif type_string.startswith("Array"):
+                    self.assertEqual("x'" + field + "'", literal)
+                else:
+                    self.assertEqual(field, literal)
+
     def test_ingest(self):
         """Test the ingest task."""
+        self._test_ingest("insert")
+
+    def test_ingest_load_data(self):
+        """Test the ingest task using LOAD DATA LOCAL INFILE."""
+        self._test_ingest("load_data")
+
+    def test_ingest_executemany(self):
+        """Test the ingest task using a parameterized INSERT."""
+        self._test_ingest("executemany")
+
+    def _test_ingest(self, ingest_mode):
+        """Ingest the test catalog into a database, and check the results."""
         # Skip if no database connection available
         if self.conn is None:
             self.skipTest("Could not connect to database")
 
         # Run the catalog ingestion task.
         config = IngestCatalogConfig()
+        config.ingest_mode = ingest_mode
         config.extra_columns = "htmId20 BIGINT, otherColumn DOUBLE DEFAULT 2.0"
         config.max_query_len = 100000
         task = IngestCatalogTask(config=config)
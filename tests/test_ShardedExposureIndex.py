@@ -0,0 +1,140 @@
+#
+# LSST Data Management System
+#
+# Copyright 2016 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+"""Unit tests for sharded exposure indexes."""
+
+import unittest
+
+import math
+try:
+    import cPickle as pickle
+except:
+    import pickle
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+
+import lsst.utils.tests
+import lsst.sphgeom as sphgeom
+from lsst.daf.ingest.indexExposure import (
+    create_exposure_tables,
+    ExposureInfo,
+    find_intersecting_exposures,
+    store_exposure_info,
+)
+from lsst.daf.ingest.shardedExposureIndex import (
+    merge_exposure_indexes,
+    shard_paths,
+    ShardedExposureIndex,
+    store_exposure_info_sharded,
+)
+
+
+class ShardedExposureIndexTest(unittest.TestCase):
+    """Tests for :mod:`lsst.daf.ingest.shardedExposureIndex`."""
+
+    def setUp(self):
+        """Create exposures distributed uniformly at random over the sky."""
+        random.seed(31415926)
+        self.infos = []
+        for data_id in xrange(1000):
+            lon = random.uniform(0.0, 360.0)
+            lat = math.degrees(math.asin(random.uniform(-0.99, 0.99)))
+            corners = [
+                sphgeom.UnitVector3d(sphgeom.LonLat.fromDegrees(
+                    lon + dlon / math.cos(math.radians(lat)), lat + dlat))
+                for dlon, dlat in ((-1, -1), (1, -1), (1, 1), (-1, 1))
+            ]
+            poly = sphgeom.ConvexPolygon(corners)
+            self.infos.append(ExposureInfo(
+                pickle.dumps(dict(visit=data_id, filter="ugrizy"[data_id % 6])),
+                poly.encode()))
+        self.database = sqlite3.connect(":memory:")
+        create_exposure_tables(self.database)
+        store_exposure_info(self.database, False, self.infos)
+        self.directory = tempfile.mkdtemp()
+        self.regions = [sphgeom.Circle(sphgeom.UnitVector3d(
+                        sphgeom.LonLat.fromDegrees(lon, lat)),
+                        sphgeom.Angle.fromDegrees(5.0))
+                        for lon in range(0, 360, 30) for lat in (-60, 0, 60)]
+
+    def tearDown(self):
+        self.database.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def expected(self, constraints=None):
+        return [sorted(e.data_id["visit"] for e in find_intersecting_exposures(
+                self.database, r, constraints)) for r in self.regions]
+
+    def test_sky_shards(self):
+        """Test that sharded and single database queries agree."""
+        counts = store_exposure_info_sharded(
+            self.directory, False, self.infos, level=1, batch_size=100)
+        self.assertGreater(len(counts), 1)
+        self.assertEqual(sum(counts.values()), 1000)
+        self.assertEqual(sorted(counts), shard_paths(self.directory))
+        for num_threads in (1, 4):
+            with ShardedExposureIndex(self.directory, num_threads) as index:
+                for constraints in (None, dict(filter="r")):
+                    results = index.find_intersecting_exposures_many(
+                        self.regions, constraints)
+                    for e, r in zip(self.expected(constraints), results):
+                        self.assertEqual(
+                            sorted(i.data_id["visit"] for i in r), e)
+
+    def test_merge(self):
+        """Test merging per-worker shards into a single index."""
+        paths = [os.path.join(self.directory, "worker{}.sqlite3".format(i))
+                 for i in range(3)]
+        for i, path in enumerate(paths):
+            create_exposure_tables(path)
+            store_exposure_info(path, False, self.infos[i::3])
+        merged = os.path.join(self.directory, "merged.sqlite3")
+        self.assertEqual(merge_exposure_indexes(paths, merged), 1000)
+        conn = sqlite3.connect(merged)
+        try:
+            results = [sorted(e.data_id["visit"] for e in
+                              find_intersecting_exposures(conn, r))
+                       for r in self.regions]
+            self.assertEqual(results, self.expected())
+            with self.assertRaises(sqlite3.IntegrityError):
+                merge_exposure_indexes(paths[:1], conn)
+            self.assertEqual(merge_exposure_indexes(paths[:1], conn, True), 334)
+            self.assertEqual(conn.execute(
+                "SELECT COUNT(*) FROM exposure").fetchone()[0], 1000)
+        finally:
+            conn.close()
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()